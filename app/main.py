@@ -18,6 +18,9 @@ from slowapi.middleware import SlowAPIMiddleware
 from slowapi import _rate_limit_exceeded_handler
 
 from .settings import settings
+from .services.db import close_supabase
+from .services.llm import close_llm_client
+from .services.pdf import close_pdf_pool
 from .routers import upload, quiz, debug, library
 from .routers.classes import router as classes_router
 from .routers.documents import router as documents_router
@@ -44,6 +47,13 @@ app = FastAPI(title="StudyBuddy API", version="1.1.0")
 app.state.limiter = limiter
 
 
+@app.on_event("shutdown")
+def _close_clients() -> None:
+    close_supabase()
+    close_llm_client()
+    close_pdf_pool()
+
+
 # ---------- CORS ----------
 app.add_middleware(
     CORSMiddleware,
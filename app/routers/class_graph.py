@@ -38,7 +38,7 @@ def get_concept_map(class_id: str, request: Request):
 
     # Fetch edges (IMPORTANT: include label/evidence/confidence)
     edges_res = (
-        sb.table("concept_edges")
+        sb.table("concept_edges_bidirected")
         .select("from_concept_id, to_concept_id, type, label, weight, confidence, evidence")
         .eq("class_id", class_id)
         .execute()
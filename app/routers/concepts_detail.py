@@ -5,7 +5,7 @@ from pydantic import BaseModel
 
 from ..auth import user_id_from_auth_header
 from ..supabase import supabase
-from ..services.explain import generate_concept_enrichment, get_class_name, get_top_concepts
+from ..services.explain import generate_concept_enrichment, get_class_context
 
 router = APIRouter(prefix="/concepts", tags=["concepts"])
 
@@ -53,9 +53,10 @@ def get_concept_detail(
     class_id = concept["class_id"]
     _require_owner(class_id, user_id)
 
-    # Fetch edges connected to this concept
+    # Fetch edges connected to this concept (related edges are stored once
+    # per pair; the view lists them from both ends)
     edges_res = (
-        supabase.table("concept_edges")
+        supabase.table("concept_edges_bidirected")
         .select("id, from_concept_id, to_concept_id, type, label, weight, confidence, definition, example, application")
         .eq("class_id", class_id)
         .or_(f"from_concept_id.eq.{concept_id},to_concept_id.eq.{concept_id}")
@@ -149,13 +150,13 @@ async def generate_concept_detail(
     if not body.force and (concept.get("definition") or concept.get("example") or concept.get("application")):
         return {"ok": True, "concept_id": concept_id, "generated": False}
 
-    class_name = get_class_name(class_id)
-    top = get_top_concepts(class_id, limit=10)
+    ctx = get_class_context(class_id, limit=10)
 
     enrich = await generate_concept_enrichment(
         concept_name=concept.get("canonical_name") or "",
-        class_name=class_name,
-        top_context=top,
+        class_name=ctx["name"],
+        top_context=ctx["top"],
+        fresh=body.force,
     )
 
     supabase.table("concepts").update(
@@ -108,6 +108,7 @@ async def generate_edge_detail(
         to_name=names.get(edge["to_concept_id"], "Concept B"),
         relation_type=edge.get("type") or "related",
         class_name=class_name,
+        fresh=body.force,
     )
 
     supabase.table("concept_edges").update(
@@ -11,23 +11,28 @@ Goal:
 from __future__ import annotations
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional
 import json
 import asyncio
 from uuid import UUID
 
+import orjson
+
 from loguru import logger
 
 from ..auth import user_id_from_auth_header
-from ..services.pdf import extract_text_from_pdf
+from ..services.pdf import extract_text_from_pdf_async
 from ..services.intelligent_classifier import classify_and_recommend
 from ..services.knowledge_graph import extract_knowledge_graph
 from ..services.auto_study_materials import generate_all_materials
 from ..services.syllabus_processor import process_syllabus, get_this_weeks_tasks, generate_exam_prep_plan
 from ..services.concept_engine import update_class_graph
 from ..services.cache import sha256_bytes
-from ..services.llm import llm
+from ..services.llm import llm, prompt_shard
 from ..services.db import new_uuid, upload_pdf_to_storage, upsert_document
+from ..services.intelligent_pipeline import stream_flashcards
+from ..services.json_utils import safe_json_loads
 from ..supabase import supabase
 
 
@@ -78,8 +83,10 @@ async def _make_markdown_summary(text_content: str, word_target: int = 1600) ->
         return ""
 
     # Keep your original "study notes" style prompt, just add LaTeX rules
+    # Static (word targets live in the user message) so the provider's prompt
+    # cache can reuse the prefix across chunks and uploads
     system_prompt = (
-        f"Write detailed structured study notes in markdown (~{word_target} words). "
+        "Write detailed structured study notes in markdown. "
         "Use headings and subheadings, bullets, and clear spacing. "
         "Make it readable for studying.\n\n"
         "FORMATTING RULES (must follow):\n"
@@ -140,6 +147,7 @@ async def _make_markdown_summary(text_content: str, word_target: int = 1600) ->
             ],
             max_tokens=3200,
             temperature=0.2,
+            prompt_cache_key=prompt_shard("summary_chunk"),
         )
 
     parts = await asyncio.gather(*[summarize_chunk(c) for c in chunks])
@@ -159,13 +167,15 @@ async def _make_markdown_summary(text_content: str, word_target: int = 1600) ->
                         "- Keep the same style.\n"
                         "- Preserve details (do not over-compress).\n"
                         "- Remove duplicates.\n"
-                        "- Keep LaTeX math.\n\n"
+                        "- Keep LaTeX math.\n"
+                        f"- Overall length: ~{word_target} words.\n\n"
                         f"NOTES A:\n{a}\n\nNOTES B:\n{b}"
                     ),
                 },
             ],
             max_tokens=3800,
             temperature=0.15,
+            prompt_cache_key=prompt_shard("summary_merge"),
         )
 
     merged = parts
@@ -214,7 +224,7 @@ async def process_document_intelligent(
         raise HTTPException(status_code=400, detail="Only PDF supported")
 
     # 1) Extract text
-    text_content = extract_text_from_pdf(raw) or ""
+    text_content = await extract_text_from_pdf_async(raw) or ""
     if len(text_content.strip()) < 100:
         raise HTTPException(status_code=400, detail="Could not extract text from document")
 
@@ -344,7 +354,7 @@ async def process_document_intelligent(
 
     # 8) Update concept graph (your existing engine)
     try:
-        await update_class_graph(class_id=class_id, doc_id=doc_id, guide_json=guide_json)
+        await update_class_graph(class_id=class_id, doc_id=doc_id, guide_json=graph)
     except Exception as e:
         logger.warning(f"[graph] update_class_graph failed: {e}")
 
@@ -374,6 +384,42 @@ async def process_document_intelligent(
     }
 
 
+@router.post("/documents/{doc_id}/flashcards/stream")
+async def stream_document_flashcards(doc_id: str, max_cards: int = 30, user_id: str = Depends(user_id_from_auth_header)):
+    """Regenerate a document's flashcards from its guide, streamed as NDJSON
+    (one card per line, as soon as the model finishes it). The finished set
+    replaces documents.cards_json."""
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    doc_id = _as_uuid(doc_id)
+    res = supabase.table("documents").select("id, guide_json").eq("id", doc_id).eq("user_id", user_id).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    guide = safe_json_loads(res.data[0].get("guide_json") or "{}", default={})
+    units = guide.get("concepts") if isinstance(guide, dict) else None
+    if not units:
+        raise HTTPException(status_code=400, detail="Document has no study guide concepts")
+
+    max_cards = max(1, min(max_cards, 30))
+
+    async def body():
+        cards = []
+        async for card in stream_flashcards(units, max_cards=max_cards, fresh=True):
+            cards.append(card)
+            yield orjson.dumps(card) + b"\n"
+        if cards:
+            await asyncio.to_thread(
+                lambda: supabase.table("documents")
+                .update({"cards_json": orjson.dumps({"cards": cards}).decode()})
+                .eq("id", doc_id)
+                .execute()
+            )
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
 # -----------------------------
 # dashboard helpers (work only if syllabus_data table exists)
 # -----------------------------
@@ -270,7 +270,7 @@ async def upload(
                 await update_class_graph(
                     class_id=class_id,
                     doc_id=doc_id,
-                    guide_json=guide_json,
+                    guide_json=graph,
                 )
             except Exception as e:
                 logger.warning(f"[graph] update_class_graph failed: {e}")
@@ -1,5 +1,5 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field
 
 class Card(BaseModel):
     type: Optional[str] = "qa"
@@ -19,3 +19,179 @@ class MCQ(BaseModel):
 
 class QuizSet(BaseModel):
     questions: List[MCQ]
+
+
+# Structured LLM outputs (sent to the provider as strict json_schema, so
+# every field is required and extra keys are rejected)
+
+class ConceptOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    name: str
+    importance: Literal["core", "important", "advanced"]
+    difficulty: Literal["easy", "medium", "hard"]
+    prerequisites: List[str]
+
+class ConceptsOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    concepts: List[ConceptOut]
+
+class ConceptEnrichmentOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    definition: str
+    example: str
+    application: str
+
+class EdgeEnrichmentOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    label: str
+    definition: str
+    example: str
+    application: str
+
+class RouterOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    learning_model: Literal[
+        "quantitative",
+        "conceptual_science",
+        "humanities_writing",
+        "historical_timeline",
+        "applied_case",
+    ]
+    confidence: float
+    reason: str
+    mapped_subject_area: Literal["stem", "humanities", "social_science", "business", "other"]
+
+class FlashcardOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    type: Literal["definition", "qa", "concept", "procedure", "application"]
+    front: str
+    back: str
+
+class FlashcardsOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    cards: List[FlashcardOut]
+
+class ContentCharacteristics(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    has_formulas: bool
+    has_code: bool
+    has_dates: bool
+    has_analysis: bool
+    has_arguments: bool
+    has_problems: bool
+    language_heavy: bool
+
+class Classification(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    document_type: Literal[
+        "syllabus",
+        "lecture_notes",
+        "textbook_chapter",
+        "reading_material",
+        "assignment",
+        "exam_study_guide",
+    ]
+    subject_area: Literal["stem", "humanities", "social_science", "arts", "business", "other"]
+    specific_subject: str
+    course_level: Literal["introductory", "intermediate", "advanced", "graduate"]
+    teaching_focus: Literal["theoretical", "practical", "applied", "mixed"]
+    content_characteristics: ContentCharacteristics
+    recommended_study_methods: List[str]
+    confidence: float
+
+# What classify_document asks the model for; the rest of Classification is
+# derived from the text.
+class ClassificationCore(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    document_type: Literal[
+        "syllabus",
+        "lecture_notes",
+        "textbook_chapter",
+        "reading_material",
+        "assignment",
+        "exam_study_guide",
+    ]
+    subject_area: Literal["stem", "humanities", "social_science", "arts", "business", "other"]
+    confidence: float
+
+class ClassifyAndRouteOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    classification: Classification
+    routing: RouterOut
+
+class GuideConceptOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    id: str
+    name: str
+    importance: Literal["core", "important", "advanced"]
+    difficulty: Literal["easy", "medium", "hard"]
+    prerequisites: List[str]
+    simple: str
+    detailed: str
+    technical: str
+    example: str
+    common_mistake: str
+
+class StudyGuideOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    chapter_title: str
+    estimated_study_minutes: int
+    concepts: List[GuideConceptOut]
+
+class UnitSignalsOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    why_matters: str
+    likely_assessed: bool
+
+class UnitOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    name: str
+    unit_type: str
+    importance: Literal["core", "important", "advanced"]
+    difficulty: Literal["easy", "medium", "hard"]
+    simple: str
+    detailed: str
+    technical: str
+    example: str
+    common_mistake: str
+    signals: UnitSignalsOut
+
+class UnitEdgeOut(BaseModel):
+    model_config = ConfigDict(extra="forbid", populate_by_name=True)
+    from_: str = Field(alias="from")
+    to: str
+    type: Literal["prereq", "related", "part_of", "example_of", "causes"]
+
+class UnitsOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    units: List[UnitOut]
+    edges: List[UnitEdgeOut]
+    rejects: List[str]
+    coverage_notes: str
+
+# Shape checks for free-form LLM JSON (prompted, not sent as json_schema):
+# containers must have the right types so callers can .get() into them;
+# extra keys pass through and missing/null ones are fine.
+class SyllabusShape(BaseModel):
+    course_info: Optional[Dict[str, Any]] = None
+    schedule: Optional[List[Dict[str, Any]]] = None
+    assessments: Optional[List[Dict[str, Any]]] = None
+    grading_breakdown: Optional[Dict[str, Any]] = None
+    learning_objectives: Optional[List[Any]] = None
+    important_dates: Optional[List[Dict[str, Any]]] = None
+
+class SyllabusWithSummaryShape(SyllabusShape):
+    summary_markdown: Optional[str] = None
+
+class StemExtractionShape(BaseModel):
+    concepts: Optional[List[Dict[str, Any]]] = None
+    practice_problems: Optional[List[Dict[str, Any]]] = None
+
+class HumanitiesExtractionShape(BaseModel):
+    concepts: Optional[List[Dict[str, Any]]] = None
+    key_arguments: Optional[List[Dict[str, Any]]] = None
+    timeline_events: Optional[List[Dict[str, Any]]] = None
+
+class SocialScienceExtractionShape(BaseModel):
+    concepts: Optional[List[Dict[str, Any]]] = None
+    studies: Optional[List[Dict[str, Any]]] = None
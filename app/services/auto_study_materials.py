@@ -6,8 +6,34 @@ Creates flashcards, quizzes, and study guides adapted to subject type
 
 import json
 from typing import Dict, List
-from .llm import llm
+from loguru import logger
+from .llm import llm, DETERMINISTIC_SEED
 from .json_utils import safe_json_loads
+from .tokens import join_within_budget
+
+
+# Prompt budgets (tokens) for the concept context fed into each generator
+FLASHCARD_CONTEXT_TOKENS = 1200
+QUIZ_CONTEXT_TOKENS = 800
+GUIDE_CONTEXT_TOKENS = 1200
+
+# Per-generator time limits (seconds) in generate_all_materials
+FLASHCARDS_TIMEOUT_S = 20
+QUIZ_TIMEOUT_S = 20
+GUIDE_TIMEOUT_S = 15
+
+
+def _dedupe_concepts(concepts: List[Dict]) -> List[Dict]:
+    """Drop nameless concepts and repeats of the same name (case/whitespace-insensitive)."""
+    seen = set()
+    out = []
+    for c in concepts or []:
+        key = (c.get("name") or "").strip().lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        out.append(c)
+    return out
 
 
 # ============== Flashcard Generation ==============
@@ -35,15 +61,7 @@ async def generate_flashcards(concepts: List[Dict], subject_area: str) -> List[D
         return await _generate_general_flashcards(concepts)
 
 
-async def _generate_stem_flashcards(concepts: List[Dict]) -> List[Dict]:
-    """STEM flashcards: Focus on formulas, definitions, problem-solving"""
-    
-    concept_summary = "\n\n".join([
-        f"**{c['name']}**\n{c.get('definition', '')}\nFormula: {c.get('subject_specific_data', {}).get('formula', 'N/A')}"
-        for c in concepts[:10]  # Limit to 10 concepts
-    ])
-    
-    prompt = f"""
+_STEM_FLASHCARD_TMPL = """
 Create flashcards for STEM concepts. For each concept, create 2-3 cards:
 1. Definition card (What is X?)
 2. Formula/Application card (How do you use X?)
@@ -67,6 +85,21 @@ Return ONLY valid JSON:
 
 Make cards concise but complete. Include examples where helpful.
 """
+
+
+async def _generate_stem_flashcards(concepts: List[Dict]) -> List[Dict]:
+    """STEM flashcards: Focus on formulas, definitions, problem-solving"""
+    
+    concept_summary = join_within_budget(
+        (
+            f"**{c['name']}**\n{c.get('definition', '')}\nFormula: {c.get('subject_specific_data', {}).get('formula', 'N/A')}"
+            for c in concepts
+        ),
+        "\n\n",
+        FLASHCARD_CONTEXT_TOKENS,
+    )
+    
+    prompt = _STEM_FLASHCARD_TMPL.format(concept_summary=concept_summary)
     
     try:
         response = await llm([
@@ -94,15 +127,7 @@ Make cards concise but complete. Include examples where helpful.
             return []
 
 
-async def _generate_humanities_flashcards(concepts: List[Dict]) -> List[Dict]:
-    """Humanities flashcards: Focus on themes, context, significance"""
-    
-    concept_summary = "\n\n".join([
-        f"**{c['name']}**\n{c.get('definition', '')}\nSignificance: {c.get('subject_specific_data', {}).get('significance', '')}"
-        for c in concepts[:10]
-    ])
-    
-    prompt = f"""
+_HUMANITIES_FLASHCARD_TMPL = """
 Create flashcards for humanities concepts. For each concept, create 2-3 cards:
 1. Meaning card (What is this theme/event?)
 2. Context card (When/where/why did this occur?)
@@ -127,12 +152,27 @@ Return ONLY valid JSON:
 
 Include specific examples and encourage deeper thinking.
 """
+
+
+async def _generate_humanities_flashcards(concepts: List[Dict]) -> List[Dict]:
+    """Humanities flashcards: Focus on themes, context, significance"""
+    
+    concept_summary = join_within_budget(
+        (
+            f"**{c['name']}**\n{c.get('definition', '')}\nSignificance: {c.get('subject_specific_data', {}).get('significance', '')}"
+            for c in concepts
+        ),
+        "\n\n",
+        FLASHCARD_CONTEXT_TOKENS,
+    )
+    
+    prompt = _HUMANITIES_FLASHCARD_TMPL.format(concept_summary=concept_summary)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective study flashcards."},
             {"role": "user", "content": prompt}
-        ], max_tokens=1500, temperature=0.3)
+        ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
         
         result = safe_json_loads(response, default={"flashcards": []})
         cards = result.get("flashcards", []) if isinstance(result, dict) else []
@@ -142,7 +182,7 @@ Include specific examples and encourage deeper thinking.
             response2 = await llm([
                 {"role": "system", "content": "You create effective study flashcards. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=1500, temperature=0.3)
+            ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
             result2 = safe_json_loads(response2, default={"flashcards": []})
             cards2 = result2.get("flashcards", []) if isinstance(result2, dict) else []
             return cards2 if isinstance(cards2, list) else []
@@ -150,15 +190,7 @@ Include specific examples and encourage deeper thinking.
             return []
 
 
-async def _generate_general_flashcards(concepts: List[Dict]) -> List[Dict]:
-    """General flashcards for any subject"""
-    
-    concept_summary = "\n\n".join([
-        f"**{c['name']}**\n{c.get('definition', '')}\nExample: {c.get('example', '')}"
-        for c in concepts[:10]
-    ])
-    
-    prompt = f"""
+_GENERAL_FLASHCARD_TMPL = """
 Create flashcards for these concepts:
 
 {concept_summary}
@@ -176,12 +208,27 @@ Return ONLY valid JSON:
   ]
 }}
 """
+
+
+async def _generate_general_flashcards(concepts: List[Dict]) -> List[Dict]:
+    """General flashcards for any subject"""
+    
+    concept_summary = join_within_budget(
+        (
+            f"**{c['name']}**\n{c.get('definition', '')}\nExample: {c.get('example', '')}"
+            for c in concepts
+        ),
+        "\n\n",
+        FLASHCARD_CONTEXT_TOKENS,
+    )
+    
+    prompt = _GENERAL_FLASHCARD_TMPL.format(concept_summary=concept_summary)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective study flashcards."},
             {"role": "user", "content": prompt}
-        ], max_tokens=1000, temperature=0.3)
+        ], max_tokens=1000, temperature=0.0, seed=DETERMINISTIC_SEED)
         
         result = safe_json_loads(response, default={"flashcards": []})
         cards = result.get("flashcards", []) if isinstance(result, dict) else []
@@ -191,7 +238,7 @@ Return ONLY valid JSON:
             response2 = await llm([
                 {"role": "system", "content": "You create effective study flashcards. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=1000, temperature=0.3)
+            ], max_tokens=1000, temperature=0.0, seed=DETERMINISTIC_SEED)
             result2 = safe_json_loads(response2, default={"flashcards": []})
             cards2 = result2.get("flashcards", []) if isinstance(result2, dict) else []
             return cards2 if isinstance(cards2, list) else []
@@ -225,12 +272,7 @@ async def generate_quiz(concepts: List[Dict], subject_area: str, difficulty: str
         return await _generate_general_quiz(concepts, difficulty)
 
 
-async def _generate_stem_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
-    """STEM quizzes: Problem-solving, calculations, conceptual"""
-    
-    concept_summary = "\n".join([f"- {c['name']}: {c.get('definition', '')[:200]}" for c in concepts[:8]])
-    
-    prompt = f"""
+_STEM_QUIZ_TMPL = """
 Create a STEM quiz with these question types:
 1. Problem-solving (given values, calculate result)
 2. Conceptual (why does this work?)
@@ -259,12 +301,24 @@ Return ONLY valid JSON:
 
 Create 5-8 questions. Mix question types.
 """
+
+
+async def _generate_stem_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
+    """STEM quizzes: Problem-solving, calculations, conceptual"""
+    
+    concept_summary = join_within_budget(
+        (f"- {c['name']}: {c.get('definition', '')[:200]}" for c in concepts),
+        "\n",
+        QUIZ_CONTEXT_TOKENS,
+    )
+    
+    prompt = _STEM_QUIZ_TMPL.format(concept_summary=concept_summary, difficulty=difficulty)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective quiz questions."},
             {"role": "user", "content": prompt}
-        ], max_tokens=2000, temperature=0.3)
+        ], max_tokens=2000, temperature=0.0, seed=DETERMINISTIC_SEED)
         
         result = safe_json_loads(response, default={"questions": []})
         qs = result.get("questions", []) if isinstance(result, dict) else []
@@ -274,7 +328,7 @@ Create 5-8 questions. Mix question types.
             response2 = await llm([
                 {"role": "system", "content": "You create effective quiz questions. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=2000, temperature=0.3)
+            ], max_tokens=2000, temperature=0.0, seed=DETERMINISTIC_SEED)
             result2 = safe_json_loads(response2, default={"questions": []})
             qs2 = result2.get("questions", []) if isinstance(result2, dict) else []
             return qs2 if isinstance(qs2, list) else []
@@ -282,12 +336,7 @@ Create 5-8 questions. Mix question types.
             return []
 
 
-async def _generate_humanities_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
-    """Humanities quizzes: Analysis, interpretation, argumentation"""
-    
-    concept_summary = "\n".join([f"- {c['name']}: {c.get('definition', '')[:200]}" for c in concepts[:8]])
-    
-    prompt = f"""
+_HUMANITIES_QUIZ_TMPL = """
 Create a humanities quiz with these question types:
 1. Analysis (analyze the significance of...)
 2. Comparison (compare and contrast...)
@@ -316,12 +365,24 @@ Return ONLY valid JSON:
 
 Create 5-8 questions. Encourage critical thinking.
 """
+
+
+async def _generate_humanities_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
+    """Humanities quizzes: Analysis, interpretation, argumentation"""
+    
+    concept_summary = join_within_budget(
+        (f"- {c['name']}: {c.get('definition', '')[:200]}" for c in concepts),
+        "\n",
+        QUIZ_CONTEXT_TOKENS,
+    )
+    
+    prompt = _HUMANITIES_QUIZ_TMPL.format(concept_summary=concept_summary, difficulty=difficulty)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective quiz questions."},
             {"role": "user", "content": prompt}
-        ], max_tokens=2000, temperature=0.3)
+        ], max_tokens=2000, temperature=0.0, seed=DETERMINISTIC_SEED)
         
         result = safe_json_loads(response, default={"questions": []})
         qs = result.get("questions", []) if isinstance(result, dict) else []
@@ -331,7 +392,7 @@ Create 5-8 questions. Encourage critical thinking.
             response2 = await llm([
                 {"role": "system", "content": "You create effective quiz questions. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=2000, temperature=0.3)
+            ], max_tokens=2000, temperature=0.0, seed=DETERMINISTIC_SEED)
             result2 = safe_json_loads(response2, default={"questions": []})
             qs2 = result2.get("questions", []) if isinstance(result2, dict) else []
             return qs2 if isinstance(qs2, list) else []
@@ -339,12 +400,7 @@ Create 5-8 questions. Encourage critical thinking.
             return []
 
 
-async def _generate_general_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
-    """General quiz questions"""
-    
-    concept_summary = "\n".join([f"- {c['name']}: {c.get('definition', '')[:150]}" for c in concepts[:8]])
-    
-    prompt = f"""
+_GENERAL_QUIZ_TMPL = """
 Create quiz questions for these concepts:
 
 {concept_summary}
@@ -368,12 +424,24 @@ Return ONLY valid JSON:
 
 Create 5-7 questions.
 """
+
+
+async def _generate_general_quiz(concepts: List[Dict], difficulty: str) -> List[Dict]:
+    """General quiz questions"""
+    
+    concept_summary = join_within_budget(
+        (f"- {c['name']}: {c.get('definition', '')[:150]}" for c in concepts),
+        "\n",
+        QUIZ_CONTEXT_TOKENS,
+    )
+    
+    prompt = _GENERAL_QUIZ_TMPL.format(concept_summary=concept_summary, difficulty=difficulty)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective quiz questions."},
             {"role": "user", "content": prompt}
-        ], max_tokens=1500, temperature=0.3)
+        ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
         
         result = safe_json_loads(response, default={"questions": []})
         qs = result.get("questions", []) if isinstance(result, dict) else []
@@ -383,7 +451,7 @@ Create 5-7 questions.
             response2 = await llm([
                 {"role": "system", "content": "You create effective quiz questions. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=1500, temperature=0.3)
+            ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
             result2 = safe_json_loads(response2, default={"questions": []})
             qs2 = result2.get("questions", []) if isinstance(result2, dict) else []
             return qs2 if isinstance(qs2, list) else []
@@ -393,23 +461,10 @@ Create 5-7 questions.
 
 # ============== Study Guide Generation ==============
 
-async def generate_study_guide(concepts: List[Dict], subject_area: str) -> Dict:
-    """
-    Generate comprehensive study guide
-    
-    Returns:
-        Study guide with organized sections
-    """
-    
-    concept_text = "\n\n".join([
-        f"**{c['name']}**\n{c.get('definition', '')}\nExample: {c.get('example', '')}"
-        for c in concepts
-    ])
-    
-    prompt = f"""
+_STUDY_GUIDE_TMPL = """
 Create a comprehensive study guide for these concepts:
 
-{concept_text[:3000]}
+{concept_text}
 
 Subject area: {subject_area}
 
@@ -437,12 +492,32 @@ Return ONLY valid JSON:
   "practice_prompts": ["Test yourself: ..."]
 }}
 """
+
+
+async def generate_study_guide(concepts: List[Dict], subject_area: str) -> Dict:
+    """
+    Generate comprehensive study guide
+    
+    Returns:
+        Study guide with organized sections
+    """
+    
+    concept_text = join_within_budget(
+        (
+            f"**{c['name']}**\n{c.get('definition', '')}\nExample: {c.get('example', '')}"
+            for c in concepts
+        ),
+        "\n\n",
+        GUIDE_CONTEXT_TOKENS,
+    )
+    
+    prompt = _STUDY_GUIDE_TMPL.format(concept_text=concept_text, subject_area=subject_area)
     
     try:
         response = await llm([
             {"role": "system", "content": "You create effective study guides."},
             {"role": "user", "content": prompt}
-        ], max_tokens=1500, temperature=0.3)
+        ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
 
         data = safe_json_loads(response, default={"title": "Study Guide", "overview": "", "key_concepts": []})
         return data if isinstance(data, dict) else {"title": "Study Guide", "overview": "", "key_concepts": []}
@@ -451,7 +526,7 @@ Return ONLY valid JSON:
             response2 = await llm([
                 {"role": "system", "content": "You create effective study guides. Return raw JSON only."},
                 {"role": "user", "content": prompt + "\n\nIMPORTANT: Output raw JSON only."},
-            ], max_tokens=1500, temperature=0.3)
+            ], max_tokens=1500, temperature=0.0, seed=DETERMINISTIC_SEED)
             data2 = safe_json_loads(response2, default={"title": "Study Guide", "overview": "", "key_concepts": []})
             return data2 if isinstance(data2, dict) else {"title": "Study Guide", "overview": "", "key_concepts": []}
         except Exception:
@@ -476,10 +551,17 @@ async def generate_all_materials(concepts: List[Dict], subject_area: str) -> Dic
     import asyncio
     from datetime import datetime
     
-    # Generate all materials concurrently
-    flashcards_task = generate_flashcards(concepts, subject_area)
-    quiz_task = generate_quiz(concepts, subject_area, "medium")
-    guide_task = generate_study_guide(concepts, subject_area)
+    unique = _dedupe_concepts(concepts)
+    if len(unique) != len(concepts):
+        logger.info(f"[materials] deduped concepts {len(concepts)} -> {len(unique)}")
+    concepts = unique
+
+    # Generate all materials concurrently. Each generator gets its own time
+    # limit so one stalled provider call can't hold up the others; a failed or
+    # timed-out generator just contributes an empty result.
+    flashcards_task = asyncio.wait_for(generate_flashcards(concepts, subject_area), FLASHCARDS_TIMEOUT_S)
+    quiz_task = asyncio.wait_for(generate_quiz(concepts, subject_area, "medium"), QUIZ_TIMEOUT_S)
+    guide_task = asyncio.wait_for(generate_study_guide(concepts, subject_area), GUIDE_TIMEOUT_S)
     
     flashcards, quiz, guide = await asyncio.gather(
         flashcards_task,
@@ -489,11 +571,14 @@ async def generate_all_materials(concepts: List[Dict], subject_area: str) -> Dic
     )
     
     # Handle any errors
-    if isinstance(flashcards, Exception):
+    if isinstance(flashcards, BaseException):
+        logger.warning(f"[materials] flashcards failed: {flashcards!r}")
         flashcards = []
-    if isinstance(quiz, Exception):
+    if isinstance(quiz, BaseException):
+        logger.warning(f"[materials] quiz failed: {quiz!r}")
         quiz = []
-    if isinstance(guide, Exception):
+    if isinstance(guide, BaseException):
+        logger.warning(f"[materials] study guide failed: {guide!r}")
         guide = {}
     
     return {
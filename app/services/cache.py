@@ -1,10 +1,14 @@
 from pathlib import Path
-import json, hashlib
+import json, hashlib, time
 from typing import Optional
 
 ROOT_DIR = Path(__file__).resolve().parents[2]
 CACHE_DIR = ROOT_DIR / "cache"
 CACHE_DIR.mkdir(exist_ok=True)
+LLM_CACHE_DIR = CACHE_DIR / "llm"
+LLM_CACHE_DIR.mkdir(exist_ok=True)
+RESULT_CACHE_DIR = CACHE_DIR / "results"
+RESULT_CACHE_DIR.mkdir(exist_ok=True)
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
@@ -37,3 +41,34 @@ def read_quiz(doc_id: str) -> Optional[dict]:
 
 def save_quiz(doc_id: str, payload: dict):
     _write_json(CACHE_DIR / f"{doc_id}.quiz.json", payload)
+
+def read_llm_response(key: str, ttl_seconds: Optional[float]) -> Optional[str]:
+    """Cached response for key, or None if missing or older than ttl_seconds
+    (ttl_seconds=None: never expires)."""
+    p = LLM_CACHE_DIR / f"{key}.json"
+    try:
+        if ttl_seconds is not None and time.time() - p.stat().st_mtime > ttl_seconds:
+            return None
+        return _read_json(p).get("response")
+    except (OSError, ValueError):
+        # missing, or a half-written file from a concurrent save
+        return None
+
+def save_llm_response(key: str, response: str):
+    _write_json(LLM_CACHE_DIR / f"{key}.json", {"response": response})
+
+def read_result(namespace: str, key: str, ttl_seconds: Optional[float]):
+    """Cached value for (namespace, key), or None if missing or older than
+    ttl_seconds (ttl_seconds=None: never expires)."""
+    p = RESULT_CACHE_DIR / namespace / f"{key}.json"
+    try:
+        if ttl_seconds is not None and time.time() - p.stat().st_mtime > ttl_seconds:
+            return None
+        return _read_json(p).get("value")
+    except (OSError, ValueError):
+        return None
+
+def save_result(namespace: str, key: str, value):
+    d = RESULT_CACHE_DIR / namespace
+    d.mkdir(exist_ok=True)
+    _write_json(d / f"{key}.json", {"value": value})
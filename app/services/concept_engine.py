@@ -1,27 +1,51 @@
 # app/services/concept_engine.py
 from __future__ import annotations
 
+import asyncio
 import json
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from loguru import logger
 
 from ..supabase import supabase
 from .db import new_uuid
-from .llm import llm
+from .llm import llm, DETERMINISTIC_SEED
 from .json_utils import safe_json_loads
-from .graph_intelligence import reinforce_graph_after_upload
+from .graph_intelligence import reinforce_graph_after_upload, upsert_edges_batch
 
 
 def _now() -> str:
     return datetime.utcnow().isoformat()
 
 
+# Strong refs to in-flight post-processing tasks (the loop only keeps weak ones)
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(aw: Awaitable, *, label: str) -> None:
+    """Run aw in the background, logging (not raising) a failure."""
+    task = asyncio.ensure_future(aw)
+    _background_tasks.add(task)
+
+    def _done(t: asyncio.Task) -> None:
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning(f"[graph] {label} failed: {t.exception()}")
+
+    task.add_done_callback(_done)
+
+
 def _safe_data(res):
     if res is None:
         return None
     return getattr(res, "data", None)
 
 
+# Guide importance labels -> sort rank for capping co-occurrence pairs
+_IMPORTANCE_RANK = {"core": 3.0, "important": 2.0, "advanced": 1.0}
+
+
 RELATION_PROMPT = """
 You are building a structured knowledge graph for a university course.
 
@@ -60,7 +84,8 @@ async def extract_relationships(concept_names: List[str]) -> List[Dict]:
             {"role": "user", "content": f"Concept list:\n{content}"},
         ],
         max_tokens=1500,
-        temperature=0.2,
+        temperature=0.0,
+        seed=DETERMINISTIC_SEED,
     )
 
     try:
@@ -78,7 +103,8 @@ async def extract_relationships(concept_names: List[str]) -> List[Dict]:
                     {"role": "user", "content": f"Return ONLY JSON.\n\nConcept list:\n{content}"},
                 ],
                 max_tokens=1500,
-                temperature=0.2,
+                temperature=0.0,
+                seed=DETERMINISTIC_SEED,
             )
             parsed2 = safe_json_loads(response2, default={"edges": []})
             edges2 = parsed2.get("edges", []) if isinstance(parsed2, dict) else []
@@ -87,7 +113,54 @@ async def extract_relationships(concept_names: List[str]) -> List[Dict]:
             return []
 
 
-async def update_class_graph(*, class_id: str, doc_id: str, guide_json: str) -> None:
+def _upsert_concept_node(*, class_id: str, name: str, now: str) -> str:
+    """Find the class concept by name (case-insensitive) and bump its
+    document_frequency, or insert it. Returns the concept id."""
+    res = (
+        supabase.table("concepts")
+        .select("id, document_frequency")
+        .eq("class_id", class_id)
+        .ilike("canonical_name", name)
+        .maybe_single()
+        .execute()
+    )
+    existing = _safe_data(res)
+
+    if existing:
+        cid = existing["id"]
+        df = existing.get("document_frequency")
+        try:
+            df = int(df) if df is not None else 0
+        except Exception:
+            df = 0
+
+        supabase.table("concepts").update(
+            {"document_frequency": df + 1, "updated_at": now}
+        ).eq("id", cid).execute()
+        return cid
+
+    cid = new_uuid()
+    supabase.table("concepts").insert(
+        {
+            "id": cid,
+            "class_id": class_id,
+            "canonical_name": name,
+            "document_frequency": 1,
+            "importance_score": 0.1,
+            "created_at": now,
+            "updated_at": now,
+            "merged_into": None,
+        }
+    ).execute()
+    return cid
+
+
+def _insert_mentions(rows: List[Dict]) -> None:
+    if rows:
+        supabase.table("concept_doc_mentions").insert(rows).execute()
+
+
+async def update_class_graph(*, class_id: str, doc_id: str, guide_json: str | Dict) -> None:
     """
     1) Upsert concept nodes into concepts table
     2) Store a mention row (doc -> concept)
@@ -96,12 +169,17 @@ async def update_class_graph(*, class_id: str, doc_id: str, guide_json: str) ->
        - reinforce co-occurrence (related)
        - prune weak edges
        - recalc importance (centrality)
+
+    guide_json may be the stored string or the already-built dict.
     """
 
     if not class_id or not doc_id:
         return
 
-    parsed = safe_json_loads(guide_json or "{}", default={})
+    # One timestamp for the whole batch; rows written together share updated_at.
+    now = _now()
+
+    parsed = guide_json if isinstance(guide_json, dict) else safe_json_loads(guide_json or "{}", default={})
     if not isinstance(parsed, dict):
         return
 
@@ -109,79 +187,61 @@ async def update_class_graph(*, class_id: str, doc_id: str, guide_json: str) ->
     if not isinstance(concepts, list) or not concepts:
         return
 
-    # If guide_json already contains edges (preferred), we'll use them.
+    # guide_json producers emit edges alongside concepts; extract_relationships
+    # is only a safety net for older documents / extractor outputs without them.
     precomputed_edges = parsed.get("edges", []) if isinstance(parsed, dict) else []
 
     # ------------- Upsert Concepts -------------
-    concept_ids: List[str] = []
-    name_to_id: Dict[str, str] = {}
-
+    names: List[str] = []
+    levels: List[float] = []
+    seen_names = set()
     for c in concepts:
+        if not isinstance(c, dict):
+            continue
         name = (c.get("name") or "").strip()
-        if not name:
+        if not name or name.lower() in seen_names:
             continue
+        seen_names.add(name.lower())
+        names.append(name)
+        levels.append(_IMPORTANCE_RANK.get(str(c.get("importance") or "").lower(), 0.0))
 
-        # Try to find existing concept in class (case-insensitive)
-        res = (
-            supabase.table("concepts")
-            .select("id, document_frequency")
-            .eq("class_id", class_id)
-            .ilike("canonical_name", name)
-            .maybe_single()
-            .execute()
-        )
-        existing = _safe_data(res)
-
-        if existing:
-            cid = existing["id"]
-            df = existing.get("document_frequency")
-            try:
-                df = int(df) if df is not None else 0
-            except Exception:
-                df = 0
-
-            supabase.table("concepts").update(
-                {"document_frequency": df + 1, "updated_at": _now()}
-            ).eq("id", cid).execute()
-        else:
-            cid = new_uuid()
-            supabase.table("concepts").insert(
-                {
-                    "id": cid,
-                    "class_id": class_id,
-                    "canonical_name": name,
-                    "document_frequency": 1,
-                    "importance_score": 0.1,
-                    "created_at": _now(),
-                    "updated_at": _now(),
-                    "merged_into": None,
-                }
-            ).execute()
-
-        concept_ids.append(cid)
-        name_to_id[name.strip().lower()] = cid
-
-        # Mention row: keep it minimal to match your schema (avoid missing columns)
-        supabase.table("concept_doc_mentions").insert(
-            {
-                "id": new_uuid(),
-                "class_id": class_id,
-                "concept_id": cid,
-                "document_id": doc_id,
-                "created_at": _now(),
-                "updated_at": _now(),
-            }
-        ).execute()
-
-    if not concept_ids:
+    if not names:
         return
 
-    # ------------- AI relationship edges -------------
-    concept_names = [((c.get("name") or "").strip()) for c in concepts if (c.get("name") or "").strip()]
-    edges = precomputed_edges if isinstance(precomputed_edges, list) and precomputed_edges else await extract_relationships(concept_names)
+    # The supabase client is sync: run the per-concept upserts on worker
+    # threads so they overlap each other (and the relationship LLM call, when
+    # the guide has no edges) instead of blocking the event loop one by one.
+    need_edges = not (isinstance(precomputed_edges, list) and precomputed_edges)
+    node_calls = [
+        asyncio.to_thread(_upsert_concept_node, class_id=class_id, name=name, now=now)
+        for name in names
+    ]
+    if need_edges:
+        *concept_ids, edges = await asyncio.gather(*node_calls, extract_relationships(names))
+    else:
+        concept_ids = list(await asyncio.gather(*node_calls))
+        edges = precomputed_edges
+
+    name_to_id: Dict[str, str] = {name.lower(): cid for name, cid in zip(names, concept_ids)}
+
+    # Mention row: keep it minimal to match your schema (avoid missing columns)
+    mention_rows = [
+        {
+            "id": new_uuid(),
+            "class_id": class_id,
+            "concept_id": cid,
+            "document_id": doc_id,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for cid in concept_ids
+    ]
 
+    # ------------- AI relationship edges -------------
     allowed_types = {"prereq", "related", "part_of", "example_of", "causes"}
 
+    # Resolve names -> ids first, then write every edge in one batched upsert
+    edge_deltas: Dict[Tuple[str, str, str], int] = {}
     for e in edges:
         from_name = (e.get("from") or "").strip().lower()
         to_name = (e.get("to") or "").strip().lower()
@@ -199,37 +259,33 @@ async def update_class_graph(*, class_id: str, doc_id: str, guide_json: str) ->
         if from_id == to_id:
             continue
 
-        # If edge exists, increase weight; else insert
-        ex = (
-            supabase.table("concept_edges")
-            .select("id, weight")
-            .eq("class_id", class_id)
-            .eq("from_concept_id", from_id)
-            .eq("to_concept_id", to_id)
-            .eq("type", etype)
-            .maybe_single()
-            .execute()
-        )
-        row = _safe_data(ex)
-
-        if row:
-            w = int(row.get("weight") or 0) + 1
-            supabase.table("concept_edges").update(
-                {"weight": w, "updated_at": _now()}
-            ).eq("id", row["id"]).execute()
-        else:
-            supabase.table("concept_edges").insert(
-                {
-                    "id": new_uuid(),
-                    "class_id": class_id,
-                    "from_concept_id": from_id,
-                    "to_concept_id": to_id,
-                    "type": etype,
-                    "weight": 1,
-                    "created_at": _now(),
-                    "updated_at": _now(),
-                }
-            ).execute()
+        key = (from_id, to_id, etype)
+        edge_deltas[key] = edge_deltas.get(key, 0) + 1
+
+    # Mentions and edges are independent writes
+    await asyncio.gather(
+        asyncio.to_thread(_insert_mentions, mention_rows),
+        asyncio.to_thread(upsert_edges_batch, class_id=class_id, edges=edge_deltas),
+    )
 
     # ------------- Graph Intelligence Layer -------------
-    reinforce_graph_after_upload(class_id=class_id, doc_id=doc_id, concept_ids=concept_ids)
\ No newline at end of file
+    # Nothing downstream reads the reinforced graph in this request, so run it
+    # in the background instead of holding the upload response.
+    _spawn(
+        asyncio.to_thread(
+            reinforce_graph_after_upload,
+            class_id=class_id,
+            doc_id=doc_id,
+            concept_ids=concept_ids,
+            importance_by_id=dict(zip(concept_ids, levels)),
+        ),
+        label="reinforce_graph_after_upload",
+    )
+
+
+def update_class_graph_in_background(*, class_id: str, doc_id: str, guide_json: str | Dict) -> None:
+    """Fire-and-forget update_class_graph for callers that don't need to wait."""
+    _spawn(
+        update_class_graph(class_id=class_id, doc_id=doc_id, guide_json=guide_json),
+        label="update_class_graph",
+    )
@@ -3,7 +3,8 @@ from typing import Dict, Any
 from ..supabase import supabase
 
 def norm(s: str) -> str:
-    return " ".join(s.lower().strip().split())
+    """Canonical concept-name key: collapsed whitespace, trimmed, lowercase."""
+    return " ".join((s or "").lower().split())
 
 def match_or_create_concepts(class_id: str, document_id: str, extracted: Dict[str, Any]) -> Dict[str, str]:
     concepts = extracted.get("concepts", [])
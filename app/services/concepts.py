@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-import json
+import asyncio
 from typing import Any
 
-from .llm import llm
+from ..schemas import ConceptsOut
+from .llm import llm_json
+from .tokens import truncate_to_tokens
 from .db import supabase, new_uuid
 
 
+# Chapter text sent to extract_concepts
+CONCEPT_INPUT_TOKENS = 6000
+
+
 CONCEPT_SYS = """
 You are extracting key study concepts from a textbook chapter.
 Return ONLY valid JSON:
@@ -33,142 +39,172 @@ Rules:
 # -----------------------------------------
 
 async def extract_concepts(text: str, max_concepts: int = 10) -> list[dict[str, Any]]:
-    raw = await llm(
+    data = await llm_json(
         [
             {"role": "system", "content": CONCEPT_SYS},
-            {"role": "user", "content": text[:20000]},
+            {"role": "user", "content": truncate_to_tokens(text, CONCEPT_INPUT_TOKENS)},
         ],
+        ConceptsOut,
         max_tokens=2000,
         temperature=0.2,
     )
-
-    try:
-        data = json.loads(raw)
-        concepts = data.get("concepts", [])
-        out: list[dict[str, Any]] = []
-
-        for c in concepts:
-            name = str(c.get("name", "")).strip()
-            if not name:
-                continue
-
-            out.append(
-                {
-                    "name": name,
-                    "importance": c.get("importance", "important"),
-                    "difficulty": c.get("difficulty", "medium"),
-                    "prerequisites": c.get("prerequisites", []),
-                }
-            )
-
-        return out[:max_concepts]
-    except Exception:
+    if data is None:
         return []
 
+    out: list[dict[str, Any]] = []
+    for c in data.concepts:
+        name = c.name.strip()
+        if not name:
+            continue
+
+        out.append(
+            {
+                "name": name,
+                "importance": c.importance,
+                "difficulty": c.difficulty,
+                "prerequisites": c.prerequisites,
+            }
+        )
+
+    return out[:max_concepts]
+
 
 # -----------------------------------------
 # Graph Engine
 # -----------------------------------------
 
+_IMPORTANCE_SCORES = {
+    "core": 0.9,
+    "important": 0.6,
+    "advanced": 0.3,
+}
+
+_DIFFICULTY_SCORES = {
+    "easy": 0.3,
+    "medium": 0.6,
+    "hard": 0.9,
+}
+
+
 def importance_to_score(level: str) -> float:
-    return {
-        "core": 0.9,
-        "important": 0.6,
-        "advanced": 0.3,
-    }.get(level, 0.5)
+    return _IMPORTANCE_SCORES.get(level, 0.5)
 
 
 def difficulty_to_score(level: str) -> float:
-    return {
-        "easy": 0.3,
-        "medium": 0.6,
-        "hard": 0.9,
-    }.get(level, 0.5)
+    return _DIFFICULTY_SCORES.get(level, 0.5)
 
 
-def upsert_concept(class_id: str, c: dict[str, Any]) -> str:
-    sb = supabase()
-
-    row = {
-        "class_id": class_id,
-        "canonical_name": c["name"].strip(),
-        "importance_score": importance_to_score(c.get("importance", "important")),
-        "difficulty_level": difficulty_to_score(c.get("difficulty", "medium")),
-    }
+def upsert_concepts_bulk(class_id: str, concepts: list[dict[str, Any]]) -> dict[str, str]:
+    """Upsert all concept nodes in one request; returns {name: concept_id}."""
+    # One row per name (Postgres rejects an upsert that touches a row twice)
+    rows_by_name: dict[str, dict[str, Any]] = {}
+    for c in concepts:
+        name = c["name"].strip()
+        rows_by_name[name] = {
+            "class_id": class_id,
+            "canonical_name": name,
+            "importance_score": importance_to_score(c.get("importance", "important")),
+            "difficulty_level": difficulty_to_score(c.get("difficulty", "medium")),
+        }
+    if not rows_by_name:
+        return {}
 
+    sb = supabase()
     r = sb.table("concepts").upsert(
-        row,
+        list(rows_by_name.values()),
         on_conflict="class_id,canonical_name",
     ).execute()
 
-    data = r.data or []
-    if data:
-        return data[0]["id"]
-
-    # fallback fetch
-    rr = (
-        sb.table("concepts")
-        .select("id")
-        .eq("class_id", class_id)
-        .eq("canonical_name", c["name"].strip())
-        .limit(1)
-        .execute()
-    )
-    rows = rr.data or []
-    return rows[0]["id"] if rows else ""
-
+    id_by_name = {
+        row["canonical_name"]: row["id"]
+        for row in (r.data or [])
+        if row.get("canonical_name") and row.get("id")
+    }
 
-def add_edge(class_id: str, from_id: str, to_id: str) -> None:
-    if not from_id or not to_id or from_id == to_id:
+    # fallback fetch for anything the upsert didn't echo back
+    missing = [n for n in rows_by_name if n not in id_by_name]
+    if missing:
+        rr = (
+            sb.table("concepts")
+            .select("id,canonical_name")
+            .eq("class_id", class_id)
+            .in_("canonical_name", missing)
+            .execute()
+        )
+        for row in rr.data or []:
+            id_by_name[row["canonical_name"]] = row["id"]
+
+    return id_by_name
+
+
+def add_edges(class_id: str, pairs: list[tuple[str, str]]) -> None:
+    """Upsert prereq edges (from_id, to_id) in one request."""
+    rows: dict[tuple[str, str], dict[str, Any]] = {}
+    for from_id, to_id in pairs:
+        if not from_id or not to_id or from_id == to_id:
+            continue
+        rows[(from_id, to_id)] = {
+            "class_id": class_id,
+            "from_concept_id": from_id,
+            "to_concept_id": to_id,
+            "type": "prereq",
+            "weight": 1.0,
+        }
+    if not rows:
         return
 
-    sb = supabase()
-
-    row = {
-        "class_id": class_id,
-        "from_concept_id": from_id,
-        "to_concept_id": to_id,
-        "type": "prereq",
-        "weight": 1.0,
-    }
-
-    sb.table("concept_edges").upsert(
-        row,
+    supabase().table("concept_edges").upsert(
+        list(rows.values()),
         on_conflict="class_id,from_concept_id,to_concept_id,type",
     ).execute()
 
 
-def save_doc_mentions(class_id: str, doc_id: str, concept_ids: list[str]) -> None:
-    sb = supabase()
+def add_edge(class_id: str, from_id: str, to_id: str) -> None:
+    add_edges(class_id, [(from_id, to_id)])
 
-    for cid in concept_ids:
-        row = {
+
+def save_doc_mentions(class_id: str, doc_id: str, concept_ids: list[str]) -> None:
+    rows = [
+        {
             "class_id": class_id,
             "document_id": doc_id,
             "concept_id": cid,
             "mention_count": 1,
         }
+        for cid in dict.fromkeys(concept_ids)
+        if cid
+    ]
+    if not rows:
+        return
 
-        sb.table("concept_doc_mentions").upsert(
-            row,
-            on_conflict="document_id,concept_id",
-        ).execute()
-
-
-def update_class_graph(user_id: str, class_id: str, doc_id: str, concepts: list[dict[str, Any]]) -> None:
-    id_by_name: dict[str, str] = {}
-
-    # 1. Upsert concept nodes
-    for c in concepts:
-        cid = upsert_concept(class_id, c)
-        id_by_name[c["name"].strip()] = cid
+    supabase().table("concept_doc_mentions").upsert(
+        rows,
+        on_conflict="document_id,concept_id",
+    ).execute()
 
-    # 2. Save document mentions
-    save_doc_mentions(class_id, doc_id, list(id_by_name.values()))
 
-    # 3. Add prerequisite edges
-    for c in concepts:
-        to_id = id_by_name.get(c["name"].strip(), "")
-        for p in c.get("prerequisites", []):
-            from_id = id_by_name.get(str(p).strip(), "")
-            add_edge(class_id, from_id, to_id)
\ No newline at end of file
+async def update_class_graph(user_id: str, class_id: str, doc_id: str, concepts: list[dict[str, Any]]) -> None:
+    named = [
+        (c["name"].strip(), [str(p).strip() for p in c.get("prerequisites", [])])
+        for c in concepts
+    ]
+
+    # 1. Upsert concept nodes (sync client -> worker thread, keeps the loop free)
+    id_by_name = await asyncio.to_thread(upsert_concepts_bulk, class_id, concepts)
+
+    # 2. Prerequisite edge pairs (names normalized once, reused for every lookup)
+    pairs: list[tuple[str, str]] = []
+    for name, prereqs in named:
+        to_id = id_by_name.get(name)
+        if not to_id:
+            continue
+        for p in prereqs:
+            from_id = id_by_name.get(p)
+            if from_id:
+                pairs.append((from_id, to_id))
+
+    # 3. Document mentions and edges don't depend on each other
+    await asyncio.gather(
+        asyncio.to_thread(save_doc_mentions, class_id, doc_id, list(id_by_name.values())),
+        asyncio.to_thread(add_edges, class_id, pairs),
+    )
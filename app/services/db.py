@@ -3,7 +3,7 @@ from __future__ import annotations
 import uuid
 from typing import Optional, Any
 
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from ..settings import settings
 
 
@@ -19,13 +19,38 @@ def supabase() -> Client:
     if _supabase is None:
         if not settings.SUPABASE_URL or not settings.SUPABASE_SERVICE_ROLE_KEY:
             raise RuntimeError("Supabase is not configured.")
+        # No shared httpx_client: postgrest and storage each set their own
+        # base_url/headers on the client they are given, so one client can't
+        # serve both. Each sub-client is created once per Supabase client and
+        # keeps its own keep-alive pool; only the timeouts are tuned here.
         _supabase = create_client(
             settings.SUPABASE_URL,
             settings.SUPABASE_SERVICE_ROLE_KEY,
+            options=ClientOptions(
+                postgrest_client_timeout=settings.SUPABASE_HTTP_TIMEOUT_SECONDS,
+                storage_client_timeout=int(settings.SUPABASE_HTTP_TIMEOUT_SECONDS),
+            ),
         )
     return _supabase
 
 
+def close_supabase() -> None:
+    """Close the client's postgrest/storage HTTP sessions and drop it; the
+    next supabase() call builds a fresh one."""
+    global _supabase
+    client, _supabase = _supabase, None
+    if client is None:
+        return
+    # Sub-clients are created on first use: close only the ones that exist
+    for sub in (getattr(client, "_postgrest", None), getattr(client, "_storage", None)):
+        session = getattr(sub, "session", None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
 def _bucket() -> str:
     return (settings.SUPABASE_STORAGE_BUCKET or "documents").strip()
 
@@ -120,6 +145,37 @@ def find_document_id_by_hash(
     return None
 
 
+def find_document_by_hash(
+    *,
+    user_id: str,
+    class_id: str,
+    content_hash: str,
+) -> Optional[dict[str, Any]]:
+    """Latest processed copy of this file in the class (same user), with its
+    stored outputs, so a re-upload can reuse them."""
+    sb = supabase()
+
+    try:
+        r = (
+            sb.table("documents")
+            .select("id, title, summary, cards_json, guide_json, pdf_path")
+            .eq("user_id", user_id)
+            .eq("class_id", class_id)
+            .eq("content_hash", content_hash)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+
+        rows = getattr(r, "data", None) or []
+        if rows:
+            return rows[0]
+    except Exception:
+        return None
+
+    return None
+
+
 def upsert_document(
     *,
     user_id: str,
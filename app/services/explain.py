@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, Optional
+import asyncio
+from typing import Any, Dict, Iterable, Optional, Tuple
 
+from ..settings import settings
 from ..supabase import supabase
-from .llm import llm
+from ..schemas import ConceptEnrichmentOut, EdgeEnrichmentOut
+from .llm import llm_json
 
 
 CONCEPT_ENRICH_PROMPT = """You are helping a student study a university course.
@@ -46,24 +48,7 @@ Rules:
 """
 
 
-def _safe_json(raw: str) -> Dict[str, Any]:
-    if not raw:
-        return {}
-    try:
-        return json.loads(raw)
-    except Exception:
-        # Sometimes the model returns extra text; try to extract the first JSON object.
-        start = raw.find("{")
-        end = raw.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(raw[start : end + 1])
-            except Exception:
-                return {}
-        return {}
-
-
-async def generate_concept_enrichment(*, concept_name: str, class_name: Optional[str] = None, top_context: Optional[list[str]] = None) -> Dict[str, str]:
+async def generate_concept_enrichment(*, concept_name: str, class_name: Optional[str] = None, top_context: Optional[list[str]] = None, fresh: bool = False) -> Dict[str, str]:
     context_bits = []
     if class_name:
         context_bits.append(f"Class: {class_name}")
@@ -75,23 +60,27 @@ async def generate_concept_enrichment(*, concept_name: str, class_name: Optional
     if context:
         user_msg += "\n" + context
 
-    raw = await llm(
+    out = await llm_json(
         [
             {"role": "system", "content": CONCEPT_ENRICH_PROMPT},
             {"role": "user", "content": user_msg},
         ],
+        ConceptEnrichmentOut,
         max_tokens=450,
         temperature=0.2,
+        # fresh: regenerate instead of replaying the cached reply
+        cache_ttl=0 if fresh else settings.LLM_CACHE_TTL_SECONDS,
     )
-    data = _safe_json(raw)
+    if out is None:
+        return {"definition": "", "example": "", "application": ""}
     return {
-        "definition": (data.get("definition") or "").strip(),
-        "example": (data.get("example") or "").strip(),
-        "application": (data.get("application") or "").strip(),
+        "definition": out.definition.strip(),
+        "example": out.example.strip(),
+        "application": out.application.strip(),
     }
 
 
-async def generate_edge_enrichment(*, from_name: str, to_name: str, relation_type: str, class_name: Optional[str] = None) -> Dict[str, str]:
+async def generate_edge_enrichment(*, from_name: str, to_name: str, relation_type: str, class_name: Optional[str] = None, fresh: bool = False) -> Dict[str, str]:
     context_bits = []
     if class_name:
         context_bits.append(f"Class: {class_name}")
@@ -101,28 +90,85 @@ async def generate_edge_enrichment(*, from_name: str, to_name: str, relation_typ
     if context:
         user_msg += "\n" + context
 
-    raw = await llm(
+    out = await llm_json(
         [
             {"role": "system", "content": EDGE_ENRICH_PROMPT},
             {"role": "user", "content": user_msg},
         ],
+        EdgeEnrichmentOut,
         max_tokens=550,
         temperature=0.2,
+        # fresh: regenerate instead of replaying the cached reply
+        cache_ttl=0 if fresh else settings.LLM_CACHE_TTL_SECONDS,
     )
-    data = _safe_json(raw)
+    if out is None:
+        return {"label": "", "definition": "", "example": "", "application": ""}
     return {
-        "label": (data.get("label") or "").strip(),
-        "definition": (data.get("definition") or "").strip(),
-        "example": (data.get("example") or "").strip(),
-        "application": (data.get("application") or "").strip(),
+        "label": out.label.strip(),
+        "definition": out.definition.strip(),
+        "example": out.example.strip(),
+        "application": out.application.strip(),
     }
 
 
+# Max enrichment LLM calls in flight per bulk call (provider rate limits)
+ENRICH_CONCURRENCY = 8
+
+
+async def enrich_concepts_bulk(
+    names: Iterable[str],
+    class_name: Optional[str] = None,
+    top_context: Optional[list[str]] = None,
+    concurrency: int = ENRICH_CONCURRENCY,
+) -> Dict[str, Dict[str, str]]:
+    """generate_concept_enrichment for many concepts concurrently; {name: enrichment}."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(name: str):
+        async with sem:
+            return name, await generate_concept_enrichment(
+                concept_name=name, class_name=class_name, top_context=top_context
+            )
+
+    return dict(await asyncio.gather(*(one(n) for n in dict.fromkeys(names))))
+
+
+async def enrich_edges_bulk(
+    edges: Iterable[Tuple[str, str, str]],
+    class_name: Optional[str] = None,
+    concurrency: int = ENRICH_CONCURRENCY,
+) -> Dict[Tuple[str, str, str], Dict[str, str]]:
+    """generate_edge_enrichment for many (from_name, to_name, relation_type) edges concurrently."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(edge: Tuple[str, str, str]):
+        from_name, to_name, relation_type = edge
+        async with sem:
+            return edge, await generate_edge_enrichment(
+                from_name=from_name, to_name=to_name, relation_type=relation_type, class_name=class_name
+            )
+
+    return dict(await asyncio.gather(*(one(e) for e in dict.fromkeys(edges))))
+
+
+# Found class names only: a miss (class not created yet, or a failed
+# lookup) must not stick
+_CLASS_NAMES: dict[str, str] = {}
+_CLASS_NAMES_MAX = 256
+
+
 def get_class_name(class_id: str) -> Optional[str]:
+    name = _CLASS_NAMES.get(class_id)
+    if name is not None:
+        return name
     res = supabase.table("classes").select("name").eq("id", class_id).maybe_single().execute()
     if res and getattr(res, "data", None):
-        return res.data.get("name")
-    return None
+        name = res.data.get("name")
+    if name is not None:
+        if len(_CLASS_NAMES) >= _CLASS_NAMES_MAX:
+            _CLASS_NAMES.clear()
+        _CLASS_NAMES[class_id] = name
+    return name
 
 
 def get_top_concepts(class_id: str, limit: int = 10) -> list[str]:
@@ -137,3 +183,23 @@ def get_top_concepts(class_id: str, limit: int = 10) -> list[str]:
     )
     rows = (res.data or []) if res else []
     return [r.get("canonical_name") for r in rows if r.get("canonical_name")]
+
+
+def get_class_context(class_id: str, limit: int = 10) -> Dict[str, Any]:
+    """Class name + its top concept names (get_class_name + get_top_concepts)
+    in one request, via PostgREST resource embedding."""
+    res = (
+        supabase.table("classes")
+        .select("name, concepts(canonical_name, importance_score)")
+        .eq("id", class_id)
+        .is_("concepts.merged_into", "null")
+        .order("importance_score", desc=True, foreign_table="concepts")
+        .limit(limit, foreign_table="concepts")
+        .maybe_single()
+        .execute()
+    )
+    row = (getattr(res, "data", None) or {}) if res else {}
+    return {
+        "name": row.get("name"),
+        "top": [c.get("canonical_name") for c in row.get("concepts") or [] if c.get("canonical_name")],
+    }
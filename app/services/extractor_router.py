@@ -12,7 +12,14 @@ from __future__ import annotations
 import json
 from typing import Any, Dict, Tuple
 
-from .llm import llm
+from ..schemas import ClassifyAndRouteOut, RouterOut
+from .intelligent_classifier import (
+    CLASSIFIER_PROMPT,
+    classify_and_recommend,
+    validate_classification,
+)
+from .llm import llm_json, prompt_shard
+from .tokens import truncate_to_tokens
 
 
 LEARNING_MODELS = [
@@ -23,6 +30,9 @@ LEARNING_MODELS = [
     "applied_case",         # business / nursing cases / applied decision-making
 ]
 
+# Document excerpt sent to the router
+ROUTER_EXCERPT_TOKENS = 1200
+
 
 ROUTER_PROMPT = """
 You are routing an academic document to the best extraction strategy.
@@ -50,13 +60,6 @@ Rules:
 """
 
 
-def _safe_json_loads(s: str) -> Dict[str, Any]:
-    try:
-        return json.loads(s)
-    except Exception:
-        return {}
-
-
 async def choose_learning_model(
     *,
     text_content: str,
@@ -71,7 +74,7 @@ async def choose_learning_model(
     - mapped_subject_area
     """
 
-    excerpt = (text_content or "")[:3500]
+    excerpt = truncate_to_tokens(text_content or "", ROUTER_EXCERPT_TOKENS)
     cls = classification or {}
 
     prompt = {
@@ -79,16 +82,24 @@ async def choose_learning_model(
         "excerpt": excerpt,
     }
 
-    resp = await llm(
+    out = await llm_json(
         [
             {"role": "system", "content": ROUTER_PROMPT},
             {"role": "user", "content": json.dumps(prompt, ensure_ascii=False)},
         ],
+        RouterOut,
         max_tokens=350,
         temperature=0.1,
+        # routing depends only on the excerpt: a cached decision never goes stale
+        cache_ttl=None,
     )
 
-    data = _safe_json_loads(resp)
+    data = out.model_dump() if out is not None else {}
+    return _normalize_route(data, cls)
+
+
+def _normalize_route(data: Dict[str, Any], cls: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate/clamp a raw routing answer, falling back on the classification."""
     lm = (data.get("learning_model") or "").strip()
     if lm not in LEARNING_MODELS:
         # fallback: map from classifier subject_area if possible
@@ -121,3 +132,49 @@ async def choose_learning_model(
         "mapped_subject_area": mapped_subject_area,
     }
 
+
+CLASSIFY_AND_ROUTE_PROMPT = f"""
+You will do TWO tasks on the same academic document excerpt.
+
+=== TASK 1: classification ===
+{CLASSIFIER_PROMPT}
+
+=== TASK 2: routing ===
+Use the excerpt and your Task 1 classification.
+{ROUTER_PROMPT}
+
+=== Output ===
+Return ONLY valid JSON with both results:
+{{
+  "classification": {{ ...Task 1 object... }},
+  "routing": {{ ...Task 2 object... }}
+}}
+"""
+
+
+async def classify_and_route(text_content: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """classify_and_recommend + choose_learning_model in ONE LLM call.
+
+    Both tasks read the same excerpt, so stacking them saves a round-trip.
+    Returns (classification_pack, route) in the shapes those two return.
+    """
+    excerpt = truncate_to_tokens(text_content or "", ROUTER_EXCERPT_TOKENS)
+    if not excerpt.strip():
+        pack = await classify_and_recommend(text_content, classification=validate_classification(None))
+        return pack, _normalize_route({}, pack["classification"])
+
+    out = await llm_json(
+        [
+            {"role": "system", "content": CLASSIFY_AND_ROUTE_PROMPT},
+            {"role": "user", "content": f"Document excerpt:\n\n{excerpt}"},
+        ],
+        ClassifyAndRouteOut,
+        max_tokens=1100,
+        temperature=0.1,
+        prompt_cache_key=prompt_shard("classify_and_route"),
+    )
+    data = out.model_dump() if out is not None else {}
+
+    cls = validate_classification(data.get("classification"))
+    pack = await classify_and_recommend(text_content, classification=cls)
+    return pack, _normalize_route(data.get("routing") or {}, cls)
@@ -1,11 +1,14 @@
 # app/services/graph_intelligence.py
 from __future__ import annotations
 
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime
-from itertools import combinations
+from itertools import combinations, islice
 from typing import Dict, List, Optional, Tuple
 
+from loguru import logger
+
 from ..supabase import supabase
 from .db import new_uuid
 
@@ -24,10 +27,6 @@ def _safe_data(res):
     return getattr(res, "data", None)
 
 
-def _normalize_name(name: str) -> str:
-    return " ".join((name or "").strip().lower().split())
-
-
 @dataclass
 class GraphTuning:
     # If an edge weight is below this, delete it
@@ -46,6 +45,9 @@ class GraphTuning:
 
 DEFAULT_TUNING = GraphTuning()
 
+# Max rows per bulk upsert request
+UPSERT_CHUNK_SIZE = 500
+
 
 # ------------------------------------------------------------
 # Core: called after each upload
@@ -55,6 +57,7 @@ def reinforce_graph_after_upload(
     class_id: str,
     doc_id: str,
     concept_ids: List[str],
+    importance_by_id: Optional[Dict[str, float]] = None,
     tuning: GraphTuning = DEFAULT_TUNING,
 ) -> None:
     """
@@ -62,12 +65,34 @@ def reinforce_graph_after_upload(
     1) co-occurrence reinforcement ("related" edges)
     2) prune weak edges
     3) recalc concept importance via centrality
+
+    All three run inside Postgres in one rpc
+    (sql/reinforce_graph_after_upload.sql); the step-by-step Python version
+    below is the fallback when that function isn't deployed.
     """
     if not class_id or not doc_id or not concept_ids:
         return
 
+    ids = _ordered_concept_ids(concept_ids, importance_by_id)
+    try:
+        supabase.rpc(
+            "reinforce_graph_after_upload",
+            {
+                "_class_id": class_id,
+                "_concept_ids": ids,
+                "_max_related_edges": tuning.max_related_edges_per_upload,
+                "_prune_edge_weight_lt": tuning.prune_edge_weight_lt,
+                "_degree_scale": tuning.degree_scale,
+                "_doc_weight": tuning.importance_doc_weight,
+                "_degree_weight": tuning.importance_degree_weight,
+            },
+        ).execute()
+        return
+    except Exception as e:
+        logger.warning(f"[graph] reinforce_graph_after_upload rpc failed, running steps: {e}")
+
     # 1) reinforce co-occurrence (related edges)
-    _reinforce_related_edges(class_id=class_id, concept_ids=concept_ids, tuning=tuning)
+    _reinforce_related_edges(class_id=class_id, concept_ids=ids, tuning=tuning)
 
     # 2) prune weak edges
     prune_weak_edges(class_id=class_id, tuning=tuning)
@@ -80,46 +105,65 @@ def reinforce_graph_after_upload(
 # Co-occurrence edges (stored as edge_type "related")
 # Your enum supports: prereq, related, part_of, example_of, causes
 # ------------------------------------------------------------
-def _reinforce_related_edges(*, class_id: str, concept_ids: List[str], tuning: GraphTuning) -> None:
-    # Dedup concept ids
-    ids = []
-    seen = set()
-    for cid in concept_ids:
-        if cid and cid not in seen:
-            ids.append(cid)
-            seen.add(cid)
+def _ordered_concept_ids(
+    concept_ids: List[str], importance_by_id: Optional[Dict[str, float]] = None
+) -> List[str]:
+    # Dedup concept ids (order-preserving)
+    ids = list(dict.fromkeys(cid for cid in concept_ids if cid))
+
+    # Most important concepts first, so the capped pairs are the meaningful ones
+    # (stable sort: ties keep document order)
+    if importance_by_id:
+        ids.sort(key=lambda cid: importance_by_id.get(cid, 0.0), reverse=True)
+    return ids
 
+
+def _reinforce_related_edges(
+    *,
+    class_id: str,
+    concept_ids: List[str],
+    tuning: GraphTuning,
+    importance_by_id: Optional[Dict[str, float]] = None,
+) -> None:
+    ids = _ordered_concept_ids(concept_ids, importance_by_id)
     if len(ids) < 2:
         return
 
-    # Build candidate pairs (cap to avoid huge spam)
-    pairs = list(combinations(ids, 2))
-    if len(pairs) > tuning.max_related_edges_per_upload:
-        pairs = pairs[: tuning.max_related_edges_per_upload]
+    # Build candidate pairs lazily (cap to avoid huge spam)
+    pairs = list(islice(combinations(ids, 2), tuning.max_related_edges_per_upload))
 
+    # "related" is undirected: store one row per pair in canonical (sorted)
+    # direction. sql/concept_edges_bidirected.sql exposes the mirrored rows.
+    edges: Dict[Tuple[str, str, str], int] = {}
     for a, b in pairs:
-        _upsert_edge(
-            class_id=class_id,
-            from_id=a,
-            to_id=b,
-            edge_type="related",
-            delta_weight=1,
-        )
-        # Also reinforce the reverse direction (so UI can treat it like undirected)
-        _upsert_edge(
-            class_id=class_id,
-            from_id=b,
-            to_id=a,
-            edge_type="related",
-            delta_weight=1,
-        )
+        lo, hi = (a, b) if a < b else (b, a)
+        edges[(lo, hi, "related")] = 1
+
+    # One atomic increment for every pair
+    upsert_edges_batch(class_id=class_id, edges=edges)
 
 
 def _upsert_edge(*, class_id: str, from_id: str, to_id: str, edge_type: str, delta_weight: int) -> None:
+    """Atomic weight += delta_weight (insert if missing) for a single edge."""
+    upsert_edges_batch(class_id=class_id, edges={(from_id, to_id, edge_type): delta_weight})
+
+
+def _upsert_edge_select_then_write(
+    *,
+    class_id: str,
+    from_id: str,
+    to_id: str,
+    edge_type: str,
+    delta_weight: int,
+    now: Optional[str] = None,
+) -> None:
     """
+    Fallback for databases without the upsert_edges_batch function.
     If edge exists: weight += delta_weight
     Else: insert with weight = delta_weight
+    (two round-trips and not atomic under concurrent uploads)
     """
+    now = now or _now()
     res = (
         supabase.table("concept_edges")
         .select("id, weight")
@@ -135,7 +179,7 @@ def _upsert_edge(*, class_id: str, from_id: str, to_id: str, edge_type: str, del
     if row:
         new_w = int(row.get("weight") or 0) + int(delta_weight)
         supabase.table("concept_edges").update(
-            {"weight": new_w, "updated_at": _now()}
+            {"weight": new_w, "updated_at": now}
         ).eq("id", row["id"]).execute()
         return
 
@@ -147,12 +191,53 @@ def _upsert_edge(*, class_id: str, from_id: str, to_id: str, edge_type: str, del
             "to_concept_id": to_id,
             "type": edge_type,  # must be valid enum value
             "weight": int(delta_weight),
-            "created_at": _now(),
-            "updated_at": _now(),
+            "created_at": now,
+            "updated_at": now,
         }
     ).execute()
 
 
+def upsert_edges_batch(*, class_id: str, edges: Dict[Tuple[str, str, str], int]) -> None:
+    """
+    Apply many edge increments in one round-trip.
+
+    edges maps (from_id, to_id, edge_type) -> delta_weight. Uses the
+    upsert_edges_batch RPC (sql/upsert_edges_batch.sql); if the function isn't
+    deployed we fall back to select-then-write per edge.
+    """
+    if not class_id or not edges:
+        return
+
+    rows = [
+        {
+            "class_id": class_id,
+            "from_concept_id": from_id,
+            "to_concept_id": to_id,
+            "type": edge_type,
+            "weight": int(delta),
+        }
+        for (from_id, to_id, edge_type), delta in edges.items()
+    ]
+
+    try:
+        supabase.rpc("upsert_edges_batch", {"rows": rows}).execute()
+        return
+    except Exception as e:
+        logger.warning(f"[graph] upsert_edges_batch rpc failed, upserting one by one: {e}")
+
+    # One timestamp for the batch; these edges are logically written together
+    now = _now()
+    for (from_id, to_id, edge_type), delta in edges.items():
+        _upsert_edge_select_then_write(
+            class_id=class_id,
+            from_id=from_id,
+            to_id=to_id,
+            edge_type=edge_type,
+            delta_weight=delta,
+            now=now,
+        )
+
+
 # ------------------------------------------------------------
 # Pruning
 # ------------------------------------------------------------
@@ -179,26 +264,74 @@ def prune_weak_edges(*, class_id: str, tuning: GraphTuning = DEFAULT_TUNING) ->
 # ------------------------------------------------------------
 # Importance scoring (centrality + document frequency)
 # ------------------------------------------------------------
+def _doc_frequency(class_id: str) -> Optional[Dict[str, int]]:
+    """Distinct documents mentioning each concept (sql/concept_doc_frequency.sql); None if unavailable."""
+    try:
+        res = supabase.rpc("concept_doc_frequency", {"_class_id": class_id}).execute()
+    except Exception as e:
+        logger.warning(f"[graph] concept_doc_frequency rpc failed, using document_frequency: {e}")
+        return None
+    return {r["concept_id"]: int(r.get("df") or 0) for r in _safe_data(res) or []}
+
+
+def _weighted_degree(class_id: str) -> Dict[str, float]:
+    """
+    Weighted degree for each concept = sum(weights of edges touching node).
+    Aggregated in Postgres (sql/concept_weighted_degree.sql): one row per
+    concept instead of every edge.
+    """
+    try:
+        res = supabase.rpc("concept_weighted_degree", {"_class_id": class_id}).execute()
+        return {
+            r["concept_id"]: float(r.get("degree") or 0.0)
+            for r in _safe_data(res) or []
+        }
+    except Exception as e:
+        logger.warning(f"[graph] concept_weighted_degree rpc failed, summing in Python: {e}")
+
+    eres = (
+        supabase.table("concept_edges_bidirected")
+        .select("from_concept_id, to_concept_id, weight")
+        .eq("class_id", class_id)
+        .execute()
+    )
+    weighted_degree: Dict[str, float] = defaultdict(float)
+    for e in _safe_data(eres) or []:
+        try:
+            w = float(e.get("weight") or 0.0)
+        except Exception:
+            continue
+        weighted_degree[e.get("from_concept_id")] += w
+        weighted_degree[e.get("to_concept_id")] += w
+    return weighted_degree
+
+
 def recalc_importance(*, class_id: str, tuning: GraphTuning = DEFAULT_TUNING) -> None:
     """
     importance_score = 0.6*(doc_frequency normalized) + 0.4*(degree normalized)
 
     If your schema doesn’t have document_frequency, we fall back safely.
     """
-    # Fetch concepts
+    # Fetch live (unmerged) concepts
     cres = (
         supabase.table("concepts")
-        .select("id, document_frequency")
+        .select("id, canonical_name, document_frequency")
         .eq("class_id", class_id)
+        .is_("merged_into", "null")
         .execute()
     )
     concepts = _safe_data(cres) or []
     if not concepts:
         return
 
-    # Normalize doc frequency
+    # Normalize doc frequency: counted from concept_doc_mentions when the
+    # concept_doc_frequency function exists, else the denormalized column
+    df_by_id = _doc_frequency(class_id)
     doc_freqs = []
     for c in concepts:
+        if df_by_id is not None:
+            doc_freqs.append(df_by_id.get(c["id"], 0))
+            continue
         df = c.get("document_frequency")
         try:
             df = int(df) if df is not None else 1
@@ -208,25 +341,13 @@ def recalc_importance(*, class_id: str, tuning: GraphTuning = DEFAULT_TUNING) ->
 
     max_df = max(doc_freqs) if doc_freqs else 1
 
-    # Compute weighted degree for each concept
-    # degree = sum(weights of edges touching node)
+    weighted_degree = _weighted_degree(class_id)
+
+    now = _now()
+    updates = []
     for idx, c in enumerate(concepts):
         cid = c["id"]
-
-        eres = (
-            supabase.table("concept_edges")
-            .select("weight")
-            .eq("class_id", class_id)
-            .or_(f"from_concept_id.eq.{cid},to_concept_id.eq.{cid}")
-            .execute()
-        )
-        edges = _safe_data(eres) or []
-        degree = 0.0
-        for e in edges:
-            try:
-                degree += float(e.get("weight") or 0.0)
-            except Exception:
-                pass
+        degree = weighted_degree.get(cid, 0.0)
 
         df = doc_freqs[idx]
         norm_df = df / max_df if max_df else 0.0
@@ -237,6 +358,19 @@ def recalc_importance(*, class_id: str, tuning: GraphTuning = DEFAULT_TUNING) ->
             + tuning.importance_degree_weight * norm_degree
         )
 
-        supabase.table("concepts").update(
-            {"importance_score": round(float(score), 4), "updated_at": _now()}
-        ).eq("id", cid).execute()
\ No newline at end of file
+        # class_id/canonical_name ride along only to satisfy NOT NULL on the
+        # insert half of the upsert; every row already exists.
+        updates.append(
+            {
+                "id": cid,
+                "class_id": class_id,
+                "canonical_name": c.get("canonical_name"),
+                "importance_score": round(float(score), 4),
+                "updated_at": now,
+            }
+        )
+
+    for i in range(0, len(updates), UPSERT_CHUNK_SIZE):
+        supabase.table("concepts").upsert(
+            updates[i : i + UPSERT_CHUNK_SIZE], on_conflict="id"
+        ).execute()
\ No newline at end of file
@@ -2,6 +2,8 @@ from __future__ import annotations
 from collections import defaultdict
 from ..supabase import supabase
 
+UPSERT_CHUNK_SIZE = 500
+
 def recompute_importance(class_id: str) -> None:
     # mentions
     mentions = supabase.table("concept_doc_mentions") \
@@ -13,7 +15,7 @@ def recompute_importance(class_id: str) -> None:
         mention_sum[m["concept_id"]] += int(m["mention_count"])
 
     # degree
-    edges = supabase.table("concept_edges") \
+    edges = supabase.table("concept_edges_bidirected") \
         .select("from_concept_id,to_concept_id") \
         .eq("class_id", class_id).execute().data
 
@@ -26,10 +28,12 @@ def recompute_importance(class_id: str) -> None:
     max_mentions = max(mention_sum.values()) if mention_sum else 1
     max_degree = max(degree.values()) if degree else 1
 
-    concepts = supabase.table("concepts").select("id,merged_into").eq("class_id", class_id).execute().data
+    concepts = supabase.table("concepts") \
+        .select("id,canonical_name") \
+        .eq("class_id", class_id) \
+        .is_("merged_into", "null").execute().data
+    updates = []
     for c in concepts:
-        if c["merged_into"] is not None:
-            continue
         cid = c["id"]
         mscore = mention_sum.get(cid, 0) / max_mentions
         dscore = degree.get(cid, 0) / max_degree
@@ -37,4 +41,12 @@ def recompute_importance(class_id: str) -> None:
         # weighted blend (tweak later)
         importance = float(0.7 * mscore + 0.3 * dscore)
 
-        supabase.table("concepts").update({"importance_score": importance}).eq("id", cid).execute()
\ No newline at end of file
+        updates.append({
+            "id": cid,
+            "class_id": class_id,
+            "canonical_name": c["canonical_name"],
+            "importance_score": importance,
+        })
+
+    for i in range(0, len(updates), UPSERT_CHUNK_SIZE):
+        supabase.table("concepts").upsert(updates[i:i + UPSERT_CHUNK_SIZE], on_conflict="id").execute()
\ No newline at end of file
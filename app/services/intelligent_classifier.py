@@ -4,9 +4,16 @@ Revolutionary AI Document Classifier
 Determines subject type and processing strategy
 """
 
-import json
+import re
 from typing import Dict, Optional
-from .llm import llm
+from ..schemas import ClassificationCore
+from ..settings import settings
+from .llm import llm_json, prompt_shard
+from . import semantic_cache
+from .tokens import truncate_to_tokens
+
+# Excerpt size sent to the classifier
+CLASSIFIER_INPUT_TOKENS = 800
 
 
 CLASSIFIER_PROMPT = """
@@ -49,39 +56,228 @@ Be accurate. If uncertain, mark confidence lower.
 """
 
 
+# classify_document only needs the routing fields from the model; this is a
+# fraction of CLASSIFIER_PROMPT's size (that one stays for classify_and_route).
+CLASSIFIER_PROMPT_COMPACT = """
+Classify this academic document excerpt. Return ONLY JSON:
+{"document_type": "syllabus|lecture_notes|textbook_chapter|reading_material|assignment|exam_study_guide",
+ "subject_area": "stem|humanities|social_science|arts|business|other",
+ "confidence": 0.0-1.0}
+stem = math, CS, physics, chemistry, engineering, biology. humanities = history, literature, philosophy, languages.
+social_science = psychology, sociology, politics, economics. Lower confidence when unsure.
+"""
+
+# specific_subject keywords per subject_area (first match wins)
+_SUBJECT_KEYWORDS = {
+    "stem": [
+        ("Computer Science", ("algorithm", "program", "software", "data structure", "compiler")),
+        ("Mathematics", ("theorem", "calculus", "algebra", "integral", "matrix", "proof")),
+        ("Physics", ("velocity", "momentum", "quantum", "newton", "thermodynamic")),
+        ("Chemistry", ("molecule", "reaction", "bond", "acid", "compound")),
+        ("Biology", ("cell", "gene", "protein", "organism", "evolution")),
+        ("Engineering", ("circuit", "design", "load", "signal", "system")),
+    ],
+    "humanities": [
+        ("History", ("century", "war", "empire", "revolution", "dynasty")),
+        ("Literature", ("novel", "poem", "author", "narrative", "character")),
+        ("Philosophy", ("ethics", "metaphysics", "epistemology", "kant", "plato")),
+    ],
+    "social_science": [
+        ("Psychology", ("behavior", "cognitive", "memory", "emotion", "therapy")),
+        ("Economics", ("market", "demand", "supply", "inflation", "price")),
+        ("Political Science", ("government", "policy", "election", "democracy")),
+        ("Sociology", ("society", "social", "inequality", "institution")),
+    ],
+    "business": [
+        ("Finance", ("finance", "investment", "portfolio", "interest rate")),
+        ("Accounting", ("accounting", "ledger", "balance sheet", "audit")),
+        ("Marketing", ("marketing", "brand", "consumer", "advertising")),
+        ("Management", ("management", "leadership", "strategy", "organization")),
+    ],
+}
+_LEVEL_KEYWORDS = [
+    ("graduate", ("graduate", "doctoral", "phd", "master's")),
+    ("advanced", ("advanced", "senior seminar", "400-level")),
+    ("introductory", ("introduction", "introductory", "intro to", "101", "fundamentals")),
+]
+
+
+def _words_re(words) -> re.Pattern:
+    """Whole-word (plural-tolerant) matcher for keywords; group 1 is the keyword"""
+    alts = "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+    return re.compile(rf"\b({alts})(?:e?s)?\b")
+
+
+# Compiled once: raw substring tests hit "war" in "toward", "cell" in "excellent"
+_SUBJECT_RES = {
+    area: [(name, _words_re(words)) for name, words in subjects]
+    for area, subjects in _SUBJECT_KEYWORDS.items()
+}
+_AREA_RES = {
+    area: _words_re({w for _, words in subjects for w in words})
+    for area, subjects in _SUBJECT_KEYWORDS.items()
+}
+_LEVEL_RES = [(lvl, _words_re(words)) for lvl, words in _LEVEL_KEYWORDS]
+_ANALYSIS_RE = _words_re((
+    "analysis", "analyze", "analyzed", "analyzing", "analyse", "analytical",
+    "interpret", "interpretation", "evaluate", "significance",
+))
+_ARGUMENT_RE = _words_re(("argue", "argument", "thesis", "claim", "evidence"))
+_PROBLEM_RE = _words_re(("problem", "exercise", "solve", "compute", "calculate"))
+_FORMULA_RE = re.compile(r"[=±×÷∑∫√≤≥]|\\frac|\b\d+\s*[\^*/+-]\s*\d+")
+_CODE_RE = re.compile(r"\bdef |\bclass |\breturn\b|#include|\bfunction\b|[;{}]\s*$", re.MULTILINE)
+_DATE_RE = re.compile(
+    r"\b1[5-9]\d\d\b|\b20\d\d\b|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}\b",
+    re.IGNORECASE,
+)
+
+
+def _expand_classification(core: Dict, excerpt: str) -> Dict:
+    """Fill the rest of the Classification shape from keyword heuristics."""
+    low = excerpt.lower()
+    subject_area = core["subject_area"]
+
+    specific = "General"
+    for name, words_re in _SUBJECT_RES.get(subject_area, []):
+        if words_re.search(low):
+            specific = name
+            break
+    level = next((lvl for lvl, words_re in _LEVEL_RES if words_re.search(low)), "intermediate")
+
+    chars = {
+        "has_formulas": bool(_FORMULA_RE.search(excerpt)),
+        "has_code": bool(_CODE_RE.search(excerpt)),
+        "has_dates": len(_DATE_RE.findall(excerpt)) >= 3,
+        "has_analysis": bool(_ANALYSIS_RE.search(low)),
+        "has_arguments": bool(_ARGUMENT_RE.search(low)),
+        "has_problems": bool(_PROBLEM_RE.search(low)),
+        "language_heavy": sum(c.isdigit() for c in excerpt) < len(excerpt) / 100,
+    }
+    if chars["has_problems"] and (chars["has_formulas"] or chars["has_code"]):
+        focus = "applied"
+    elif chars["has_problems"]:
+        focus = "practical"
+    elif chars["has_arguments"] or chars["has_analysis"]:
+        focus = "theoretical"
+    else:
+        focus = "mixed"
+
+    methods = ["flashcards", "concept_map"]
+    if chars["has_problems"] or chars["has_formulas"]:
+        methods.append("practice_problems")
+    if chars["has_dates"]:
+        methods.append("timeline")
+    if chars["has_arguments"]:
+        methods.append("essay_practice")
+
+    return {
+        "document_type": core["document_type"],
+        "subject_area": subject_area,
+        "specific_subject": specific,
+        "course_level": level,
+        "teaching_focus": focus,
+        "content_characteristics": chars,
+        "recommended_study_methods": methods,
+        "confidence": core["confidence"],
+    }
+
+
+# Cached classifications include the keyword-derived fields
+semantic_cache.register_prompt(
+    "classification",
+    CLASSIFIER_PROMPT_COMPACT,
+    ClassificationCore.model_json_schema(),
+    _SUBJECT_KEYWORDS,
+    _LEVEL_KEYWORDS,
+)
+
+
+# Signals for the no-LLM fast path; each must be unambiguous on its own
+_WEEK_RE = re.compile(r"\bweek\s+\d{1,2}\b", re.IGNORECASE)
+_SYLLABUS_RE = re.compile(
+    r"\b(syllabus|office hours|grading|late work|attendance|academic integrity|course objectives)\b",
+    re.IGNORECASE,
+)
+_CODE_LINE_RE = re.compile(r"^\s*(?:def \w+\(|class \w+[:(]|import \w+|from \w+(?:\.\w+)* import |return\b)", re.MULTILINE)
+_TEX_MATH_RE = re.compile(r"\$[^$\n]+\$")
+_YEAR_RE = re.compile(r"\b1[5-9]\d\d\b")
+
+
+def _guess_subject_area(low: str) -> Optional[str]:
+    """subject_area with the most distinct whole-word keyword hits (at
+    least 3), if unique."""
+    scores = {area: len(set(words_re.findall(low))) for area, words_re in _AREA_RES.items()}
+    best = max(scores.values())
+    winners = [a for a, n in scores.items() if n == best]
+    return winners[0] if best >= 3 and len(winners) == 1 else None
+
+
+def _heuristic_classify(excerpt: str) -> Optional[Dict]:
+    """Classification core for obvious documents, or None when the signals
+    are ambiguous (the LLM decides those)."""
+    syllabus_terms = {m.lower() for m in _SYLLABUS_RE.findall(excerpt)}
+    if len(syllabus_terms) >= 3 and len(_WEEK_RE.findall(excerpt)) >= 3:
+        # The syllabus' subject_area is written onto the class, so only take
+        # the fast path when the keywords clearly point at one area.
+        subject_area = _guess_subject_area(excerpt.lower())
+        if subject_area is None:
+            return None
+        return {"document_type": "syllabus", "subject_area": subject_area, "confidence": 0.9}
+
+    code_lines = len(_CODE_LINE_RE.findall(excerpt))
+    tex_math = len(_TEX_MATH_RE.findall(excerpt))
+    if code_lines >= 5 or tex_math >= 5:
+        return {"document_type": "lecture_notes", "subject_area": "stem", "confidence": 0.9}
+
+    if len(_YEAR_RE.findall(excerpt)) >= 12 and not (code_lines or tex_math):
+        return {"document_type": "reading_material", "subject_area": "humanities", "confidence": 0.9}
+
+    return None
+
+
 async def classify_document(text_content: str) -> Dict:
     """
     Classifies document to determine optimal processing strategy
     
     Args:
-        text_content: First ~3000 chars of document
+        text_content: Document text (the first CLASSIFIER_INPUT_TOKENS are used)
         
     Returns:
         Classification dict with processing recommendations
     """
     
-    # Use first 3000 chars for classification
-    excerpt = text_content[:3000] if text_content else ""
+    excerpt = truncate_to_tokens(text_content or "", CLASSIFIER_INPUT_TOKENS)
     
     if not excerpt.strip():
         return _default_classification()
     
+    core = _heuristic_classify(excerpt)
+    if core is not None:
+        return _expand_classification(core, excerpt)
+    
+    hit = semantic_cache.lookup("classification", excerpt)
+    if hit is not None:
+        return hit
+    
     try:
-        response = await llm(
+        out = await llm_json(
             [
-                {"role": "system", "content": CLASSIFIER_PROMPT},
+                {"role": "system", "content": CLASSIFIER_PROMPT_COMPACT},
                 {"role": "user", "content": f"Document excerpt:\n\n{excerpt}"}
             ],
-            max_tokens=800,
-            temperature=0.1  # Low temperature for consistency
+            ClassificationCore,
+            model=settings.CLASSIFIER_MODEL,
+            max_tokens=150,
+            temperature=0.1,  # Low temperature for consistency
+            prompt_cache_key=prompt_shard("classify"),
         )
         
-        classification = json.loads(response)
-        
-        # Validate required fields
-        if not all(k in classification for k in ['document_type', 'subject_area', 'specific_subject']):
+        # Schema-enforced; None only if it never validated
+        if out is None:
             return _default_classification()
+        classification = _expand_classification(out.model_dump(), excerpt)
         
+        semantic_cache.store("classification", excerpt, classification)
         return classification
         
     except Exception as e:
@@ -89,6 +285,17 @@ async def classify_document(text_content: str) -> Dict:
         return _default_classification()
 
 
+def _has_required_fields(classification) -> bool:
+    return isinstance(classification, dict) and all(
+        k in classification for k in ['document_type', 'subject_area', 'specific_subject']
+    )
+
+
+def validate_classification(classification) -> Dict:
+    """classification if it has the required fields, else the fallback"""
+    return classification if _has_required_fields(classification) else _default_classification()
+
+
 def _default_classification() -> Dict:
     """Fallback classification"""
     return {
@@ -111,14 +318,18 @@ def _default_classification() -> Dict:
     }
 
 
-async def classify_and_recommend(text_content: str) -> Dict:
+async def classify_and_recommend(text_content: str, classification: Optional[Dict] = None) -> Dict:
     """
     Classify document and provide specific recommendations
     
+    Args:
+        classification: already-parsed classification (skips the LLM call)
+    
     Returns classification plus actionable recommendations
     """
     
-    classification = await classify_document(text_content)
+    if classification is None:
+        classification = await classify_document(text_content)
     
     # Add specific processing recommendations
     subject = classification['subject_area']
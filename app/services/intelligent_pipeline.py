@@ -12,29 +12,50 @@ Routers should call `process_uploaded_pdf(...)` and return its response.
 from __future__ import annotations
 
 import asyncio
-import json
-from typing import Any, Dict, Optional, Tuple
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 
-from loguru import logger
+import orjson
+from pydantic import ValidationError
 
 from .cache import sha256_bytes
-from .db import new_uuid, upload_pdf_to_storage, upsert_document
-from .extractor_router import choose_learning_model
-from .intelligent_classifier import classify_and_recommend
-from .llm import llm
-from .pdf import extract_text_from_pdf
-from .syllabus_processor import process_syllabus
-from .universal_extractors import extract_by_learning_model
-from .concept_engine import update_class_graph
-
-
-def _to_guide_json(units: list[dict[str, Any]]) -> dict[str, Any]:
-    """Convert extractor units into your existing guide_json format."""
+from .db import find_document_by_hash, new_uuid, upload_pdf_to_storage, upsert_document
+from .extractor_router import classify_and_route
+from .json_utils import safe_json_loads, take_complete_objects
+from ..schemas import FlashcardOut, FlashcardsOut
+from ..settings import settings
+from .llm import json_schema_format, llm, llm_json, llm_stream, prompt_shard
+from .pdf import extract_text_from_pdf_async
+from . import semantic_cache
+from .syllabus_processor import process_syllabus, process_syllabus_with_summary
+from .tokens import join_within_budget, truncate_to_tokens
+from .universal_extractors import BASE_RULES, extract_by_learning_model, model_brief, normalize_units
+from .concept_engine import update_class_graph_in_background
+
+
+_EMPTY_CARDS_JSON = orjson.dumps({"cards": []}).decode()
+_EMPTY_GUIDE_JSON = orjson.dumps({"concepts": []}).decode()
+
+# Input budgets (tokens) for the document-wide LLM calls
+SUMMARY_INPUT_TOKENS = 6000
+FLASHCARD_CONTEXT_TOKENS = 3000
+
+# Char cut applied once per upload before token budgeting; generous enough
+# (~8 chars/token) that the token budget, not this, decides what is sent.
+_MAX_LLM_CHARS = SUMMARY_INPUT_TOKENS * 8
+
+
+def _to_guide_json(units: list[dict[str, Any]], edges: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+    """Convert extractor units (+ edges) into your existing guide_json format.
+
+    Units come from universal_extractors.normalize_units, which already caps
+    every field length.
+    """
     concepts = []
     for u in units:
         concepts.append(
             {
-                "name": u.get("name", "")[:200],
+                "name": u.get("name", ""),
                 "importance": u.get("importance", "important"),
                 "difficulty": u.get("difficulty", "medium"),
                 "simple": u.get("simple", ""),
@@ -44,42 +65,56 @@ def _to_guide_json(units: list[dict[str, Any]]) -> dict[str, Any]:
                 "common_mistake": u.get("common_mistake", ""),
             }
         )
-    return {"concepts": concepts}
+    return {"concepts": concepts, "edges": list(edges or [])}
+
+
+# Static so the provider can reuse its prompt cache across uploads; the
+# per-call word target goes in the user message.
+_SUMMARY_SYSTEM = (
+    "Write detailed structured study notes in markdown. "
+    "Use headings/subheadings, bullets, and clear spacing. "
+    "Prioritize what will be tested and what helps a student perform well. "
+    "Avoid fluff."
+)
+semantic_cache.register_prompt("summary", _SUMMARY_SYSTEM)
 
 
 async def _make_markdown_summary(text: str, *, word_target: int) -> str:
-    src = (text or "")[:18000]
+    src = truncate_to_tokens(text or "", SUMMARY_INPUT_TOKENS)
     if not src.strip():
         return ""
-    return await llm(
+    hit = semantic_cache.lookup("summary", src, word_target=word_target)
+    if hit is not None:
+        return hit
+    out = await llm(
         [
-            {
-                "role": "system",
-                "content": (
-                    f"Write detailed structured study notes in markdown (~{word_target} words). "
-                    "Use headings/subheadings, bullets, and clear spacing. "
-                    "Prioritize what will be tested and what helps a student perform well. "
-                    "Avoid fluff."
-                ),
-            },
-            {"role": "user", "content": src},
+            {"role": "system", "content": _SUMMARY_SYSTEM},
+            {"role": "user", "content": f"{src}\n\nLength: ~{word_target} words."},
         ],
         max_tokens=2500,
         temperature=0.2,
+        prompt_cache_key=prompt_shard("summary"),
     )
+    if out:
+        semantic_cache.store("summary", src, out, word_target=word_target)
+    return out
 
 
-async def _make_flashcards(units: list[dict[str, Any]], *, max_cards: int = 30) -> dict[str, Any]:
-    """Return old-format cards_json: {"cards":[{"type","front","back"}]}"""
-    if not units:
-        return {"cards": []}
+def _unit_card_context(i: int, u: dict[str, Any]) -> str:
+    # Every field capped: the flashcard prompt only needs the gist of a unit
+    gist = u.get("simple") or u.get("detailed") or ""
+    example = u.get("example") or ""
+    mistake = u.get("common_mistake") or ""
+    return f"{i}. {u.get('name', '')}: {gist[:280]}\nExample: {example[:240]}\nMistake: {mistake[:200]}"
 
-    # Build compact context
-    blob = "\n\n".join(
-        [
-            f"{i+1}. {u.get('name','')}: {u.get('simple','') or u.get('detailed','')[:180]}\nExample: {u.get('example','')}\nMistake: {u.get('common_mistake','')}"
-            for i, u in enumerate(units[:12])
-        ]
+
+_FLASHCARDS_SYSTEM = {"role": "system", "content": "You create effective study flashcards."}
+
+
+def _flashcards_prompt(units: list[dict[str, Any]], max_cards: int) -> Tuple[str, list[dict[str, str]]]:
+    """(context blob, messages) for flashcard generation from learning units."""
+    blob = join_within_budget(
+        (_unit_card_context(i, u) for i, u in enumerate(units[:12], start=1)), "\n\n", FLASHCARD_CONTEXT_TOKENS
     )
 
     prompt = f"""
@@ -100,41 +135,234 @@ Rules:
 Learning units:
 {blob}
 """
+    return blob, [
+        _FLASHCARDS_SYSTEM,
+        {"role": "user", "content": prompt},
+    ]
+
+
+# The template rendered with no units stands in for the inline prompt
+semantic_cache.register_prompt("flashcards", _flashcards_prompt([], 0)[1], FlashcardsOut.model_json_schema())
+
+
+def _card_row(c: FlashcardOut) -> Optional[dict[str, str]]:
+    # Shape is schema-enforced; only trim lengths and skip blank cards
+    front = c.front.strip()
+    back = c.back.strip()
+    if not front or not back:
+        return None
+    return {"type": c.type, "front": front[:500], "back": back[:2000]}
+
+
+async def _make_flashcards(units: list[dict[str, Any]], *, max_cards: int = 30) -> dict[str, Any]:
+    """Return old-format cards_json: {"cards":[{"type","front","back"}]}"""
+    if not units:
+        return {"cards": []}
+
+    blob, messages = _flashcards_prompt(units, max_cards)
+    hit = semantic_cache.lookup("flashcards", blob, max_cards=max_cards)
+    if hit is not None:
+        return hit
 
     try:
-        resp = await llm(
-            [
-                {"role": "system", "content": "You create effective study flashcards."},
-                {"role": "user", "content": prompt},
-            ],
+        data = await llm_json(
+            messages,
+            FlashcardsOut,
             max_tokens=1600,
             temperature=0.2,
+            prompt_cache_key=prompt_shard("flashcards"),
         )
-        data = json.loads(resp)
-        if not isinstance(data, dict) or not isinstance(data.get("cards"), list):
+        if data is None:
             return {"cards": []}
 
-        # normalize
-        cards = []
-        for c in data.get("cards", [])[: max_cards + 5]:
-            if not isinstance(c, dict):
-                continue
-            front = (c.get("front") or "").strip()
-            back = (c.get("back") or "").strip()
-            if not front or not back:
-                continue
-            cards.append(
-                {
-                    "type": (c.get("type") or "qa")[:30],
-                    "front": front[:500],
-                    "back": back[:2000],
-                }
-            )
-        return {"cards": cards[:max_cards]}
+        cards = [row for row in map(_card_row, data.cards[: max_cards + 5]) if row]
+        out = {"cards": cards[:max_cards]}
+        if cards:
+            semantic_cache.store("flashcards", blob, out, max_cards=max_cards)
+        return out
     except Exception:
         return {"cards": []}
 
 
+def _complete_flashcards(raw: str) -> bool:
+    """Whether a flashcards reply parses whole (a stream cut off by
+    max_tokens leaves the JSON unclosed)"""
+    try:
+        FlashcardsOut.model_validate_json(raw)
+    except ValidationError:
+        return False
+    return True
+
+
+async def stream_flashcards(
+    units: list[dict[str, Any]], *, max_cards: int = 30, fresh: bool = False
+) -> AsyncIterator[dict[str, str]]:
+    """_make_flashcards, yielding each card as soon as the model finishes
+    writing it (same prompt, schema and caches). fresh skips the caches
+    (the stored set is replaced once the new one completes)."""
+    if not units:
+        return
+
+    blob, messages = _flashcards_prompt(units, max_cards)
+    hit = None if fresh else semantic_cache.lookup("flashcards", blob, max_cards=max_cards)
+    if hit is not None:
+        for card in hit.get("cards", []):
+            yield card
+        return
+
+    buf = ""
+    pos = -1  # index just inside the "cards" array, once seen
+    cards: list[dict[str, str]] = []
+    async for piece in llm_stream(
+        messages,
+        response_format=json_schema_format(FlashcardsOut),
+        max_tokens=1600,
+        temperature=0.2,
+        prompt_cache_key=prompt_shard("flashcards"),
+        cache_ttl=0 if fresh else settings.LLM_CACHE_TTL_SECONDS,
+        accept=_complete_flashcards,
+    ):
+        buf += piece
+        if pos < 0:
+            bracket = buf.find("[")
+            if bracket < 0:
+                continue
+            pos = bracket + 1
+        objs, pos = take_complete_objects(buf, pos)
+        for obj in objs:
+            try:
+                row = _card_row(FlashcardOut.model_validate(obj))
+            except ValidationError:
+                continue
+            if row and len(cards) < max_cards:
+                cards.append(row)
+                yield row
+
+    # _make_flashcards reads this key too: never store a truncated set
+    if cards and _complete_flashcards(buf):
+        semantic_cache.store("flashcards", blob, {"cards": cards}, max_cards=max_cards)
+
+
+@lru_cache(maxsize=16)
+def _combined_system(learning_model: str) -> str:
+    """Combined-call system prompt, rendered once per learning model. The
+    per-upload lengths go in the user message so this stays a stable,
+    provider-cacheable prefix."""
+    return f"""
+{model_brief(learning_model)}
+
+{BASE_RULES}
+
+In the same response also write:
+- summary: detailed structured study notes in markdown (length given below the excerpt), with headings/subheadings, bullets and clear spacing. Prioritize what will be tested. Avoid fluff.
+- cards: high-quality flashcards built from the units (count given below the excerpt). Focus on testable knowledge and common mistakes. Keep fronts short; backs should teach. Avoid duplicates.
+
+Return ONLY JSON in this exact shape:
+{{
+  "summary": "markdown...",
+  "cards": [
+    {{"type":"definition|qa|concept|procedure|application","front":"...","back":"..."}}
+  ],
+  "units": [ ... ],
+  "edges": [ ... ],
+  "rejects": ["..."],
+  "coverage_notes": "..."
+}}
+"""
+
+
+async def _make_combined_materials(
+    text: str, *, learning_model: str, word_target: int, max_cards: int = 30
+) -> Tuple[Dict[str, Any], str, dict[str, Any]]:
+    """Extraction + summary + flashcards in a single LLM call.
+
+    Returns (extractor_result, summary_md, cards_obj) in the same shapes as
+    extract_by_learning_model / _make_markdown_summary / _make_flashcards.
+    """
+    raw = await llm(
+        [
+            {"role": "system", "content": _combined_system((learning_model or "").strip().lower())},
+            {
+                "role": "user",
+                "content": (
+                    f"Document excerpt:\n{truncate_to_tokens(text or '', SUMMARY_INPUT_TOKENS)}\n\n"
+                    f"Summary length: ~{word_target} words. Flashcards: {min(max_cards, 30)}."
+                ),
+            },
+        ],
+        max_tokens=4500,
+        temperature=0.2,
+        prompt_cache_key=prompt_shard("combined"),
+    )
+    data = safe_json_loads(raw, default={})
+    if not isinstance(data, dict):
+        data = {}
+
+    summary = data.get("summary")
+    cards: list[dict[str, str]] = []
+    for c in data.get("cards") or []:
+        try:
+            row = _card_row(FlashcardOut.model_validate(c))
+        except ValidationError:
+            continue
+        if row:
+            cards.append(row)
+    return (
+        normalize_units(data),
+        summary.strip() if isinstance(summary, str) else "",
+        {"cards": cards[:max_cards]},
+    )
+
+
+def _reusable(existing: Dict[str, Any], *, want_summary: bool, want_cards: bool, want_guide: bool) -> bool:
+    """Whether a stored document has every output this upload asked for."""
+    cards = safe_json_loads(existing.get("cards_json") or "{}", default={})
+    guide = safe_json_loads(existing.get("guide_json") or "{}", default={})
+    has_cards = isinstance(cards, dict) and bool(cards.get("cards"))
+    has_guide = isinstance(guide, dict) and bool(guide.get("concepts"))
+    # Syllabi are stored with no cards or concepts (syllabus_data itself
+    # isn't persisted), so they always go through the pipeline again.
+    if not has_cards and not has_guide:
+        return False
+    return bool(
+        (existing.get("summary") or not want_summary)
+        and (has_cards or not want_cards)
+        and (has_guide or not want_guide)
+    )
+
+
+def _reused_response(
+    existing: Dict[str, Any],
+    *,
+    doc_type: str,
+    learning_model: str,
+    subject_area: str,
+    classification: Dict[str, Any],
+    route: Dict[str, Any],
+) -> Dict[str, Any]:
+    """process_uploaded_pdf's response for a stored copy of the same file."""
+    guide_json = existing.get("guide_json") or _EMPTY_GUIDE_JSON
+    guide = safe_json_loads(guide_json, default={})
+    return {
+        "id": existing["id"],
+        "document_type": doc_type,
+        "learning_model": learning_model,
+        "subject_area": subject_area,
+        "classification": classification,
+        "routing": route,
+        "extractor": {
+            "rejects": [],
+            "coverage_notes": "",
+            "units_count": len(guide.get("concepts") or []) if isinstance(guide, dict) else 0,
+        },
+        "summary": existing.get("summary") or "",
+        "cards_json": existing.get("cards_json") or _EMPTY_CARDS_JSON,
+        "guide_json": guide_json,
+        "pdf_path": existing.get("pdf_path"),
+        "reused": True,
+    }
+
+
 async def process_uploaded_pdf(
     *,
     user_id: str,
@@ -152,40 +380,72 @@ async def process_uploaded_pdf(
     if not raw_pdf:
         raise ValueError("Empty file")
 
-    # 1) Extract text
-    text_content = extract_text_from_pdf(raw_pdf) or ""
+    # 1) Same file already processed into this class: its stored outputs
+    # replace extraction / summary / cards below (identical bytes ->
+    # identical text)
+    content_hash = await asyncio.to_thread(sha256_bytes, raw_pdf)
+    existing = await asyncio.to_thread(
+        find_document_by_hash, user_id=user_id, class_id=class_id, content_hash=content_hash
+    )
+    if existing and not _reusable(existing, want_summary=want_summary, want_cards=want_cards, want_guide=want_guide):
+        existing = None
+
+    # 2) Extract text (CPU-bound; kept off the event loop)
+    # Pages past the LLM input budget are never read; cut once so no step
+    # below copies or tokenizes more than that
+    text_content = await extract_text_from_pdf_async(raw_pdf, max_chars=_MAX_LLM_CHARS) or ""
     if len(text_content.strip()) < 100:
         raise ValueError("Could not extract text")
+    text_content = text_content[:_MAX_LLM_CHARS]
 
-    # 2) High-level classification
-    classification_pack = await classify_and_recommend(text_content)
+    # 3) High-level classification + learning model (extractor), one LLM call
+    classification_pack, route = await classify_and_route(text_content)
     cls = (classification_pack or {}).get("classification", {}) if isinstance(classification_pack, dict) else {}
     doc_type = (cls.get("document_type") or "document").lower()
 
-    # 3) Choose learning model (extractor)
-    route = await choose_learning_model(text_content=text_content, classification=cls)
     learning_model = route["learning_model"]
     mapped_subject_area = route["mapped_subject_area"]
 
-    # 4) Create document id + upload to storage
+    # Classified as before (a repeat of the same excerpt is served from the
+    # LLM cache) so a reused document gets the full response shape
+    if existing and doc_type != "syllabus":
+        return _reused_response(
+            existing,
+            doc_type=doc_type,
+            learning_model=learning_model,
+            subject_area=mapped_subject_area,
+            classification=cls,
+            route=route,
+        )
+
+    # 4) Create document id + upload to storage in the background; it only
+    # has to finish before the document row is written, so it overlaps the
+    # syllabus / extraction LLM calls below.
     doc_id = new_uuid()
-    content_hash = sha256_bytes(raw_pdf)
-    pdf_path = upload_pdf_to_storage(user_id=user_id, doc_id=doc_id, raw_pdf=raw_pdf, filename=filename)
+    upload_task = asyncio.create_task(
+        asyncio.to_thread(upload_pdf_to_storage, user_id=user_id, doc_id=doc_id, raw_pdf=raw_pdf, filename=filename)
+    )
 
     # 5) Syllabus path
     if doc_type == "syllabus":
-        syllabus_data = await process_syllabus(text_content)
-
-        summary_md = await _make_markdown_summary(text_content, word_target=min(word_target, 1400)) if want_summary else ""
+        if settings.ENABLE_COMBINED_CALL and want_summary:
+            syllabus_data, summary_md = await process_syllabus_with_summary(
+                text_content, word_target=min(word_target, 1400)
+            )
+        else:
+            syllabus_data = await process_syllabus(text_content)
+            summary_md = await _make_markdown_summary(text_content, word_target=min(word_target, 1400)) if want_summary else ""
+        pdf_path = await upload_task
 
-        upsert_document(
+        await asyncio.to_thread(
+            upsert_document,
             user_id=user_id,
             doc_id=doc_id,
             class_id=class_id,
             title=title or (filename or "Syllabus"),
             summary=summary_md,
-            cards_json=json.dumps({"cards": []}),
-            guide_json=json.dumps({"concepts": []}),
+            cards_json=_EMPTY_CARDS_JSON,
+            guide_json=_EMPTY_GUIDE_JSON,
             pdf_path=pdf_path,
             content_hash=content_hash,
         )
@@ -200,27 +460,39 @@ async def process_uploaded_pdf(
             "routing": route,
             "syllabus_data": syllabus_data,
             "summary": summary_md,
-            "cards_json": json.dumps({"cards": []}),
-            "guide_json": json.dumps({"concepts": []}),
+            "cards_json": _EMPTY_CARDS_JSON,
+            "guide_json": _EMPTY_GUIDE_JSON,
             "pdf_path": pdf_path,
         }
 
     # 6) Extraction + materials
-    extractor_result = await extract_by_learning_model(learning_model, text_content)
-    units = extractor_result.get("units", []) if isinstance(extractor_result, dict) else []
+    if settings.ENABLE_COMBINED_CALL:
+        extractor_result, summary_md, cards_obj = await _make_combined_materials(
+            text_content, learning_model=learning_model, word_target=word_target
+        )
+        units = extractor_result["units"]
+        unit_edges = extractor_result["edges"]
+        summary_md = summary_md if want_summary else ""
+        cards_obj = cards_obj if want_cards else {"cards": []}
+    else:
+        extractor_result = await extract_by_learning_model(learning_model, text_content)
+        units = extractor_result.get("units", []) if isinstance(extractor_result, dict) else []
+        unit_edges = extractor_result.get("edges", []) if isinstance(extractor_result, dict) else []
 
-    guide_obj = _to_guide_json(units) if want_guide else {"concepts": []}
+        summary_task = _make_markdown_summary(text_content, word_target=word_target) if want_summary else asyncio.sleep(0, result="")
+        cards_task = _make_flashcards(units) if want_cards else asyncio.sleep(0, result={"cards": []})
 
-    summary_task = _make_markdown_summary(text_content, word_target=word_target) if want_summary else asyncio.sleep(0, result="")
-    cards_task = _make_flashcards(units) if want_cards else asyncio.sleep(0, result={"cards": []})
+        summary_md, cards_obj = await asyncio.gather(summary_task, cards_task)
 
-    summary_md, cards_obj = await asyncio.gather(summary_task, cards_task)
+    guide_obj = _to_guide_json(units, unit_edges) if want_guide else {"concepts": []}
 
-    guide_json = json.dumps(guide_obj, ensure_ascii=False)
-    cards_json = json.dumps(cards_obj, ensure_ascii=False)
+    guide_json = orjson.dumps(guide_obj).decode()
+    cards_json = orjson.dumps(cards_obj).decode()
 
     # 7) Store document correctly
-    upsert_document(
+    pdf_path = await upload_task
+    await asyncio.to_thread(
+        upsert_document,
         user_id=user_id,
         doc_id=doc_id,
         class_id=class_id,
@@ -232,12 +504,10 @@ async def process_uploaded_pdf(
         content_hash=content_hash,
     )
 
-    # 8) Update concept graph (best-effort)
+    # 8) Update concept graph (best-effort, in the background: the response
+    # doesn't depend on it)
     if want_guide and guide_obj.get("concepts"):
-        try:
-            await update_class_graph(class_id=class_id, doc_id=doc_id, guide_json=guide_json)
-        except Exception as e:
-            logger.warning(f"[graph] update_class_graph failed: {e}")
+        update_class_graph_in_background(class_id=class_id, doc_id=doc_id, guide_json=guide_obj)
 
     return {
         "id": doc_id,
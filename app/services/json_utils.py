@@ -11,15 +11,106 @@ from __future__ import annotations
 
 import json
 import re
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import orjson
+from pydantic import BaseModel, ValidationError
 
 
 _FENCE_RE = re.compile(r"```(?:json|JSON)?\s*|```", re.MULTILINE)
+# First '{' through last '}' (greedy), searched on the encoded bytes
+_JSON_OBJ_RE = re.compile(rb"\{.*\}", re.DOTALL)
+# Characters that matter when scanning for a balanced JSON value
+_STRUCT_RE = re.compile(r'[{}\[\]"\\]')
 
 
 def clean_llm_text(s: str) -> str:
     """Remove markdown code fences and trim."""
-    return _FENCE_RE.sub("", s or "").strip()
+    if not s:
+        return ""
+    if "```" not in s:  # the common case once JSON mode is on
+        return s.strip()
+    return _FENCE_RE.sub("", s).strip()
+
+
+try:  # optional: compiled byte scanner for large responses
+    import numba
+    import numpy as np
+
+    @numba.njit(cache=True)
+    def _scan_close(buf) -> int:
+        # Same walk as the Python loop below, over UTF-8 bytes ('{' 123,
+        # '}' 125, '[' 91, ']' 93, '"' 34, '\\' 92 are never part of a
+        # multi-byte sequence, so byte offsets of them are exact).
+        stack = np.empty(buf.shape[0], np.uint8)
+        depth = 0
+        in_string = False
+        i = 0
+        n = buf.shape[0]
+        while i < n:
+            c = buf[i]
+            if in_string:
+                if c == 92:
+                    i += 2
+                    continue
+                if c == 34:
+                    in_string = False
+            elif c == 34:
+                in_string = True
+            elif c == 123 or c == 91:
+                stack[depth] = c + 2
+                depth += 1
+            elif c == 125 or c == 93:
+                if depth == 0 or stack[depth - 1] != c:
+                    return -1
+                depth -= 1
+                if depth == 0:
+                    return i
+            i += 1
+        return -1
+
+except ImportError:
+    _scan_close = None
+
+
+def _match_close(t: str, start: int) -> int:
+    """Index of the bracket closing the one at t[start], or -1.
+
+    Single forward pass tracking bracket depth, skipping brackets inside
+    string literals (with escapes). The regex jumps straight between the
+    structural characters, so plain text is never looped over in Python.
+    Uses the numba scanner instead when it is installed.
+    """
+    if _scan_close is not None:
+        b = t[start:].encode()
+        end = _scan_close(np.frombuffer(b, dtype=np.uint8))
+        if end < 0 or t.isascii():
+            return end if end < 0 else start + end
+        return start + len(b[: end + 1].decode()) - 1
+
+    stack = []
+    in_string = False
+    skip = -1  # index of a character escaped by a preceding backslash
+    for m in _STRUCT_RE.finditer(t, start):
+        i = m.start()
+        if i == skip:
+            continue
+        ch = t[i]
+        if in_string:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack.pop() != ch:
+                return -1
+            if not stack:
+                return i
+    return -1
 
 
 def extract_json_substring(s: str) -> Optional[str]:
@@ -28,12 +119,17 @@ def extract_json_substring(s: str) -> Optional[str]:
     Strategy:
     - remove code fences
     - find first '{' or '['
-    - find the matching last '}' or ']'
+    - scan forward to its matching close (so trailing prose containing
+      brackets isn't swallowed)
+    - if that fails (truncated/unbalanced output), fall back to the last
+      matching end char
     - return that slice
     """
-    t = clean_llm_text(s)
-    if not t:
+    # Only fences need removing: the slice below starts and ends on
+    # brackets, so surrounding whitespace never needs stripping (or copying).
+    if not s:
         return None
+    t = _FENCE_RE.sub("", s) if "```" in s else s
 
     # Find first JSON start
     start_obj = t.find("{")
@@ -51,8 +147,10 @@ def extract_json_substring(s: str) -> Optional[str]:
         start = min(start_obj, start_arr)
         end_char = "}" if start == start_obj else "]"
 
-    # Find last matching end char
-    end = t.rfind(end_char)
+    end = _match_close(t, start)
+    if end == -1:
+        # Find last matching end char
+        end = t.rfind(end_char)
     if end == -1 or end <= start:
         return None
     return t[start : end + 1]
@@ -62,10 +160,80 @@ def safe_json_loads(s: str, *, default: Any = None) -> Any:
     """Best-effort json.loads for LLM responses."""
     if default is None:
         default = {}
+    if not s:
+        return default
+    # Fast path: JSON-mode replies are usually the bare object, so let
+    # orjson validate the whole body before scanning for a substring.
+    try:
+        data = orjson.loads(s)
+    except orjson.JSONDecodeError:
+        pass
+    else:
+        if isinstance(data, (dict, list)):
+            return data
     sub = extract_json_substring(s)
     if not sub:
         return default
+    try:
+        return orjson.loads(sub)
+    except orjson.JSONDecodeError:
+        pass
+    # stdlib is laxer (NaN/Infinity, ints beyond 64 bits)
     try:
         return json.loads(sub)
-    except Exception:
+    except ValueError:
         return default
+
+
+def conforms(shape: Type[BaseModel], data: Any) -> bool:
+    """True if data validates against the pydantic model shape (pydantic's
+    compiled validator; the parsed dict itself is used as-is)."""
+    try:
+        shape.model_validate(data)
+    except ValidationError:
+        return False
+    return True
+
+
+def loads_object(raw: str | bytes | None) -> Dict[str, Any]:
+    """Parse an LLM response that should be a JSON object; {} on failure.
+
+    Tries the whole body first, then the outermost {...} span (for replies
+    with surrounding prose).
+    """
+    if not raw:
+        return {}
+    b = raw.encode("utf-8") if isinstance(raw, str) else raw
+    try:
+        data = orjson.loads(b)
+    except orjson.JSONDecodeError:
+        m = _JSON_OBJ_RE.search(b)
+        if not m:
+            return {}
+        try:
+            data = orjson.loads(m.group())
+        except orjson.JSONDecodeError:
+            return {}
+    return data if isinstance(data, dict) else {}
+
+
+def take_complete_objects(t: str, pos: int) -> Tuple[List[Any], int]:
+    """Parse every complete {...} object at or after pos in a growing buffer.
+
+    For streamed arrays of objects: call with pos just inside the '[' and
+    again with the returned position as more text arrives. An object still
+    being written is left for the next call.
+    """
+    out: List[Any] = []
+    while True:
+        start = t.find("{", pos)
+        if start == -1:
+            return out, pos
+        end = _match_close(t, start)
+        if end == -1:
+            return out, start
+        try:
+            out.append(orjson.loads(t[start : end + 1]))
+        except orjson.JSONDecodeError:
+            pass
+        pos = end + 1
@@ -36,11 +36,19 @@ Output format is compatible with your existing UI + concept_engine:
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import heapq
 import re
+from collections import OrderedDict
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Optional
 
-from .llm import llm
+import orjson
+
+from ..settings import settings
+from .llm import llm, prompt_shard
 from .json_utils import safe_json_loads
 
 
@@ -72,14 +80,38 @@ Return ONLY valid JSON:
 """
 
 
+# Parsed router results by document-prefix hash (LRU). Exact repeats are
+# also in llm()'s cache; this one skips the prompt hashing and parse, and
+# whitespace normalization lets re-exported copies of a document share it.
+_ROUTE_CACHE: "OrderedDict[bytes, Dict]" = OrderedDict()
+_ROUTE_CACHE_SIZE = 512
+
+
 async def route_extraction_mode(text: str) -> Dict:
+    prefix = " ".join(text[:3000].split())
+    key = hashlib.blake2b(prefix.encode("utf-8"), digest_size=16).digest()
+    hit = _ROUTE_CACHE.get(key)
+    if hit is not None:
+        _ROUTE_CACHE.move_to_end(key)
+        return dict(hit)
+
+    route = await _route_uncached(prefix)
+    if route.get("reason") != "parse_failed":
+        _ROUTE_CACHE[key] = route
+        if len(_ROUTE_CACHE) > _ROUTE_CACHE_SIZE:
+            _ROUTE_CACHE.popitem(last=False)
+    return dict(route)
+
+
+async def _route_uncached(prefix: str) -> Dict:
     resp = await llm(
         [
             {"role": "system", "content": ROUTER_PROMPT},
-            {"role": "user", "content": text[:3000]},
+            {"role": "user", "content": prefix},
         ],
         max_tokens=300,
         temperature=0.1,
+        prompt_cache_key=prompt_shard("kg_router"),
     )
     data = safe_json_loads(resp, default={})
     if not isinstance(data, dict):
@@ -137,15 +169,19 @@ Rules:
 - Don't invent facts not present in the text
 """
 
-    if mode == "stem":
-        return base + "\nFocus on: definitions, formulas, algorithms, problem methods, key assumptions."
-    if mode == "humanities":
-        return base + "\nFocus on: themes, events, people, movements, arguments, primary-source claims."
-    if mode == "social_science":
-        return base + "\nFocus on: theories, variables, studies, methods, models, interpretations."
-    if mode == "writing":
-        return base + "\nFocus on: thesis building, evidence use, structure, rhetoric, style, revision strategies."
-    return base + "\nFocus on: whatever would be tested in this course."
+    return base + _mode_focus(mode)
+
+
+_MODE_FOCUS = {
+    "stem": "definitions, formulas, algorithms, problem methods, key assumptions.",
+    "humanities": "themes, events, people, movements, arguments, primary-source claims.",
+    "social_science": "theories, variables, studies, methods, models, interpretations.",
+    "writing": "thesis building, evidence use, structure, rhetoric, style, revision strategies.",
+}
+
+
+def _mode_focus(mode: str) -> str:
+    return "\nFocus on: " + _MODE_FOCUS.get(mode, "whatever would be tested in this course.")
 
 
 # NOTE: coarse edge type is DB-safe; label is the real meaning.
@@ -193,6 +229,71 @@ Rules:
 """
 
 
+# Candidate + refine in one call: the model sees the document once and
+# returns candidates, the kept subset and edges together.
+COMBINED_PROMPT = r"""
+You will extract "learning units" from a document, pick the core study concepts,
+and connect them with meaningful edges.
+
+Each unit must be something a student can be tested on.
+Avoid trivial vocabulary, obvious section headings, or administrative fluff.
+
+Return ONLY valid JSON:
+{
+  "candidates": [
+    {
+      "name": "...",              // short label
+      "unit_type": "...",         // e.g., formula|method|theme|event|argument|skill|device|framework|policy|process
+      "importance": 1,             // 1..5 (5 = essential to pass)
+      "difficulty": "easy|medium|hard",
+      "simple": "1-2 sentences",
+      "detailed": "4-6 sentences",
+      "technical": "optional: formalism/structure",
+      "example": "specific example (numbers / quote / scenario)",
+      "common_mistake": "realistic misunderstanding",
+      "evidence": ["short phrases copied from text (<=12 words each)"],
+      "prereqs": ["names of other units if clearly needed"]
+    }
+  ],
+  "keep": [
+    {
+      "name": "...",              // must exactly match a candidate name
+      "why_keep": "short",
+      "final_importance": 1        // 1..5
+    }
+  ],
+  "edges": [
+    {
+      "from": "Unit A",
+      "to": "Unit B",
+      "type": "prereq|related|part_of|example_of|causes",
+      "label": "short_verb_phrase",  // e.g. defines, applies_to, derived_from, contrasts_with, leads_to
+      "strength": 1,               // 1..5
+      "confidence": 0.0,           // 0..1
+      "evidence": ["short phrases copied from the document (<=12 words)"],
+      "why": "short"
+    }
+  ]
+}
+
+Rules:
+- Propose 18-24 candidates to maximize coverage
+- Importance MUST be meaningful (most should be 2-4; only a few 5)
+- Keep 8-12 units total
+- Create 8-16 edges if possible (avoid isolated nodes); max 18
+- Edges must be only between kept units
+- Prefer specific relationships: part_of, causes, example_of
+- Use prereq only if the document implies learning order (before/after/requires/must know)
+- Use related only if label is specific (contrasts_with/influences/supports/etc.)
+- Evidence MUST be copied from the text (no invented quotes)
+- Don't invent facts not present in the text
+"""
+
+
+def _combined_prompt(mode: str) -> str:
+    return COMBINED_PROMPT + _mode_focus(mode)
+
+
 EDGE_VALIDATE_PROMPT = r"""
 Validate edges in a course knowledge graph.
 
@@ -231,58 +332,57 @@ Rules:
 # Server-side enforcement
 # -----------------------------
 
+# Curly quotes / dashes -> ASCII, shared by name and evidence normalization
+_QUOTES_TABLE = str.maketrans({"’": "'", "‘": "'", "“": '"', "”": '"', "–": "-", "—": "-"})
+_WS_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\s'\-]")
+
+
+@lru_cache(maxsize=4096)
 def _normalize_name(s: str) -> str:
     """
     Strong normalization so concept matching works across:
     - curly quotes/apostrophes (’ “ ”) vs straight ( ' " )
     - punctuation differences
     - whitespace differences
+
+    Memoized: the same few dozen names (candidates, keep list, edge
+    endpoints from both passes, labels) are normalized over and over.
     """
     if not s:
         return ""
-    s = s.strip().lower()
-
-    s = (
-        s.replace("’", "'")
-        .replace("‘", "'")
-        .replace("“", '"')
-        .replace("”", '"')
-        .replace("–", "-")
-        .replace("—", "-")
-    )
+    s = s.strip().lower().translate(_QUOTES_TABLE)
 
-    s = re.sub(r"\s+", " ", s)
+    s = _WS_RE.sub(" ", s)
 
     # remove punctuation except quotes/hyphen
-    s = re.sub(r"[^\w\s'\-]", "", s)
+    s = _PUNCT_RE.sub("", s)
 
     return s.strip()
 
 
 def _normalize_text_for_evidence(t: str) -> str:
-    if not t:
-        return ""
-    return (
-        t.lower()
-        .replace("’", "'")
-        .replace("‘", "'")
-        .replace("“", '"')
-        .replace("”", '"')
-        .replace("–", "-")
-        .replace("—", "-")
-    )
+    return t.lower().translate(_QUOTES_TABLE) if t else ""
 
 
-def _evidence_supported(evidence: List[str], text_norm: str) -> bool:
+def _evidence_supported(evidence: List[str], text_norm: str, memo: Optional[Dict[str, bool]] = None) -> bool:
     """
     Cheap guardrail: at least one evidence snippet should appear in the text (case-insensitive).
     Prevents edges built on invented quotes.
+
+    memo (raw snippet -> found) lets the refine and validate passes share
+    lookups; validate mostly echoes refine's evidence back.
     """
     for s in evidence or []:
         ss = (s or "").strip()
         if not ss:
             continue
-        if _normalize_text_for_evidence(ss) in text_norm:
+        found = memo.get(ss) if memo is not None else None
+        if found is None:
+            found = _normalize_text_for_evidence(ss) in text_norm
+            if memo is not None:
+                memo[ss] = found
+        if found:
             return True
     return False
 
@@ -296,6 +396,15 @@ class Edge:
     strength: int
     confidence: float
     evidence: List[str]
+    # _normalize_name(src / dst), computed once
+    src_n: str = ""
+    dst_n: str = ""
+
+    def __post_init__(self) -> None:
+        if not self.src_n:
+            self.src_n = _normalize_name(self.src)
+        if not self.dst_n:
+            self.dst_n = _normalize_name(self.dst)
 
 
 DIRECTED_TYPES = {"prereq", "causes"}
@@ -321,34 +430,36 @@ def _dedupe_candidates(cands: List[Dict]) -> List[Dict]:
     return out
 
 
+def _importance(c: Dict) -> int:
+    try:
+        return int(c.get("importance") or 0)
+    except Exception:
+        return 0
+
+
 def _pick_top(cands: List[Dict], keep_names: List[str], *, max_nodes: int = 12, min_importance: int = 3) -> List[Dict]:
     """
     Refine might return names with tiny formatting differences.
     We match by normalized form (strong normalization).
     """
+    scored = [(c, _importance(c)) for c in cands]  # parse each importance once
+
     wanted_norm = {_normalize_name(n) for n in (keep_names or []) if n}
     chosen = []
-    for c in cands:
+    for c, imp in scored:
         nm = (c.get("name") or "").strip()
         if nm and _normalize_name(nm) in wanted_norm:
-            chosen.append(c)
+            chosen.append((c, imp))
 
-    # If refine returned too many/few, fall back to importance sorting
+    # If refine returned too many/few, fall back to importance sorting.
+    # Only max_nodes survive the cut below, and the ones the importance
+    # filter drops sort last, so a partial (stable) sort is enough.
     if len(chosen) < 6:
-        def score(x):
-            try:
-                return int(x.get("importance") or 0)
-            except Exception:
-                return 0
-        chosen = sorted(cands, key=score, reverse=True)
+        chosen = heapq.nlargest(max_nodes, scored, key=lambda x: x[1])
 
     # Enforce min_importance and max_nodes
     pruned = []
-    for c in chosen:
-        try:
-            imp = int(c.get("importance") or 0)
-        except Exception:
-            imp = 0
+    for c, imp in chosen:
         if imp < min_importance:
             continue
         pruned.append(c)
@@ -364,6 +475,7 @@ def _build_edge_list(
     text_norm: str,
     *,
     max_edges: int = 18,
+    evidence_memo: Optional[Dict[str, bool]] = None,
 ) -> List[Edge]:
     """
     Important:
@@ -420,7 +532,7 @@ def _build_edge_list(
         evidence = [(" ".join(str(x).split())[:200]) for x in evidence if str(x).strip()][:6]
 
         # Evidence guardrail (do not accept hallucinated edges)
-        if evidence and not _evidence_supported(evidence, text_norm):
+        if evidence and not _evidence_supported(evidence, text_norm, evidence_memo):
             continue
 
         key = (src_n, dst_n, typ, _normalize_name(label))
@@ -428,83 +540,108 @@ def _build_edge_list(
             continue
         dedup.add(key)
 
-        out.append(Edge(src=src, dst=dst, typ=typ, label=label, strength=strength, confidence=confidence, evidence=evidence))
+        out.append(
+            Edge(
+                src=src,
+                dst=dst,
+                typ=typ,
+                label=label,
+                strength=strength,
+                confidence=confidence,
+                evidence=evidence,
+                src_n=src_n,
+                dst_n=dst_n,
+            )
+        )
         if len(out) >= max_edges:
             break
 
     return out
 
 
+def _strongly_connected(adj: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan's SCC algorithm, iterative (explicit stack, no recursion)."""
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    on_stack = set()
+    stack: List[str] = []
+    sccs: List[List[str]] = []
+    counter = 0
+
+    for root in adj:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(adj.get(root, ())))]
+        while work:
+            u, it = work[-1]
+            advanced = False
+            for v in it:
+                if v not in index:
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack.add(v)
+                    work.append((v, iter(adj.get(v, ()))))
+                    advanced = True
+                    break
+                if v in on_stack:
+                    low[u] = min(low[u], index[v])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[u])
+            if low[u] == index[u]:
+                comp = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    comp.append(w)
+                    if w == u:
+                        break
+                sccs.append(comp)
+    return sccs
+
+
+def _directed_pairs(edges: List[Edge]) -> set:
+    return {(e.src_n, e.dst_n) for e in edges if e.typ in DIRECTED_TYPES}
+
+
 def _break_cycles(edges: List[Edge]) -> List[Edge]:
     """Break cycles only for directed prerequisite-like edges.
 
-We repeatedly detect a cycle among directed edges and remove the weakest
-edge from that cycle.
+Every strongly connected component with more than one node contains a
+cycle; drop its weakest internal edge (strength, then confidence) and
+repeat until all components are single nodes.
 """
-
-    def build_adj(es: List[Edge]):
-        adj = {}
-        for ed in es:
-            if ed.typ not in DIRECTED_TYPES:
-                continue
-            adj.setdefault(_normalize_name(ed.src), []).append(_normalize_name(ed.dst))
-        return adj
-
-    def find_cycle(adj):
-        visited = set()
-        stack = set()
-        parent = {}
-
-        def dfs(u):
-            visited.add(u)
-            stack.add(u)
-            for v in adj.get(u, []):
-                if v not in visited:
-                    parent[v] = u
-                    cyc = dfs(v)
-                    if cyc:
-                        return cyc
-                elif v in stack:
-                    path = [v]
-                    cur = u
-                    while cur != v and cur in parent:
-                        path.append(cur)
-                        cur = parent[cur]
-                    path.append(v)
-                    path.reverse()
-                    return path
-            stack.remove(u)
-            return None
-
-        for node in list(adj.keys()):
-            if node not in visited:
-                cyc = dfs(node)
-                if cyc:
-                    return cyc
-        return None
-
     out = list(edges)
     while True:
-        adj = build_adj(out)
-        cyc = find_cycle(adj)
-        if not cyc:
-            break
-
-        cycle_edges = []
-        for i in range(len(cyc) - 1):
-            a = cyc[i]
-            b = cyc[i + 1]
-            for ed in out:
-                if ed.typ in DIRECTED_TYPES and _normalize_name(ed.src) == a and _normalize_name(ed.dst) == b:
-                    cycle_edges.append(ed)
-
-        if not cycle_edges:
-            break
-
-        weakest = sorted(cycle_edges, key=lambda x: x.strength)[0]
-        out = [e for e in out if e is not weakest]
+        adj: Dict[str, List[str]] = {}
+        for ed in out:
+            if ed.typ in DIRECTED_TYPES:
+                adj.setdefault(ed.src_n, []).append(ed.dst_n)
+        if not adj:
+            return out
+
+        weakest = set()
+        for comp in _strongly_connected(adj):
+            if len(comp) < 2:
+                continue
+            members = set(comp)
+            internal = [
+                ed for ed in out
+                if ed.typ in DIRECTED_TYPES and ed.src_n in members and ed.dst_n in members
+            ]
+            weakest.add(id(min(internal, key=lambda x: (x.strength, x.confidence))))
 
-    return out
+        if not weakest:
+            return out
+        out = [e for e in out if id(e) not in weakest]
 
 
 def _importance_bucket(score_1_to_5: int) -> str:
@@ -515,57 +652,116 @@ def _importance_bucket(score_1_to_5: int) -> str:
     return "advanced"
 
 
-async def extract_knowledge_graph(text: str, *, max_nodes: int = 12) -> Dict:
-    """Main entry point.
-
-Returns a dict with concepts + edges.
-"""
-    route = await route_extraction_mode(text)
-    mode = route.get("extraction_mode", "mixed")
-
-    text_window = text[:6500]
-    text_norm = _normalize_text_for_evidence(text_window)
-
-    # 1) Candidate pass
-    cand_prompt = _candidate_prompt(mode)
+async def _candidate_pass(text_window: str, mode: str) -> List[Dict]:
     cand_resp = await llm(
         [
-            {"role": "system", "content": cand_prompt},
+            {"role": "system", "content": _candidate_prompt(mode)},
             {"role": "user", "content": text_window},
         ],
         max_tokens=3500,
         temperature=0.2,
+        prompt_cache_key=prompt_shard("kg_candidates"),
     )
     cand_data = safe_json_loads(cand_resp, default={"candidates": []})
     cands = cand_data.get("candidates", []) if isinstance(cand_data, dict) else []
-    if not isinstance(cands, list):
-        cands = []
-    cands = _dedupe_candidates(cands)
+    return cands if isinstance(cands, list) else []
+
 
-    # 2) Refine pass (pick top + edges)
+async def _combined_pass(text_window: str, mode: str) -> Optional[Dict]:
+    """
+    Candidate + refine in one call. Returns None unless the reply has a
+    candidate list plus keep/edges lists, so the caller can fall back to
+    the separate passes.
+    """
+    resp = await llm(
+        [
+            {"role": "system", "content": _combined_prompt(mode)},
+            {"role": "user", "content": text_window},
+        ],
+        max_tokens=5000,
+        temperature=0.2,
+        prompt_cache_key=prompt_shard("kg_combined"),
+    )
+    data = safe_json_loads(resp, default=None)
+    if not isinstance(data, dict):
+        return None
+    if not isinstance(data.get("candidates"), list) or not data["candidates"]:
+        return None
+    if not isinstance(data.get("keep"), list) or not isinstance(data.get("edges"), list):
+        return None
+    return data
+
+
+async def _refine_pass(cands: List[Dict]) -> Dict:
     refine_input = {
         "candidates": [
             {
                 "name": c.get("name"),
                 "importance": c.get("importance"),
                 "unit_type": c.get("unit_type"),
-                "simple": c.get("simple"),
             }
             for c in cands[:24]
         ]
     }
 
+    # keep entries (~30 tokens) plus about one edge (~60) per candidate
     refine_resp = await llm(
         [
             {"role": "system", "content": REFINE_PROMPT},
-            {"role": "user", "content": str(refine_input)},
+            {"role": "user", "content": orjson.dumps(refine_input).decode()},
         ],
-        max_tokens=2000,
+        max_tokens=min(2000, 400 + 90 * len(refine_input["candidates"])),
         temperature=0.2,
+        prompt_cache_key=prompt_shard("kg_refine"),
     )
     refine = safe_json_loads(refine_resp, default={"keep": [], "edges": []})
+    return refine if isinstance(refine, dict) else {}
+
+
+async def _route_and_combine(text: str, text_window: str):
+    """
+    Returns (route, combined-or-None).
+
+    With KG_SPECULATIVE_ROUTING the router runs alongside a "mixed"-mode
+    combined call; that result (even None) is kept when the router agrees,
+    otherwise it is discarded and the call is redone with the routed mode.
+    """
+    if not settings.KG_SPECULATIVE_ROUTING:
+        route = await route_extraction_mode(text)
+        return route, await _combined_pass(text_window, route.get("extraction_mode", "mixed"))
+
+    route, speculative = await asyncio.gather(
+        route_extraction_mode(text),
+        _combined_pass(text_window, "mixed"),
+    )
+    mode = route.get("extraction_mode", "mixed")
+    if mode == "mixed":
+        # a failed mixed call falls back to the separate passes, not a rerun
+        return route, speculative
+    return route, await _combined_pass(text_window, mode)
+
+
+async def extract_knowledge_graph(text: str, *, max_nodes: int = 12) -> Dict:
+    """Main entry point.
+
+Returns a dict with concepts + edges.
+"""
+    text_window = text[:6500]
+    text_norm = _normalize_text_for_evidence(text_window)
 
-    keep = refine.get("keep", []) if isinstance(refine, dict) else []
+    # 1) Route + combined candidate/refine pass
+    route, combined = await _route_and_combine(text, text_window)
+    mode = route.get("extraction_mode", "mixed")
+
+    if combined is not None:
+        cands = _dedupe_candidates(combined["candidates"])
+        refine = combined
+    else:
+        # 2) Fallback: separate candidate and refine passes
+        cands = _dedupe_candidates(await _candidate_pass(text_window, mode))
+        refine = await _refine_pass(cands)
+
+    keep = refine.get("keep", []) or []
     keep_names = [(k.get("name") or "").strip() for k in keep if isinstance(k, dict)]
 
     selected = _pick_top(cands, keep_names, max_nodes=max_nodes, min_importance=3)
@@ -575,13 +771,16 @@ Returns a dict with concepts + edges.
     kept_norm_to_name = {_normalize_name(n): n for n in kept_names}
 
     # 3) Build + sanitize edges from refine
-    edges_raw = refine.get("edges", []) if isinstance(refine, dict) else []
-    edges1 = _build_edge_list(edges_raw, kept_norm_to_name, text_norm, max_edges=18)
+    edges_raw = refine.get("edges", []) or []
+    evidence_memo: Dict[str, bool] = {}
+    edges1 = _build_edge_list(edges_raw, kept_norm_to_name, text_norm, max_edges=18, evidence_memo=evidence_memo)
     edges1 = _break_cycles(edges1)
 
-    # 4) Validation pass (downgrade instead of deleting)
-    edges_final = edges1
-    if edges1:
+    # 4) Validation pass (downgrade instead of deleting), only when there
+    # is a real graph with some low-confidence edges worth re-checking.
+    # The call is started here and awaited after the concept rows are built.
+    validate_task = None
+    if len(edges1) >= 4 and any(e.confidence < 0.6 for e in edges1):
         validate_payload = {
             "kept": kept_names,
             "edges": [
@@ -592,27 +791,30 @@ Returns a dict with concepts + edges.
                     "label": e.label,
                     "strength": e.strength,
                     "confidence": e.confidence,
-                    "evidence": e.evidence,
+                    # a prefix is enough to judge the edge (and still matches the doc)
+                    "evidence": [ev[:80] for ev in e.evidence],
                 }
                 for e in edges1[:18]
             ],
         }
-        validate_resp = await llm(
-            [
-                {"role": "system", "content": EDGE_VALIDATE_PROMPT},
-                {"role": "user", "content": str(validate_payload)},
-            ],
-            max_tokens=1600,
-            temperature=0.1,
+        validate_task = asyncio.create_task(
+            llm(
+                [
+                    {"role": "system", "content": EDGE_VALIDATE_PROMPT},
+                    {"role": "user", "content": orjson.dumps(validate_payload).decode()},
+                ],
+                # the reply echoes at most the edges sent (~80 tokens each)
+                max_tokens=min(1600, 200 + 80 * len(validate_payload["edges"])),
+                temperature=0.1,
+                prompt_cache_key=prompt_shard("kg_validate"),
+            )
         )
-        validated = safe_json_loads(validate_resp, default={"edges": []})
-        vraw = validated.get("edges", []) if isinstance(validated, dict) else []
-        edges2 = _build_edge_list(vraw, kept_norm_to_name, text_norm, max_edges=18)
-        edges2 = _break_cycles(edges2)
-
-        # Prefer validated edges if we still have a non-trivial graph
-        if len(edges2) >= 4:
-            edges_final = edges2
+        # Validate echoes those prefixes back; a prefix of a snippet found
+        # in the text is found too, so seed the memo instead of searching.
+        for e in edges1[:18]:
+            for ev in e.evidence:
+                if evidence_memo.get(ev):
+                    evidence_memo.setdefault(ev[:80].strip(), True)
 
     # 5) Final shape compatible with UI + concept_engine
     concepts = []
@@ -639,6 +841,21 @@ Returns a dict with concepts + edges.
             }
         )
 
+    edges_final = edges1
+    if validate_task is not None:
+        validate_resp = await validate_task
+        validated = safe_json_loads(validate_resp, default={"edges": []})
+        vraw = validated.get("edges", []) if isinstance(validated, dict) else []
+        edges2 = _build_edge_list(vraw, kept_norm_to_name, text_norm, max_edges=18, evidence_memo=evidence_memo)
+        # edges1 is already acyclic; if validate only kept/downgraded its
+        # directed edges, edges2's directed subgraph is a subgraph of it
+        if not _directed_pairs(edges2) <= _directed_pairs(edges1):
+            edges2 = _break_cycles(edges2)
+
+        # Prefer validated edges if we still have a non-trivial graph
+        if len(edges2) >= 4:
+            edges_final = edges2
+
     edges = [
         {
             "from": e.src,
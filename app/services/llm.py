@@ -1,24 +1,344 @@
-import asyncio, json
+import asyncio, json, time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterator, Optional, Tuple, Type, TypeVar
+import httpx
+import orjson
 from openai import OpenAI
+from pydantic import BaseModel, ValidationError
 from ..settings import settings
+from .cache import read_llm_response, save_llm_response, sha256_bytes
+from .json_utils import extract_json_substring
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY) if not settings.MOCK_MODE else None
+# One pooled keep-alive HTTP/2 client for every OpenAI call, so the several
+# calls an upload makes share a connection instead of each paying a TLS
+# handshake.
+_http: httpx.Client | None = None
+client = None
+if not settings.MOCK_MODE:
+    _http = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(settings.OPENAI_HTTP_TIMEOUT_SECONDS, connect=5.0),
+    )
+    client = OpenAI(api_key=settings.OPENAI_API_KEY, http_client=_http)
+
+
+def close_llm_client() -> None:
+    if _http is not None:
+        _http.close()
+
+# Seed used with temperature=0 for schema-driven JSON generators so identical
+# prompts give identical output (and can be served from cache).
+DETERMINISTIC_SEED = 42
 
-def _llm_sync(messages, *, max_tokens=400, temperature=0.2):
+# In-process LRU+TTL memo of low-temperature responses: key -> (stored_at, text).
+_MEMO: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_MEMO_SIZE = 1024
+_MEMO_TTL_SECONDS = 24 * 3600
+# Calls at or below this temperature are treated as repeatable for the memo
+_MEMO_MAX_TEMPERATURE = 0.2
+
+
+def _llm_sync(
+    messages, *, max_tokens=400, temperature=0.2, seed=None, response_format=None, prompt_cache_key=None, model=None
+) -> Tuple[str, Optional[str]]:
+    """(completion text, finish_reason)"""
     if settings.MOCK_MODE:
         sys = (messages[0].get("content","") if messages else "").lower()
         if "flashcards" in sys:
-            return '{"cards":[{"type":"definition","front":"What is latency?","back":"Delay before transfer begins.","source":"Slide 3"},{"type":"cloze","front":"TCP handshake is {{c1::SYN}}, {{c2::SYN-ACK}}, {{c3::ACK}}.","back":"SYN → SYN-ACK → ACK","source":"Slide 7"}]}'
+            return '{"cards":[{"type":"definition","front":"What is latency?","back":"Delay before transfer begins.","source":"Slide 3"},{"type":"cloze","front":"TCP handshake is {{c1::SYN}}, {{c2::SYN-ACK}}, {{c3::ACK}}.","back":"SYN → SYN-ACK → ACK","source":"Slide 7"}]}', "stop"
         if "questions" in sys:
-            return json.dumps({"questions":[{"question":"Which layer handles routing on the Internet?","choices":["Physical","Data Link","Network","Transport"],"answer_index":2,"explanation":"IP routing occurs at Layer 3.","source":"Slide 8"}]})
-        return "This is a MOCK summary."
+            return json.dumps({"questions":[{"question":"Which layer handles routing on the Internet?","choices":["Physical","Data Link","Network","Transport"],"answer_index":2,"explanation":"IP routing occurs at Layer 3.","source":"Slide 8"}]}), "stop"
+        return "This is a MOCK summary.", "stop"
     resp = client.chat.completions.create(
-        model=settings.OPENAI_MODEL,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
+        **_request(
+            messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            seed=seed,
+            response_format=response_format,
+            prompt_cache_key=prompt_cache_key,
+            model=model,
+        )
+    )
+    choice = resp.choices[0]
+    return choice.message.content, choice.finish_reason
+
+
+def _request(messages, *, max_tokens, temperature, seed, response_format, prompt_cache_key, model=None) -> dict:
+    req = {
+        "model": model or settings.OPENAI_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    if seed is not None:
+        req["seed"] = seed
+    if response_format is not None:
+        req["response_format"] = response_format
+    if prompt_cache_key is not None:
+        req["prompt_cache_key"] = prompt_cache_key
+    return req
+
+
+def prompt_shard(name: str) -> str:
+    """prompt_cache_key for a call site: requests sharing a static prompt
+    prefix get routed to the same provider prompt-cache shard."""
+    return f"studybuddy:{name}:{settings.OPENAI_MODEL}"
+
+
+def _llm_stream_sync(
+    messages, *, max_tokens=400, temperature=0.2, seed=None, response_format=None, prompt_cache_key=None, model=None
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """(text piece, finish_reason or None) as the provider streams them"""
+    stream = client.chat.completions.create(
+        **_request(
+            messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            seed=seed,
+            response_format=response_format,
+            prompt_cache_key=prompt_cache_key,
+            model=model,
+        ),
+        stream=True,
     )
-    return resp.choices[0].message.content
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.content or choice.finish_reason:
+            yield choice.delta.content or "", choice.finish_reason
+
+
+def _cache_key(messages, kw) -> str:
+    """sha256 over everything that shapes the completion: the messages, the
+    model and every request parameter (defaults filled in), plus
+    settings.LLM_CACHE_VERSION.
+
+    Editing a prompt changes the key by itself; bump the version to drop
+    every cached response at once (e.g. the provider changed a model
+    without renaming it)."""
+    params = {"max_tokens": 400, "temperature": 0.2, **kw}
+    params["model"] = params.get("model") or settings.OPENAI_MODEL
+    params["_cache_version"] = settings.LLM_CACHE_VERSION
+    params.pop("prompt_cache_key", None)  # routing hint only, doesn't change the output
+    blob = orjson.dumps([messages, params], option=orjson.OPT_SORT_KEYS)
+    return sha256_bytes(blob)
+
+
+def _remember(key: str, out: str) -> None:
+    _MEMO[key] = (time.monotonic(), out)
+    _MEMO.move_to_end(key)
+    if len(_MEMO) > _MEMO_SIZE:
+        _MEMO.popitem(last=False)
+
+
+def _recall(key: str, ttl: Optional[float]) -> Optional[str]:
+    entry = _MEMO.get(key)
+    if entry is None:
+        return None
+    stored_at, out = entry
+    max_age = _MEMO_TTL_SECONDS if ttl is None else min(ttl, _MEMO_TTL_SECONDS)
+    if time.monotonic() - stored_at > max_age:
+        del _MEMO[key]
+        return None
+    _MEMO.move_to_end(key)
+    return out
+
+
+_DEFAULT_TTL = object()
+
+
+def _lookup(key: str, cache_ttl, deterministic: bool) -> Optional[str]:
+    """Cached reply for key (memo, then disk), or None. cache_ttl=0 skips
+    both tiers, for callers that must regenerate."""
+    if cache_ttl == 0:
+        return None
+    if deterministic:
+        hit = _recall(key, cache_ttl)
+        if hit is not None:
+            return hit
+    hit = read_llm_response(key, cache_ttl)
+    if hit is not None and deterministic:
+        _remember(key, hit)
+    return hit
+
+
+def _persist(key: str, out: str, finish_reason: Optional[str], deterministic: bool, accept) -> None:
+    """Cache a fresh reply, unless it is empty, was cut off by max_tokens,
+    or the caller's accept() rejected it (a bad reply pinned in the cache
+    would be replayed on every retry)."""
+    if not out or finish_reason == "length":
+        return
+    if accept is not None and not accept(out):
+        return
+    save_llm_response(key, out)
+    if deterministic:
+        _remember(key, out)
+
+
+async def llm(
+    messages,
+    *,
+    cache_ttl=_DEFAULT_TTL,
+    accept: Optional[Callable[[str], bool]] = None,
+    retry_max_tokens: Optional[int] = None,
+    **kw,
+):
+    """Chat completion with two cache tiers in front of the provider:
+    an in-process LRU+TTL memo for low-temperature (<= 0.2) calls and a
+    persistent on-disk cache (cache/llm).
+
+    cache_ttl: max age in seconds of a cache hit; defaults to
+    settings.LLM_CACHE_TTL_SECONDS, None never expires, 0 skips the cache
+    (the fresh reply is still stored).
+    accept: only replies for which accept(reply) is true are cached;
+    replies truncated by max_tokens never are.
+    retry_max_tokens: if the reply is cut off by max_tokens, retry once
+    with this budget (JSON mode can't return a parseable cut-off object).
+    model: per-call override of settings.OPENAI_MODEL."""
+    if settings.MOCK_MODE:
+        out, _ = await asyncio.to_thread(_llm_sync, messages, **kw)
+        return out
+
+    key = _cache_key(messages, kw)
+    deterministic = kw.get("temperature", 0.2) <= _MEMO_MAX_TEMPERATURE
+    if cache_ttl is _DEFAULT_TTL:
+        cache_ttl = settings.LLM_CACHE_TTL_SECONDS
+
+    hit = _lookup(key, cache_ttl, deterministic)
+    if hit is not None:
+        return hit
+
+    out, finish_reason = await asyncio.to_thread(_llm_sync, messages, **kw)
+    if finish_reason == "length" and retry_max_tokens:
+        out, finish_reason = await asyncio.to_thread(_llm_sync, messages, **{**kw, "max_tokens": retry_max_tokens})
+    # stored under the original key: it answers the same request
+    _persist(key, out, finish_reason, deterministic, accept)
+    return out
+
+
+_STREAM_DONE = object()
+
+
+async def llm_stream(
+    messages, *, cache_ttl=_DEFAULT_TTL, accept: Optional[Callable[[str], bool]] = None, **kw
+) -> AsyncIterator[str]:
+    """llm(), yielding the completion text in pieces as the provider generates it.
+
+    Shares llm()'s cache (and its cache_ttl/accept rules): hits (and
+    MOCK_MODE) yield the whole text at once, and a streamed miss is cached
+    once it completes.
+    """
+    if settings.MOCK_MODE:
+        out, _ = await asyncio.to_thread(_llm_sync, messages, **kw)
+        yield out
+        return
+
+    key = _cache_key(messages, kw)
+    deterministic = kw.get("temperature", 0.2) <= _MEMO_MAX_TEMPERATURE
+    if cache_ttl is _DEFAULT_TTL:
+        cache_ttl = settings.LLM_CACHE_TTL_SECONDS
+
+    hit = _lookup(key, cache_ttl, deterministic)
+    if hit is not None:
+        yield hit
+        return
+
+    # The SDK stream is a blocking iterator: drain it on a worker thread and
+    # hand pieces to the loop through a queue.
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def pump() -> None:
+        try:
+            for item in _llm_stream_sync(messages, **kw):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+            return
+        loop.call_soon_threadsafe(queue.put_nowait, _STREAM_DONE)
+
+    worker = asyncio.ensure_future(asyncio.to_thread(pump))
+    parts = []
+    finish_reason = None
+    while True:
+        item = await queue.get()
+        if item is _STREAM_DONE:
+            break
+        if isinstance(item, Exception):
+            raise item
+        piece, reason = item
+        finish_reason = reason or finish_reason
+        if piece:
+            parts.append(piece)
+            yield piece
+    await worker
+
+    _persist(key, "".join(parts), finish_reason, deterministic, accept)
+
+
+M = TypeVar("M", bound=BaseModel)
+
+# Validation-error retries for llm_json (on top of the first attempt)
+JSON_RETRIES = 2
+
+
+def json_schema_format(model: Type[BaseModel]) -> dict:
+    """response_format that makes the provider enforce model's JSON schema."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "schema": model.model_json_schema(),
+            "strict": True,
+        },
+    }
+
+
+def _validate(model: Type[M], raw: str) -> Tuple[Optional[M], Optional[ValidationError]]:
+    """(parsed model, None) or (None, the validation error)"""
+    try:
+        return model.model_validate_json(raw or ""), None
+    except ValidationError as e:
+        # Often just code fences or prose around valid JSON: strip those
+        # locally before paying for a repair round-trip.
+        sub = extract_json_substring(raw or "")
+        if sub and sub != raw:
+            try:
+                return model.model_validate_json(sub), None
+            except ValidationError:
+                pass
+        return None, e
+
+
+async def llm_json(messages, model: Type[M], **kw) -> Optional[M]:
+    """llm() with server-side schema enforcement, validated into model.
 
-async def llm(messages, **kw):
-    return await asyncio.to_thread(_llm_sync, messages, **kw)
+    On a validation error the error is fed back to the model and the call
+    retried (at most JSON_RETRIES times); returns None if it never validates.
+    Only replies that validate are cached.
+    """
+    fmt = json_schema_format(model)
+    msgs = list(messages)
+    accept = lambda raw: _validate(model, raw)[0] is not None
+    for attempt in range(JSON_RETRIES + 1):
+        raw = await llm(msgs, response_format=fmt, accept=accept, **kw)
+        out, err = _validate(model, raw)
+        if out is not None:
+            return out
+        if attempt == JSON_RETRIES:
+            return None
+        msgs = msgs + [
+            {"role": "assistant", "content": raw or ""},
+            {"role": "user", "content": f"That JSON did not match the schema:\n{err}\nReturn the corrected JSON only."},
+        ]
+        # Fixing up a nearly-right reply doesn't need the strong model
+        if settings.FALLBACK_MODEL:
+            kw = {**kw, "model": settings.FALLBACK_MODEL}
+    return None
@@ -1,30 +1,95 @@
 import re
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 from fastapi import HTTPException
 from ..settings import settings
-from .llm import llm
+from .llm import llm, prompt_shard
 from .cache import read_bullets, save_bullets
+from .json_utils import loads_object
 
 
-def extract_pages_text(pdf_path: str) -> list[str]:
-    """Extract text from PDF file by path"""
-    doc = fitz.open(pdf_path)
-    out = []
-    for p in doc:
-        t = p.get_text() or ""
-        t = re.sub(r"[ \t]+", " ", t).strip()
-        out.append(t)
-    return out
+_TRAILING_WS_RE = re.compile(r"[ \t]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SPACES_RE = re.compile(r" {2,}")
+_TAB_TABLE = str.maketrans("\t", " ")
+# Default text flags plus joining words hyphenated across line breaks
+_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT | fitz.TEXT_DEHYPHENATE
 
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+def _clean_page(t: str) -> str:
+    """Tabs -> spaces, collapse space runs, trim."""
+    t = t.translate(_TAB_TABLE)
+    if "  " in t:
+        t = _SPACES_RE.sub(" ", t)
+    return t.strip()
+
+
+def _page_texts(doc, start: int, stop: int) -> list[str]:
+    return [
+        _clean_page(doc[i].get_text("text", flags=_TEXT_FLAGS) or "")
+        for i in range(start, min(stop, doc.page_count))
+    ]
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    with fitz.open(pdf_path) as doc:
+        return _page_texts(doc, start, stop)
+
+
+def extract_pages_text(pdf_path: str, max_pages: int | None = None) -> list[str]:
+    """Extract text from PDF file by path (first max_pages pages if given)"""
+    return _extract_page_range(pdf_path, 0, max_pages if max_pages is not None else 1 << 30)
+
+
+# Below this many pages a single worker thread is faster than fanning out
+_PARALLEL_MIN_PAGES = 16
+
+
+def _small_pages_or_count(pdf_path: str, max_pages: int | None) -> list[str] | int:
+    """One open: the page texts if there are fewer than _PARALLEL_MIN_PAGES
+    to read, otherwise just how many there are (for the caller to fan out)."""
+    with fitz.open(pdf_path) as doc:
+        n = doc.page_count if max_pages is None else min(doc.page_count, max_pages)
+        if n < _PARALLEL_MIN_PAGES:
+            return _page_texts(doc, 0, n)
+        return n
+
+
+async def extract_pages_text_async(pdf_path: str, max_pages: int | None = None) -> list[str]:
+    """
+    extract_pages_text off the event loop.
+
+    PyMuPDF isn't thread-safe, so large files are split into page ranges
+    parsed concurrently in the PDF process pool (each worker opens its own
+    copy); small ones are read by one worker thread in the same open that
+    counts their pages.
+    """
+    res = await asyncio.to_thread(_small_pages_or_count, pdf_path, max_pages)
+    if isinstance(res, list):
+        return res
+    n = res
+
+    loop = asyncio.get_running_loop()
+    step = -(-n // settings.PDF_PROCESS_WORKERS)
+    parts = await asyncio.gather(
+        *(
+            loop.run_in_executor(_process_pool(), _extract_page_range, pdf_path, a, min(a + step, n))
+            for a in range(0, n, step)
+        )
+    )
+    return [t for part in parts for t in part]
+
+
+def extract_text_from_pdf(pdf_bytes: bytes, max_chars: int | None = None) -> str:
     """
     Extract all text from PDF bytes.
     Used by intelligent processing to get full document text.
     
     Args:
         pdf_bytes: PDF file as bytes
+        max_chars: Stop reading pages once this much text is collected
+            (the result is still a prefix of the full text, not cut to it)
         
     Returns:
         Full text from all pages
@@ -33,55 +98,137 @@ def extract_text_from_pdf(pdf_bytes: bytes) -> str:
         # Open PDF from bytes
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         
-        # Extract text from all pages
+        # Extract text page by page. Pages are stripped, so the "\n\n"
+        # separators can't merge into longer runs and each page can be
+        # collapsed on its own: drop trailing spaces and blank-line runs
+        # so they don't cost prompt tokens downstream
         text_parts = []
+        total = 0
         for page in doc:
-            text = page.get_text()
-            if text:
-                # Clean up whitespace
-                text = re.sub(r"[ \t]+", " ", text)
-                text_parts.append(text.strip())
+            text = _clean_page(page.get_text("text", flags=_TEXT_FLAGS))
+            if not text:
+                continue
+            text = _BLANK_LINES_RE.sub("\n\n", _TRAILING_WS_RE.sub("\n", text))
+            text_parts.append(text)
+            total += len(text) + 2
+            if max_chars is not None and total >= max_chars:
+                break
         
         doc.close()
         
-        # Join all pages with double newline
-        full_text = "\n\n".join(text_parts)
-        return full_text
+        return "\n\n".join(text_parts)
         
     except Exception as e:
         print(f"PDF extraction error: {e}")
         return ""
 
 
+_pdf_pool: ProcessPoolExecutor | None = None
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=settings.PDF_PROCESS_WORKERS)
+    return _pdf_pool
+
+
+# Distinct slides summarized per bullet request
+BULLET_BATCH = 4
+_BULLETS_SYSTEM = "Return 3–6 dense, exam-focused bullets. No preface, no conclusion."
+_BULLETS_BATCH_SYSTEM = (
+    "For EACH slide below, write 3–6 dense, exam-focused bullets. "
+    'Return ONLY JSON: {"slides": {"<slide number>": ["bullet", ...]}} '
+    "with one key per slide given."
+)
+
+
+def close_pdf_pool() -> None:
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+    _pdf_pool = None
+
+
+async def extract_text_from_pdf_async(pdf_bytes: bytes, max_chars: int | None = None) -> str:
+    """
+    extract_text_from_pdf off the event loop.
+
+    Small files parse on a worker thread; files of PDF_PROCESS_POOL_MIN_MB
+    or more go to a process pool so a long parse doesn't hold the GIL.
+    """
+    if len(pdf_bytes) >= settings.PDF_PROCESS_POOL_MIN_MB * 1024 * 1024:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_process_pool(), extract_text_from_pdf, pdf_bytes, max_chars)
+    return await asyncio.to_thread(extract_text_from_pdf, pdf_bytes, max_chars)
+
+
 async def build_bullets_from_pdf(tmp_path: str, doc_id: str) -> tuple[str, list[str]]:
     """Build bullet points from PDF file"""
     cached = read_bullets(doc_id)
     if cached:
         return cached["joined"], cached["bullets"]
 
-    pages = extract_pages_text(tmp_path)
+    pages = await extract_pages_text_async(tmp_path, max_pages=settings.MAX_PAGES)
     if not any(p.strip() for p in pages):
         raise HTTPException(422, "No extractable text found (image-only PDF).")
 
     sem = asyncio.Semaphore(settings.CONCURRENCY)
 
-    async def one(idx: int, txt: str):
-        if not txt:
-            return None
-        snippet = txt[:1500]
+    # Decks repeat slides (title, section dividers, "Questions?"): one LLM
+    # call per distinct snippet, fanned back out to every slide that has it.
+    groups: dict[str, list[int]] = {}
+    for i, t in enumerate(pages, start=1):
+        if t:
+            groups.setdefault(t[:1500], []).append(i)
+
+    async def one(idx: int, snippet: str):
         async with sem:
             b = await llm(
                 [
-                    {"role": "system", "content": "Return 3–6 dense, exam-focused bullets. No preface, no conclusion."},
+                    {"role": "system", "content": _BULLETS_SYSTEM},
                     {"role": "user", "content": f"Slide {idx} text:\n{snippet}"}
                 ],
                 max_tokens=220,
-                temperature=0.2
+                temperature=0.2,
+                prompt_cache_key=prompt_shard("slide_bullets"),
             )
-            return f"Slide {idx}:\n{b}"
+            return b
+
+    async def batch(chunk: list[tuple[int, str]]) -> list[str]:
+        """BULLET_BATCH slides per request; any slide the reply misses
+        (or a malformed reply) falls back to its own request."""
+        async with sem:
+            raw = await llm(
+                [
+                    {"role": "system", "content": _BULLETS_BATCH_SYSTEM},
+                    {"role": "user", "content": "\n---\n".join(f"Slide {idx}:\n{snippet}" for idx, snippet in chunk)},
+                ],
+                max_tokens=220 * len(chunk),
+                temperature=0.2,
+                response_format={"type": "json_object"},
+                prompt_cache_key=prompt_shard("slide_bullets_batch"),
+            )
+        slides = loads_object(raw).get("slides")
+        if not isinstance(slides, dict):
+            slides = {}
+
+        out = []
+        for idx, snippet in chunk:
+            items = slides.get(str(idx))
+            lines = [f"- {str(b).strip()}" for b in items if str(b).strip()] if isinstance(items, list) else []
+            out.append("\n".join(lines) if lines else await one(idx, snippet))
+        return out
 
-    tasks = [one(i, t) for i, t in enumerate(pages[:settings.MAX_PAGES], start=1)]
-    results = [r for r in await asyncio.gather(*tasks) if r]
+    # (first slide number, snippet) per distinct snippet
+    work = [(idxs[0], snippet) for snippet, idxs in groups.items()]
+    if len(work) == 1:
+        bullets = [await one(*work[0])]
+    else:
+        chunks = [work[i:i + BULLET_BATCH] for i in range(0, len(work), BULLET_BATCH)]
+        bullets = [b for bs in await asyncio.gather(*(batch(c) for c in chunks)) for b in bs]
+    by_slide = {i: b for idxs, b in zip(groups.values(), bullets) for i in idxs}
+    results = [f"Slide {i}:\n{by_slide[i]}" for i in sorted(by_slide)]
     joined = "\n\n".join(results) if results else "No text found."
 
     save_bullets(doc_id, joined, results)
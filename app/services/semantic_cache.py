@@ -0,0 +1,66 @@
+# app/services/semantic_cache.py
+"""Near-duplicate result cache for upload-time LLM helpers.
+
+Re-uploads of the same material rarely produce byte-identical text (a
+re-exported PDF shifts whitespace and casing), so the exact prompt cache
+in llm() misses. Here the source text is canonicalized first (case-folded,
+whitespace collapsed) and the helper's *result* is cached under
+sha256(namespace, LLM_CACHE_VERSION, prompt id, model, params, canonical text).
+
+Each namespace registers its prompt with register_prompt, so editing a
+prompt (or bumping LLM_CACHE_VERSION) retires the results made with the old one.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Any, Optional
+
+import orjson
+
+from ..settings import settings
+from .cache import read_result, save_result, sha256_bytes
+
+_WS_RE = re.compile(r"\s+")
+
+# namespace -> hash of whatever produced its results (see register_prompt)
+_PROMPT_IDS: dict[str, str] = {}
+
+
+def register_prompt(namespace: str, *parts: Any) -> None:
+    """Key namespace's results on parts: the system prompt(s), reply schema
+    and any post-processing tables the cached result depends on."""
+    _PROMPT_IDS[namespace] = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+
+def canonical_text(text: str) -> str:
+    return _WS_RE.sub(" ", text or "").strip().casefold()
+
+
+def cache_key(namespace: str, text: str, **params: Any) -> str:
+    blob = orjson.dumps(
+        [
+            namespace,
+            settings.LLM_CACHE_VERSION,
+            _PROMPT_IDS.get(namespace),
+            settings.OPENAI_MODEL,
+            params,
+            canonical_text(text),
+        ],
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return sha256_bytes(blob)
+
+
+def lookup(namespace: str, text: str, **params: Any) -> Optional[Any]:
+    """Stored result for an equivalent input, or None."""
+    if settings.MOCK_MODE:
+        return None
+    return read_result(namespace, cache_key(namespace, text, **params), settings.LLM_CACHE_TTL_SECONDS)
+
+
+def store(namespace: str, text: str, value: Any, **params: Any) -> None:
+    if settings.MOCK_MODE:
+        return
+    save_result(namespace, cache_key(namespace, text, **params), value)
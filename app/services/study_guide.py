@@ -1,6 +1,9 @@
-import json
 from typing import Any, Dict, List
-from .llm import llm
+
+import orjson
+
+from ..schemas import StudyGuideOut
+from .llm import llm_json, prompt_shard
 
 GUIDE_SCHEMA_HINT = {
   "chapter_title": "string",
@@ -21,6 +24,33 @@ GUIDE_SCHEMA_HINT = {
   ]
 }
 
+# Everything that doesn't vary per chapter lives in the system message so the
+# provider can reuse its cached prefix; the concept count, title and text go
+# in the user message.
+GUIDE_SYSTEM = (
+    "You are StudyBuddy, an expert tutor. "
+    "Return ONLY valid JSON, no markdown, no prose. "
+    "Follow the schema exactly. "
+    "Make it practical, student-friendly, and accurate. "
+    "Do not invent page numbers. If unsure, omit sources.\n\n"
+    "Create a structured study guide for the chapter in the user message.\n"
+    "You must:\n"
+    "1) Identify the key concepts taught.\n"
+    "2) Order them in a learning path (foundations first).\n"
+    "3) Label each as importance: core/important/advanced.\n"
+    "4) Label difficulty: easy/medium/hard. Mark tricky concepts as hard.\n"
+    "5) Add prerequisites using other concept ids.\n"
+    "6) For each concept write: simple, detailed, technical explanations + example + common_mistake.\n\n"
+    "Rules:\n"
+    "- Keep explanations concise (2-6 sentences each).\n"
+    "- Make the simple explanation use an analogy when possible.\n"
+    "- The technical explanation can mention OS terms, APIs, edge cases.\n"
+    "- Make ids short, lowercase, snake_case.\n\n"
+    "Return JSON in this shape (keys must match):\n"
+    + orjson.dumps(GUIDE_SCHEMA_HINT).decode()
+)
+
+
 async def generate_study_guide(chapter_text: str, chapter_title: str, *, max_concepts: int = 10) -> Dict[str, Any]:
     """Generate an interactive study guide JSON object from chapter text."""
     # Keep prompt bounded
@@ -28,56 +58,24 @@ async def generate_study_guide(chapter_text: str, chapter_title: str, *, max_con
     if len(src) > 24000:
         src = src[:24000]
 
-    system = (
-        "You are StudyBuddy, an expert tutor. "
-        "Return ONLY valid JSON, no markdown, no prose. "
-        "Follow the schema exactly. "
-        "Make it practical, student-friendly, and accurate. "
-        "Do not invent page numbers. If unsure, omit sources. "
-        f"Generate 6 to {max_concepts} concepts max."
-    )
-
     user = (
-        f"Create a structured study guide for this chapter titled: {chapter_title!r}.\n"
-        "You must:\n"
-        "1) Identify the key concepts taught.\n"
-        "2) Order them in a learning path (foundations first).\n"
-        "3) Label each as importance: core/important/advanced.\n"
-        "4) Label difficulty: easy/medium/hard. Mark tricky concepts as hard.\n"
-        "5) Add prerequisites using other concept ids.\n"
-        "6) For each concept write: simple, detailed, technical explanations + example + common_mistake.\n\n"
-        "Rules:\n"
-        "- Keep explanations concise (2-6 sentences each).\n"
-        "- Make the simple explanation use an analogy when possible.\n"
-        "- The technical explanation can mention OS terms, APIs, edge cases.\n"
-        "- Make ids short, lowercase, snake_case.\n\n"
-        "Return JSON in this shape (keys must match):\n"
-        + json.dumps(GUIDE_SCHEMA_HINT, ensure_ascii=False)
-        + "\n\n"
+        f"Generate 6 to {max_concepts} concepts max.\n"
+        f"Chapter title: {chapter_title!r}\n\n"
         "CHAPTER TEXT:\n"
         + src
     )
 
-    raw = await llm(
+    out = await llm_json(
         [
-            {"role": "system", "content": system},
+            {"role": "system", "content": GUIDE_SYSTEM},
             {"role": "user", "content": user},
         ],
-        max_tokens=2600,
+        StudyGuideOut,
+        # ~260 tokens per concept (three explanations + example + mistake)
+        max_tokens=min(2600, 300 + 260 * max_concepts),
         temperature=0.2,
+        prompt_cache_key=prompt_shard("study_guide"),
     )
-
-    # Parse, repair if needed
-    try:
-        obj = json.loads(raw)
-        return obj
-    except Exception:
-        fixed = await llm(
-            [
-                {"role": "system", "content": "Fix this into valid JSON only. No prose. Keep the same schema."},
-                {"role": "user", "content": raw},
-            ],
-            max_tokens=2600,
-            temperature=0,
-        )
-        return json.loads(fixed)
+    if out is None:
+        raise ValueError("Study guide did not match the schema")
+    return out.model_dump()
@@ -4,10 +4,33 @@ Subject-Aware Content Extractors
 Different extraction strategies for different subject types
 """
 
-import json
-from typing import Dict, List
-from .llm import llm
-from .json_utils import safe_json_loads
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from ..settings import settings
+from .llm import llm, prompt_shard
+from ..schemas import HumanitiesExtractionShape, SocialScienceExtractionShape, StemExtractionShape
+from .json_utils import conforms, safe_json_loads
+from . import semantic_cache
+
+
+# Extraction reply budget. Output size is set by the schema (per-concept
+# fields plus problems/arguments/studies), not by the excerpt length.
+_EXTRACTION_MAX_TOKENS = 2000
+# One retry budget for a reply that still hit the cap
+_EXTRACTION_RETRY_MAX_TOKENS = 4000
+
+
+# Provider-enforced JSON object replies (the prompts all ask for JSON)
+_JSON_MODE = {"type": "json_object"}
+
+
+def _parse_shape(response: str, shape) -> Optional[Dict]:
+    """Parsed reply if it is a JSON object of the expected shape, else None"""
+    parsed = safe_json_loads(response, default=None)
+    if isinstance(parsed, dict) and conforms(shape, parsed):
+        return parsed
+    return None
 
 
 # ============== STEM Extractor ==============
@@ -53,33 +76,37 @@ Return ONLY valid JSON:
 """
 
 
+_STEM_SYSTEM = {"role": "system", "content": STEM_EXTRACTION_PROMPT}
+semantic_cache.register_prompt("stem_extraction", STEM_EXTRACTION_PROMPT, StemExtractionShape.model_json_schema())
+
+
 async def extract_stem_content(text: str) -> Dict:
     """Extract STEM-specific content (formulas, problems, algorithms)"""
     
+    src = text[:4000]
+    hit = semantic_cache.lookup("stem_extraction", src)
+    if hit is not None:
+        return hit
+
     try:
         response = await llm(
             [
-                {"role": "system", "content": STEM_EXTRACTION_PROMPT},
-                {"role": "user", "content": f"Extract STEM concepts:\n\n{text[:4000]}"}
+                _STEM_SYSTEM,
+                {"role": "user", "content": f"Extract STEM concepts:\n\n{src}"}
             ],
-            max_tokens=2000,
-            temperature=0.2
-        )
-        parsed = safe_json_loads(response, default=None)
-        if isinstance(parsed, dict) and (parsed.get("concepts") or parsed.get("practice_problems") is not None):
-            return parsed
-
-        # One retry with stricter instruction (models sometimes add extra text)
-        response2 = await llm(
-            [
-                {"role": "system", "content": STEM_EXTRACTION_PROMPT + "\n\nIMPORTANT: Output raw JSON only. No markdown, no commentary."},
-                {"role": "user", "content": f"Return ONLY JSON.\n\n{text[:4000]}"},
-            ],
-            max_tokens=2000,
+            max_tokens=_EXTRACTION_MAX_TOKENS,
+            retry_max_tokens=_EXTRACTION_RETRY_MAX_TOKENS,
             temperature=0.2,
+            response_format=_JSON_MODE,
+            prompt_cache_key=prompt_shard("stem_extraction"),
+            accept=lambda r: _parse_shape(r, StemExtractionShape) is not None,
         )
-        parsed2 = safe_json_loads(response2, default={"concepts": [], "practice_problems": []})
-        return parsed2 if isinstance(parsed2, dict) else {"concepts": [], "practice_problems": []}
+        parsed = _parse_shape(response, StemExtractionShape)
+        if parsed is None:
+            return {"concepts": [], "practice_problems": []}
+        if parsed.get("concepts"):
+            semantic_cache.store("stem_extraction", src, parsed)
+        return parsed
     except Exception as e:
         print(f"STEM extraction error: {e}")
         return {"concepts": [], "practice_problems": []}
@@ -136,32 +163,39 @@ Return ONLY valid JSON:
 """
 
 
+_HUMANITIES_SYSTEM = {"role": "system", "content": HUMANITIES_EXTRACTION_PROMPT}
+semantic_cache.register_prompt(
+    "humanities_extraction", HUMANITIES_EXTRACTION_PROMPT, HumanitiesExtractionShape.model_json_schema()
+)
+
+
 async def extract_humanities_content(text: str) -> Dict:
     """Extract humanities-specific content (themes, arguments, context)"""
     
+    src = text[:4000]
+    hit = semantic_cache.lookup("humanities_extraction", src)
+    if hit is not None:
+        return hit
+
     try:
         response = await llm(
             [
-                {"role": "system", "content": HUMANITIES_EXTRACTION_PROMPT},
-                {"role": "user", "content": f"Extract humanities concepts:\n\n{text[:4000]}"}
+                _HUMANITIES_SYSTEM,
+                {"role": "user", "content": f"Extract humanities concepts:\n\n{src}"}
             ],
-            max_tokens=2000,
-            temperature=0.2
-        )
-        parsed = safe_json_loads(response, default=None)
-        if isinstance(parsed, dict) and (parsed.get("concepts") or parsed.get("timeline_events") is not None):
-            return parsed
-
-        response2 = await llm(
-            [
-                {"role": "system", "content": HUMANITIES_EXTRACTION_PROMPT + "\n\nIMPORTANT: Output raw JSON only. No markdown, no commentary."},
-                {"role": "user", "content": f"Return ONLY JSON.\n\n{text[:4000]}"},
-            ],
-            max_tokens=2000,
+            max_tokens=_EXTRACTION_MAX_TOKENS,
+            retry_max_tokens=_EXTRACTION_RETRY_MAX_TOKENS,
             temperature=0.2,
+            response_format=_JSON_MODE,
+            prompt_cache_key=prompt_shard("humanities_extraction"),
+            accept=lambda r: _parse_shape(r, HumanitiesExtractionShape) is not None,
         )
-        parsed2 = safe_json_loads(response2, default={"concepts": [], "key_arguments": [], "timeline_events": []})
-        return parsed2 if isinstance(parsed2, dict) else {"concepts": [], "key_arguments": [], "timeline_events": []}
+        parsed = _parse_shape(response, HumanitiesExtractionShape)
+        if parsed is None:
+            return {"concepts": [], "key_arguments": [], "timeline_events": []}
+        if parsed.get("concepts"):
+            semantic_cache.store("humanities_extraction", src, parsed)
+        return parsed
     except Exception as e:
         print(f"Humanities extraction error: {e}")
         return {"concepts": [], "key_arguments": [], "timeline_events": []}
@@ -210,32 +244,39 @@ Return ONLY valid JSON:
 """
 
 
+_SOCIAL_SCIENCE_SYSTEM = {"role": "system", "content": SOCIAL_SCIENCE_EXTRACTION_PROMPT}
+semantic_cache.register_prompt(
+    "social_science_extraction", SOCIAL_SCIENCE_EXTRACTION_PROMPT, SocialScienceExtractionShape.model_json_schema()
+)
+
+
 async def extract_social_science_content(text: str) -> Dict:
     """Extract social science content (theories, studies, phenomena)"""
     
+    src = text[:4000]
+    hit = semantic_cache.lookup("social_science_extraction", src)
+    if hit is not None:
+        return hit
+
     try:
         response = await llm(
             [
-                {"role": "system", "content": SOCIAL_SCIENCE_EXTRACTION_PROMPT},
-                {"role": "user", "content": f"Extract social science concepts:\n\n{text[:4000]}"}
+                _SOCIAL_SCIENCE_SYSTEM,
+                {"role": "user", "content": f"Extract social science concepts:\n\n{src}"}
             ],
-            max_tokens=2000,
-            temperature=0.2
-        )
-        parsed = safe_json_loads(response, default=None)
-        if isinstance(parsed, dict) and (parsed.get("concepts") or parsed.get("studies") is not None):
-            return parsed
-
-        response2 = await llm(
-            [
-                {"role": "system", "content": SOCIAL_SCIENCE_EXTRACTION_PROMPT + "\n\nIMPORTANT: Output raw JSON only. No markdown, no commentary."},
-                {"role": "user", "content": f"Return ONLY JSON.\n\n{text[:4000]}"},
-            ],
-            max_tokens=2000,
+            max_tokens=_EXTRACTION_MAX_TOKENS,
+            retry_max_tokens=_EXTRACTION_RETRY_MAX_TOKENS,
             temperature=0.2,
+            response_format=_JSON_MODE,
+            prompt_cache_key=prompt_shard("social_science_extraction"),
+            accept=lambda r: _parse_shape(r, SocialScienceExtractionShape) is not None,
         )
-        parsed2 = safe_json_loads(response2, default={"concepts": [], "studies": []})
-        return parsed2 if isinstance(parsed2, dict) else {"concepts": [], "studies": []}
+        parsed = _parse_shape(response, SocialScienceExtractionShape)
+        if parsed is None:
+            return {"concepts": [], "studies": []}
+        if parsed.get("concepts"):
+            semantic_cache.store("social_science_extraction", src, parsed)
+        return parsed
     except Exception as e:
         print(f"Social science extraction error: {e}")
         return {"concepts": [], "studies": []}
@@ -274,13 +315,114 @@ async def extract_content_intelligent(text: str, subject_area: str, classificati
     return result
 
 
+def _empty_result(subject_area: str) -> Dict:
+    """Failure shape of the extractor extract_content_intelligent routes to"""
+    if subject_area == "humanities":
+        return {"concepts": [], "key_arguments": [], "timeline_events": []}
+    if subject_area == "social_science":
+        return {"concepts": [], "studies": []}
+    return {"concepts": [], "practice_problems": []}
+
+
+async def extract_content_intelligent_batch(items: List[Tuple[str, str, Dict]]) -> List[Dict]:
+    """
+    extract_content_intelligent over many documents concurrently
+    (at most settings.CONCURRENCY in flight)
+
+    Args:
+        items: (text, subject_area, classification) per document
+
+    Returns:
+        One result per item, in order; a failed item gets the empty
+        result shape for its subject
+    """
+
+    # Bounds this fan-out only; single-document extraction is unthrottled
+    sem = asyncio.Semaphore(settings.CONCURRENCY)
+
+    async def _limited(text: str, subject_area: str, classification: Dict) -> Dict:
+        async with sem:
+            return await extract_content_intelligent(text, subject_area, classification)
+
+    results = await asyncio.gather(
+        *(_limited(text, subject_area, classification) for text, subject_area, classification in items),
+        return_exceptions=True
+    )
+
+    out = []
+    for (_, subject_area, classification), result in zip(items, results):
+        if isinstance(result, BaseException):
+            print(f"Batch extraction error: {result}")
+            result = _empty_result(subject_area)
+            result['subject_area'] = subject_area
+            result['classification'] = classification
+            result['extraction_timestamp'] = _now()
+        out.append(result)
+    return out
+
+
 def _now():
-    from datetime import datetime
-    return datetime.utcnow().isoformat()
+    return datetime.now(timezone.utc).isoformat()
 
 
 # ============== Format Conversion ==============
 
+# The join-only lookups below use `or ()`: the empty tuple is a shared
+# constant, so a missing (or null) list costs no allocation. Defaults that
+# end up in the stored data stay fresh lists.
+
+def _format_stem(concept: Dict) -> Tuple[str, str, Dict]:
+    g = concept.get
+    return (
+        g('example_problem', ''),
+        '\n'.join(g('applications') or ()),
+        {
+            "formula": g('formula'),
+            "algorithm_steps": g('algorithm_steps'),
+            "solution_approach": g('solution_approach'),
+            "common_mistakes": g('common_mistakes'),
+            "prerequisites": g('prerequisites', [])
+        },
+    )
+
+
+def _format_humanities(concept: Dict) -> Tuple[str, str, Dict]:
+    g = concept.get
+    return (
+        '\n'.join(g('examples') or ()),
+        g('modern_relevance', ''),
+        {
+            "historical_context": g('historical_context'),
+            "significance": g('significance'),
+            "key_figures": g('key_figures', []),
+            "different_perspectives": g('different_perspectives', []),
+            "essay_angles": g('essay_angles', [])
+        },
+    )
+
+
+def _format_social_science(concept: Dict) -> Tuple[str, str, Dict]:
+    g = concept.get
+    return (
+        '\n'.join(g('real_world_examples') or ()),
+        '\n'.join(g('applications') or ()),
+        {
+            "key_researchers": g('key_researchers', []),
+            "research_evidence": g('research_evidence'),
+            "debates": g('debates'),
+            "measurement": g('measurement')
+        },
+    )
+
+
+# subject_area -> (example, application, subject_specific_data) builder
+_FORMATTERS = {
+    "stem": _format_stem,
+    "humanities": _format_humanities,
+    "social_science": _format_social_science,
+}
+
+
 def convert_to_unified_format(extracted_content: Dict) -> List[Dict]:
     """
     Converts subject-specific format to unified concept format
@@ -296,51 +438,27 @@ def convert_to_unified_format(extracted_content: Dict) -> List[Dict]:
     }
     """
     
-    concepts = extracted_content.get('concepts', [])
+    concepts = extracted_content.get('concepts') or ()
     subject_area = extracted_content.get('subject_area', 'other')
+    fmt = _FORMATTERS.get(subject_area)
     
     unified = []
     
     for concept in concepts:
+        g = concept.get
         # Common fields
         unified_concept = {
-            "name": concept.get('name', 'Unknown'),
-            "definition": concept.get('definition', ''),
+            "name": g('name', 'Unknown'),
+            "definition": g('definition', ''),
             "subject_area": subject_area
         }
         
         # Subject-specific formatting
-        if subject_area == "stem":
-            unified_concept['example'] = concept.get('example_problem', '')
-            unified_concept['application'] = '\n'.join(concept.get('applications', []))
-            unified_concept['subject_specific_data'] = {
-                "formula": concept.get('formula'),
-                "algorithm_steps": concept.get('algorithm_steps'),
-                "solution_approach": concept.get('solution_approach'),
-                "common_mistakes": concept.get('common_mistakes'),
-                "prerequisites": concept.get('prerequisites', [])
-            }
-            
-        elif subject_area == "humanities":
-            unified_concept['example'] = '\n'.join(concept.get('examples', []))
-            unified_concept['application'] = concept.get('modern_relevance', '')
-            unified_concept['subject_specific_data'] = {
-                "historical_context": concept.get('historical_context'),
-                "significance": concept.get('significance'),
-                "key_figures": concept.get('key_figures', []),
-                "different_perspectives": concept.get('different_perspectives', []),
-                "essay_angles": concept.get('essay_angles', [])
-            }
-            
-        elif subject_area == "social_science":
-            unified_concept['example'] = '\n'.join(concept.get('real_world_examples', []))
-            unified_concept['application'] = '\n'.join(concept.get('applications', []))
-            unified_concept['subject_specific_data'] = {
-                "key_researchers": concept.get('key_researchers', []),
-                "research_evidence": concept.get('research_evidence'),
-                "debates": concept.get('debates'),
-                "measurement": concept.get('measurement')
-            }
+        if fmt is not None:
+            example, application, data = fmt(concept)
+            unified_concept['example'] = example
+            unified_concept['application'] = application
+            unified_concept['subject_specific_data'] = data
         
         unified.append(unified_concept)
     
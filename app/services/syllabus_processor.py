@@ -4,10 +4,19 @@ Intelligent Syllabus Processor
 Extracts everything from syllabus and creates study timeline
 """
 
-import json
-from typing import Dict, List
+import asyncio
+import re
+from bisect import bisect_left, bisect_right
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
-from .llm import llm
+
+import orjson
+
+from ..settings import settings
+from ..schemas import SyllabusShape, SyllabusWithSummaryShape
+from .llm import llm, llm_stream, prompt_shard
+from .json_utils import conforms, safe_json_loads, take_complete_objects
+from . import semantic_cache
 
 
 SYLLABUS_EXTRACTION_PROMPT = """
@@ -78,6 +87,113 @@ Extract everything. If information is not present, use null or [].
 Be thorough - this is critical for student success.
 """
 
+# process_syllabus splits the extraction in two so the study timeline
+# (which only needs course_info/schedule/assessments) can start as soon as
+# the core half is back, while the auxiliary half is still generating.
+SYLLABUS_CORE_PROMPT = """
+You are analyzing a course syllabus. Extract the course details, weekly schedule and assessments comprehensively.
+
+Return ONLY valid JSON:
+
+{
+  "course_info": {
+    "name": "Course name",
+    "code": "Course code (e.g., CS 101)",
+    "professor": "Professor name",
+    "semester": "Fall 2024, Spring 2025, etc.",
+    "credits": 3,
+    "meeting_times": "Days and times"
+  },
+  "schedule": [
+    {
+      "week": 1,
+      "date_range": "Jan 15-19" or "Week of Jan 15",
+      "topics": ["Topic 1", "Topic 2"],
+      "readings": ["Reading 1 (pages)", "Reading 2"],
+      "assignments_due": ["Assignment name"] or []
+    }
+  ],
+  "assessments": [
+    {
+      "type": "exam" | "quiz" | "assignment" | "project" | "presentation" | "participation",
+      "name": "Midterm Exam 1",
+      "date": "March 15, 2024" or "Week 8",
+      "weight_percent": 20,
+      "topics_covered": ["Topics that will be tested"],
+      "format": "multiple choice, essay, etc.",
+      "details": "Any special instructions"
+    }
+  ]
+}
+
+Extract everything. If information is not present, use null or [].
+Be thorough - this is critical for student success.
+"""
+
+SYLLABUS_AUX_PROMPT = """
+You are analyzing a course syllabus. Extract grading, objectives, materials, policies and key dates.
+
+Return ONLY valid JSON:
+
+{
+  "grading_breakdown": {
+    "exams": 40,
+    "quizzes": 20,
+    "assignments": 30,
+    "participation": 10
+  },
+  "grading_scale": "A: 90-100, B: 80-89, etc.",
+  "learning_objectives": [
+    "Students will be able to...",
+    "Students will understand..."
+  ],
+  "required_materials": [
+    "Textbook name",
+    "Software",
+    "Other materials"
+  ],
+  "policies": {
+    "attendance": "Attendance policy text",
+    "late_work": "Late work policy",
+    "academic_integrity": "Integrity policy"
+  },
+  "office_hours": "When and where",
+  "important_dates": [
+    {
+      "date": "Feb 20",
+      "event": "No class - holiday"
+    }
+  ]
+}
+
+Extract everything. If information is not present, use null or [].
+"""
+
+_WEEK_RE = re.compile(r"week\s*(\d+)", re.IGNORECASE)
+
+# Provider-enforced JSON object replies (the prompts all ask for JSON)
+_JSON_MODE = {"type": "json_object"}
+_SYLLABUS_CORE_SYSTEM = {"role": "system", "content": SYLLABUS_CORE_PROMPT}
+_SYLLABUS_AUX_SYSTEM = {"role": "system", "content": SYLLABUS_AUX_PROMPT}
+_TIMELINE_SYSTEM = {"role": "system", "content": "You create effective study timelines."}
+_EXAM_PREP_SYSTEM = {"role": "system", "content": "You create effective exam prep plans."}
+
+
+# Reply budgets, fixed: output size follows the syllabus structure (a full
+# schedule and assessment list, or every policy), not the input length
+_SYLLABUS_MAX_TOKENS = 2500
+_SYLLABUS_AUX_MAX_TOKENS = 1500
+_SYLLABUS_SUMMARY_MAX_TOKENS = 4500
+# A reply that still hits its cap is retried once with twice the budget
+
+
+def _parse_syllabus(response: str, shape) -> Optional[Dict]:
+    """Parsed reply if it is a JSON object of the expected shape, else None"""
+    data = safe_json_loads(response, default=None)
+    if isinstance(data, dict) and conforms(shape, data):
+        return data
+    return None
+
 
 async def process_syllabus(syllabus_text: str) -> Dict:
     """
@@ -90,28 +206,114 @@ async def process_syllabus(syllabus_text: str) -> Dict:
         Structured syllabus data
     """
     
+    src = syllabus_text[:6000]
+    hit = semantic_cache.lookup("syllabus", src)
+    if hit is not None:
+        return hit
+
+    user = {"role": "user", "content": f"Syllabus:\n\n{src}"}
+    core_task = asyncio.create_task(llm(
+        [_SYLLABUS_CORE_SYSTEM, user],
+        max_tokens=_SYLLABUS_MAX_TOKENS,
+        retry_max_tokens=2 * _SYLLABUS_MAX_TOKENS,
+        temperature=0.1,  # Very low - need accuracy
+        response_format=_JSON_MODE,
+        prompt_cache_key=prompt_shard("syllabus_core"),
+        accept=lambda r: _parse_syllabus(r, SyllabusShape) is not None,
+    ))
+    aux_task = asyncio.create_task(llm(
+        [_SYLLABUS_AUX_SYSTEM, user],
+        max_tokens=_SYLLABUS_AUX_MAX_TOKENS,
+        retry_max_tokens=2 * _SYLLABUS_AUX_MAX_TOKENS,
+        temperature=0.1,
+        response_format=_JSON_MODE,
+        prompt_cache_key=prompt_shard("syllabus_aux"),
+        accept=lambda r: _parse_syllabus(r, SyllabusShape) is not None,
+    ))
+
     try:
-        response = await llm(
-            [
-                {"role": "system", "content": SYLLABUS_EXTRACTION_PROMPT},
-                {"role": "user", "content": f"Syllabus:\n\n{syllabus_text[:6000]}"}
-            ],
-            max_tokens=2500,
-            temperature=0.1  # Very low - need accuracy
-        )
-        
-        syllabus_data = json.loads(response)
+        syllabus_data = _parse_syllabus(await core_task, SyllabusShape)
+        if syllabus_data is None:
+            aux_task.cancel()
+            return _default_syllabus_structure()
         
-        # Generate study timeline
-        syllabus_data['study_timeline'] = await create_study_timeline(syllabus_data)
+        # Generate study timeline while the auxiliary half finishes
+        timeline_task = asyncio.create_task(_study_timeline(syllabus_data))
+        try:
+            aux = _parse_syllabus(await aux_task, SyllabusShape)
+        except Exception as e:
+            print(f"Syllabus aux extraction error: {e}")
+            aux = None
+        if aux:
+            for field in ('course_info', 'schedule', 'assessments'):
+                aux.pop(field, None)
+            syllabus_data.update(aux)
+        syllabus_data['study_timeline'], timeline_ok = await timeline_task
         
+        # A failed aux call or heuristic timeline is transient: don't replay it
+        if aux and timeline_ok:
+            semantic_cache.store("syllabus", src, syllabus_data)
         return syllabus_data
         
     except Exception as e:
+        aux_task.cancel()
         print(f"Syllabus processing error: {e}")
         return _default_syllabus_structure()
 
 
+SYLLABUS_SUMMARY_ADDENDUM = """
+Also add a top-level "summary_markdown" string: detailed structured study notes
+for the syllabus in markdown (headings, bullets, clear spacing), prioritizing
+what will be tested and key dates. Avoid fluff.
+"""
+_SYLLABUS_SUMMARY_SYSTEM = {"role": "system", "content": SYLLABUS_EXTRACTION_PROMPT + SYLLABUS_SUMMARY_ADDENDUM}
+
+
+async def process_syllabus_with_summary(syllabus_text: str, *, word_target: int) -> Tuple[Dict, str]:
+    """
+    Extract syllabus information and markdown study notes in one LLM call
+
+    Args:
+        syllabus_text: Full text of syllabus
+        word_target: Approximate length of the notes
+
+    Returns:
+        (structured syllabus data, summary markdown)
+    """
+
+    src = syllabus_text[:6000]
+    hit = semantic_cache.lookup("syllabus_with_summary", src, word_target=word_target)
+    if hit is not None:
+        return hit[0], hit[1]
+
+    try:
+        user = {"role": "user", "content": f"Syllabus:\n\n{src}\n\nNotes length: ~{word_target} words."}
+        response = await llm(
+            [_SYLLABUS_SUMMARY_SYSTEM, user],
+            max_tokens=_SYLLABUS_SUMMARY_MAX_TOKENS,
+            retry_max_tokens=2 * _SYLLABUS_SUMMARY_MAX_TOKENS,
+            temperature=0.1,
+            response_format=_JSON_MODE,
+            prompt_cache_key=prompt_shard("syllabus_summary"),
+            accept=lambda r: _parse_syllabus(r, SyllabusWithSummaryShape) is not None,
+        )
+
+        syllabus_data = _parse_syllabus(response, SyllabusWithSummaryShape)
+        if syllabus_data is None:
+            return _default_syllabus_structure(), ""
+        summary_md = syllabus_data.pop('summary_markdown', None) or ""
+
+        syllabus_data['study_timeline'], timeline_ok = await _study_timeline(syllabus_data)
+
+        if timeline_ok:
+            semantic_cache.store("syllabus_with_summary", src, [syllabus_data, summary_md], word_target=word_target)
+        return syllabus_data, summary_md
+
+    except Exception as e:
+        print(f"Syllabus processing error: {e}")
+        return _default_syllabus_structure(), ""
+
+
 def _default_syllabus_structure() -> Dict:
     """Fallback structure"""
     return {
@@ -124,26 +326,12 @@ def _default_syllabus_structure() -> Dict:
     }
 
 
-async def create_study_timeline(syllabus_data: Dict) -> List[Dict]:
-    """
-    Creates personalized week-by-week study plan
-    
-    Args:
-        syllabus_data: Extracted syllabus information
-        
-    Returns:
-        List of weekly study plans
-    """
-    
-    schedule = syllabus_data.get('schedule', [])
-    assessments = syllabus_data.get('assessments', [])
-    
-    if not schedule:
-        return []
+def _timeline_messages(schedule: List[Dict], assessments: List[Dict]) -> List[Dict]:
+    """Chat messages for the week-by-week study plan"""
     
     # Build context for AI
-    schedule_summary = json.dumps(schedule[:15], indent=2)  # First 15 weeks
-    assessments_summary = json.dumps(assessments, indent=2)
+    schedule_summary = orjson.dumps(schedule[:15], option=orjson.OPT_INDENT_2).decode()  # First 15 weeks
+    assessments_summary = orjson.dumps(assessments, option=orjson.OPT_INDENT_2).decode()
     
     prompt = f"""
 Create a strategic study plan based on this course schedule.
@@ -187,23 +375,97 @@ Guidelines:
 - Connect current topics to future assessments
 - Be specific and actionable
 """
+    return [
+        _TIMELINE_SYSTEM,
+        {"role": "user", "content": prompt}
+    ]
+
+
+# Cached syllabus results include the study timeline; the timeline
+# template rendered with no data stands in for its inline prompt
+semantic_cache.register_prompt(
+    "syllabus", SYLLABUS_CORE_PROMPT, SYLLABUS_AUX_PROMPT, _timeline_messages([], []), SyllabusShape.model_json_schema()
+)
+semantic_cache.register_prompt(
+    "syllabus_with_summary",
+    _SYLLABUS_SUMMARY_SYSTEM,
+    _timeline_messages([], []),
+    SyllabusWithSummaryShape.model_json_schema(),
+)
+
+
+async def stream_study_timeline(syllabus_data: Dict, *, model: Optional[str] = None) -> AsyncIterator[Dict]:
+    """
+    Week-by-week study plans, yielded one by one as the model finishes
+    writing each (same prompt and caches as create_study_timeline)
     
-    try:
-        response = await llm(
-            [
-                {"role": "system", "content": "You create effective study timelines."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=3000,
-            temperature=0.2
-        )
-        
-        result = json.loads(response)
-        return result.get('weekly_plans', [])
+    Args:
+        syllabus_data: Extracted syllabus information
+        model: Override for settings.OPENAI_MODEL
+    """
+    
+    schedule = syllabus_data.get('schedule', [])
+    if not schedule:
+        return
+    
+    buf = ""
+    pos = -1  # index just inside the "weekly_plans" array, once seen
+    async for piece in llm_stream(
+        _timeline_messages(schedule, syllabus_data.get('assessments', [])),
+        max_tokens=3000,
+        temperature=0.2,
+        response_format=_JSON_MODE,
+        model=model,
+    ):
+        buf += piece
+        if pos < 0:
+            bracket = buf.find("[")
+            if bracket < 0:
+                continue
+            pos = bracket + 1
+        plans, pos = take_complete_objects(buf, pos)
+        for plan in plans:
+            if isinstance(plan, dict):
+                yield plan
+
+
+async def create_study_timeline(syllabus_data: Dict) -> List[Dict]:
+    """
+    Creates personalized week-by-week study plan
+    
+    Args:
+        syllabus_data: Extracted syllabus information
         
-    except Exception as e:
-        print(f"Timeline creation error: {e}")
-        return _generate_basic_timeline(schedule)
+    Returns:
+        List of weekly study plans
+    """
+    
+    plans, _ = await _study_timeline(syllabus_data)
+    return plans
+
+
+async def _study_timeline(syllabus_data: Dict) -> Tuple[List[Dict], bool]:
+    """create_study_timeline, plus whether the plan is the LLM's (False when
+    it fell back to _generate_basic_timeline; callers don't cache those)"""
+    schedule = syllabus_data.get('schedule', [])
+    
+    if not schedule:
+        return [], True
+    
+    # First the main model; if that fails, one retry on the cheap fallback
+    # model before dropping to the heuristic timeline
+    models = [None]
+    if settings.FALLBACK_MODEL and settings.FALLBACK_MODEL != settings.OPENAI_MODEL:
+        models.append(settings.FALLBACK_MODEL)
+    for model in models:
+        try:
+            plans = [plan async for plan in stream_study_timeline(syllabus_data, model=model)]
+            if plans:
+                return plans, True
+            
+        except Exception as e:
+            print(f"Timeline creation error: {e}")
+    return _generate_basic_timeline(schedule), False
 
 
 def _generate_basic_timeline(schedule: List[Dict]) -> List[Dict]:
@@ -239,7 +501,7 @@ async def get_this_weeks_tasks(syllabus_data: Dict, current_week: int) -> Dict:
         This week's detailed tasks
     """
     
-    timeline = syllabus_data.get('study_timeline', [])
+    timeline = syllabus_data.get('study_timeline') or ()
     
     # Find this week
     this_week = None
@@ -253,48 +515,66 @@ async def get_this_weeks_tasks(syllabus_data: Dict, current_week: int) -> Dict:
     
     # Check for upcoming assessments
     upcoming_assessments = _get_upcoming_assessments(
-        syllabus_data.get('assessments', []),
+        syllabus_data.get('assessments') or (),
         current_week
     )
     
+    g = this_week.get
     return {
         "week": current_week,
-        "title": this_week.get('week_title', f'Week {current_week}'),
-        "topics": this_week.get('topics_this_week', []),
-        "tasks": this_week.get('what_to_study', []),
-        "estimated_hours": this_week.get('estimated_study_hours', 5),
-        "priority": this_week.get('priority', 'medium'),
-        "why_important": this_week.get('why_important', ''),
-        "milestone": this_week.get('milestone', ''),
+        "title": g('week_title', f'Week {current_week}'),
+        "topics": g('topics_this_week', []),
+        "tasks": g('what_to_study', []),
+        "estimated_hours": g('estimated_study_hours', 5),
+        "priority": g('priority', 'medium'),
+        "why_important": g('why_important', ''),
+        "milestone": g('milestone', ''),
         "upcoming_assessments": upcoming_assessments,
-        "study_methods": this_week.get('study_methods', [])
+        "study_methods": g('study_methods', [])
     }
 
 
-def _get_upcoming_assessments(assessments: List[Dict], current_week: int) -> List[Dict]:
-    """Find assessments coming up in next 2 weeks"""
+def _index_assessments_by_week(assessments: List[Dict]) -> List[Tuple[int, Dict]]:
+    """(week, assessment) for every assessment dated "Week X", sorted by
+    week (stable, so same-week assessments keep syllabus order)"""
     
-    upcoming = []
+    indexed = []
     for assessment in assessments:
-        # Try to parse week from date field
-        date_str = assessment.get('date', '')
-        
-        # Simple check if "Week X" is in date
-        if 'week' in date_str.lower():
-            try:
-                week_num = int(''.join(filter(str.isdigit, date_str)))
-                if current_week <= week_num <= current_week + 2:
-                    upcoming.append({
-                        "name": assessment.get('name', 'Assessment'),
-                        "type": assessment.get('type', 'exam'),
-                        "week": week_num,
-                        "weight": assessment.get('weight_percent', 0),
-                        "topics": assessment.get('topics_covered', [])
-                    })
-            except:
-                pass
+        # "Week X" in the date (only the week's own number, not other digits)
+        m = _WEEK_RE.search(assessment.get('date') or '')
+        if m:
+            indexed.append((int(m.group(1)), assessment))
+    indexed.sort(key=lambda x: x[0])
+    return indexed
+
+
+def _get_upcoming_assessments(
+    assessments: List[Dict],
+    current_week: int,
+    indexed: Optional[List[Tuple[int, Dict]]] = None
+) -> List[Dict]:
+    """
+    Find assessments coming up in next 2 weeks
+
+    indexed: _index_assessments_by_week(assessments), when the caller
+    queries the same syllabus for several weeks
+    """
+    
+    if indexed is None:
+        indexed = _index_assessments_by_week(assessments)
     
-    return upcoming
+    start = bisect_left(indexed, current_week, key=lambda x: x[0])
+    stop = bisect_right(indexed, current_week + 2, key=lambda x: x[0])
+    return [
+        {
+            "name": assessment.get('name', 'Assessment'),
+            "type": assessment.get('type', 'exam'),
+            "week": week_num,
+            "weight": assessment.get('weight_percent', 0),
+            "topics": assessment.get('topics_covered', [])
+        }
+        for week_num, assessment in indexed[start:stop]
+    ]
 
 
 async def generate_exam_prep_plan(
@@ -361,13 +641,14 @@ Return ONLY valid JSON:
     try:
         response = await llm(
             [
-                {"role": "system", "content": "You create effective exam prep plans."},
+                _EXAM_PREP_SYSTEM,
                 {"role": "user", "content": prompt}
             ],
             max_tokens=2000,
-            temperature=0.2
+            temperature=0.2,
+            response_format=_JSON_MODE,
         )
         
-        return json.loads(response)
+        return orjson.loads(response)
     except:
         return {"prep_plan": []}
@@ -0,0 +1,57 @@
+# app/services/tokens.py
+"""Token counting / truncation for LLM prompts (tiktoken, loaded once)."""
+
+from typing import Iterable, List
+
+from ..settings import settings
+
+try:
+    import tiktoken
+    try:
+        _ENCODING = tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+    except KeyError:  # model name tiktoken doesn't know yet
+        _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or its BPE file can't be fetched
+    _ENCODING = None
+
+# Rough chars-per-token when no tokenizer is available
+_CHARS_PER_TOKEN = 4
+# Upper bound for real text; truncate_to_tokens only encodes this much
+_MAX_CHARS_PER_TOKEN = 8
+
+
+def count_tokens(s: str) -> int:
+    if _ENCODING is None:
+        return len(s) // _CHARS_PER_TOKEN + 1
+    return len(_ENCODING.encode(s))
+
+
+def truncate_to_tokens(text: str, n: int) -> str:
+    """First n tokens of text."""
+    if not text:
+        return ""
+    if _ENCODING is None:
+        return text[: n * _CHARS_PER_TOKEN]
+    # Don't tokenize a whole book to keep its first few thousand tokens
+    head = text[: n * _MAX_CHARS_PER_TOKEN]
+    ids = _ENCODING.encode(head)
+    if len(ids) <= n:
+        return head
+    return _ENCODING.decode(ids[:n])
+
+
+def join_within_budget(parts: Iterable[str], sep: str, budget: int) -> str:
+    """Greedily join parts until the token budget is spent (the first part is
+    always kept, truncated to the budget if it alone exceeds it)."""
+    out: List[str] = []
+    used = 0
+    sep_cost = count_tokens(sep) if sep else 0
+    for part in parts:
+        if not out:
+            part = truncate_to_tokens(part, budget)
+        cost = count_tokens(part) + (sep_cost if out else 0)
+        if out and used + cost > budget:
+            break
+        out.append(part)
+        used += cost
+    return sep.join(out)
@@ -24,17 +24,30 @@ All extractors return a shared JSON shape:
       "signals": {"why_matters": "...", "likely_assessed": true/false}
     }
   ],
+  "edges": [
+    {"from": "unit name", "to": "unit name", "type": "prereq|related|part_of|example_of|causes"}
+  ],
   "rejects": ["low-value topics ignored"],
   "coverage_notes": "short note"
 }
+
+Edges are emitted in the same call so concept_engine.update_class_graph
+doesn't need a separate relationship-extraction round-trip.
 """
 
 from __future__ import annotations
 
-import json
-from typing import Any, Dict
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
 
-from .llm import llm
+from ..schemas import UnitsOut
+from ..settings import settings
+from . import semantic_cache
+from .json_utils import safe_json_loads, take_complete_objects
+from .llm import DETERMINISTIC_SEED, json_schema_format, llm, prompt_shard
 
 
 BASE_RULES = """
@@ -52,17 +65,73 @@ Quality requirements for each unit:
 - technical: optional, but include when the course uses formalism.
 - example: concrete and specific (numbers for math; short quote/reference for humanities).
 - common_mistake: something realistic.
+
+Edges:
+- Add up to 15 edges between the units you extracted (use the exact unit names).
+- type must be one of: prereq, related, part_of, example_of, causes.
+- prereq means "from" must be learned before "to". Only include strong relationships.
 """
 
+EDGE_TYPES = {"prereq", "related", "part_of", "example_of", "causes"}
+
+# Excerpts shorter than this (after stripping) can't hold 8+ study units;
+# they get an empty result without an LLM call
+_MIN_EXCERPT_CHARS = 200
+
+# Excerpt windows: one call sees at most _WINDOW_CHARS; longer documents
+# may be split (settings.UNITS_MAX_WINDOWS) into windows overlapping by
+# _WINDOW_OVERLAP so a unit straddling a cut is seen whole at least once
+_WINDOW_CHARS = 7000
+_WINDOW_OVERLAP = 400
+_MULTI_WINDOW_MIN_CHARS = 10000
+_MAX_UNITS = 14
+_MAX_EDGES = 15
+_IMPORTANCE_RANK = {"core": 0, "important": 1, "advanced": 2}
+
+
+# Read-only: normalize_units builds a fresh dict from it
+_PARSE_ERROR: Dict[str, Any] = {"units": [], "edges": [], "rejects": [], "coverage_notes": "parse_error"}
+
+# (field, default, max length) for the free-text unit fields after "name"
+_UNIT_TEXT_FIELDS = (
+    ("unit_type", "term", 40),
+    ("importance", "important", 20),
+    ("difficulty", "medium", 10),
+    ("simple", "", 600),
+    ("detailed", "", 2500),
+    ("technical", "", 1200),
+    ("example", "", 1200),
+    ("common_mistake", "", 600),
+)
+
 
 def _safe_json_loads(s: str) -> Dict[str, Any]:
-    try:
-        return json.loads(s)
-    except Exception:
-        return {"units": [], "rejects": [], "coverage_notes": "parse_error"}
+    data = safe_json_loads(s, default=_PARSE_ERROR)
+    return data if isinstance(data, dict) else _PARSE_ERROR
+
+
+# Reply budget for one extraction. Output size is set by what BASE_RULES asks
+# for (8-14 fully written units plus edges), not by the excerpt length.
+_UNITS_MAX_TOKENS = 2200
+
 
+def _salvage_units(s: str) -> Dict[str, Any]:
+    """Complete unit objects from a reply cut off by max_tokens (the schema
+    puts "units" first, so they are what a truncated reply still has)."""
+    start = s.find('"units"')
+    bracket = s.find("[", start) if start >= 0 else -1
+    if bracket < 0:
+        return _PARSE_ERROR
+    units, _ = take_complete_objects(s, bracket + 1)
+    return {"units": units, "coverage_notes": "truncated"}
 
-def _normalize_units(data: Dict[str, Any]) -> Dict[str, Any]:
+
+def _stripped(value: Any) -> str:
+    """value.strip() for strings; "" for null or anything non-string"""
+    return value.strip() if isinstance(value, str) else ""
+
+
+def normalize_units(data: Dict[str, Any]) -> Dict[str, Any]:
     units = data.get("units")
     if not isinstance(units, list):
         units = []
@@ -70,35 +139,45 @@ def _normalize_units(data: Dict[str, Any]) -> Dict[str, Any]:
     for u in units:
         if not isinstance(u, dict):
             continue
-        name = (u.get("name") or "").strip()
+        g = u.get
+        name = _stripped(g("name"))
         if not name:
             continue
-        out_units.append(
-            {
-                "name": name[:200],
-                "unit_type": (u.get("unit_type") or "term")[:40],
-                "importance": (u.get("importance") or "important")[:20],
-                "difficulty": (u.get("difficulty") or "medium")[:10],
-                "simple": (u.get("simple") or "")[:600],
-                "detailed": (u.get("detailed") or "")[:2500],
-                "technical": (u.get("technical") or "")[:1200],
-                "example": (u.get("example") or "")[:1200],
-                "common_mistake": (u.get("common_mistake") or "")[:600],
-                "signals": u.get("signals") if isinstance(u.get("signals"), dict) else {},
-            }
-        )
+        unit = {"name": name[:200]}
+        for field, default, limit in _UNIT_TEXT_FIELDS:
+            value = g(field) or default
+            unit[field] = value[:limit] if isinstance(value, str) else default
+        signals = g("signals")
+        unit["signals"] = signals if isinstance(signals, dict) else {}
+        out_units.append(unit)
+    edges = data.get("edges")
+    if not isinstance(edges, list):
+        edges = []
+    out_edges = []
+    for e in edges:
+        if not isinstance(e, dict):
+            continue
+        g = e.get
+        src = _stripped(g("from"))
+        dst = _stripped(g("to"))
+        etype = _stripped(g("type"))
+        if not src or not dst or etype not in EDGE_TYPES:
+            continue
+        out_edges.append({"from": src[:200], "to": dst[:200], "type": etype})
+        if len(out_edges) == 15:
+            break
     rejects = data.get("rejects")
     if not isinstance(rejects, list):
         rejects = []
     notes = data.get("coverage_notes")
     if not isinstance(notes, str):
         notes = ""
-    return {"units": out_units, "rejects": rejects[:20], "coverage_notes": notes[:600]}
+    return {"units": out_units, "edges": out_edges, "rejects": rejects[:20], "coverage_notes": notes[:600]}
 
 
-async def extract_quantitative(text: str) -> Dict[str, Any]:
-    prompt = f"""
-You are extracting the highest-value learning units from QUANTITATIVE course material (math, physics, engineering, CS theory, stats).
+# Per-learning-model brief that opens the extraction prompt.
+_MODEL_BRIEFS: Dict[str, str] = {
+    "quantitative": """You are extracting the highest-value learning units from QUANTITATIVE course material (math, physics, engineering, CS theory, stats).
 
 Focus on:
 - procedures students must execute (step sequences)
@@ -106,31 +185,8 @@ Focus on:
 - canonical problem patterns (recognition cues)
 - constraints/assumptions that change the method
 
-Unit types to use: formula, theorem, procedure, algorithm, problem_type, definition.
-
-{BASE_RULES}
-
-Return ONLY JSON in this exact shape:
-{{
-  "units": [ ... ],
-  "rejects": ["..."],
-  "coverage_notes": "..."
-}}
-
-Document excerpt:
-{(text or '')[:7000]}
-"""
-    resp = await llm(
-        [{"role": "system", "content": "You extract study-critical units."}, {"role": "user", "content": prompt}],
-        max_tokens=2200,
-        temperature=0.2,
-    )
-    return _normalize_units(_safe_json_loads(resp))
-
-
-async def extract_conceptual_science(text: str) -> Dict[str, Any]:
-    prompt = f"""
-You are extracting the highest-value learning units from CONCEPTUAL SCIENCE / SOCIAL SCIENCE material (bio, psych, econ theory, sociology).
+Unit types to use: formula, theorem, procedure, algorithm, problem_type, definition.""",
+    "conceptual_science": """You are extracting the highest-value learning units from CONCEPTUAL SCIENCE / SOCIAL SCIENCE material (bio, psych, econ theory, sociology).
 
 Focus on:
 - models/theories and their components
@@ -138,31 +194,8 @@ Focus on:
 - key terms with operational meaning
 - classic study/research patterns if present (method → finding → implication)
 
-Unit types to use: model, theory, mechanism, term, study, process.
-
-{BASE_RULES}
-
-Return ONLY JSON in this exact shape:
-{{
-  "units": [ ... ],
-  "rejects": ["..."],
-  "coverage_notes": "..."
-}}
-
-Document excerpt:
-{(text or '')[:7000]}
-"""
-    resp = await llm(
-        [{"role": "system", "content": "You extract study-critical units."}, {"role": "user", "content": prompt}],
-        max_tokens=2200,
-        temperature=0.2,
-    )
-    return _normalize_units(_safe_json_loads(resp))
-
-
-async def extract_humanities_writing(text: str) -> Dict[str, Any]:
-    prompt = f"""
-You are extracting the highest-value learning units from HUMANITIES / WRITING material (English, literature, philosophy, rhetoric).
+Unit types to use: model, theory, mechanism, term, study, process.""",
+    "humanities_writing": """You are extracting the highest-value learning units from HUMANITIES / WRITING material (English, literature, philosophy, rhetoric).
 
 Focus on:
 - argument structures students must produce (thesis → claims → evidence → analysis)
@@ -170,31 +203,8 @@ Focus on:
 - writing skills/rubrics that affect grades
 - literary/rhetorical devices only if they are actively used/assessed
 
-Unit types to use: skill, argument, theme, device, term, framework.
-
-{BASE_RULES}
-
-Return ONLY JSON in this exact shape:
-{{
-  "units": [ ... ],
-  "rejects": ["..."],
-  "coverage_notes": "..."
-}}
-
-Document excerpt:
-{(text or '')[:7000]}
-"""
-    resp = await llm(
-        [{"role": "system", "content": "You extract study-critical units."}, {"role": "user", "content": prompt}],
-        max_tokens=2200,
-        temperature=0.2,
-    )
-    return _normalize_units(_safe_json_loads(resp))
-
-
-async def extract_historical_timeline(text: str) -> Dict[str, Any]:
-    prompt = f"""
-You are extracting the highest-value learning units from HISTORICAL / TIMELINE-based material (history, gov, law-history).
+Unit types to use: skill, argument, theme, device, term, framework.""",
+    "historical_timeline": """You are extracting the highest-value learning units from HISTORICAL / TIMELINE-based material (history, gov, law-history).
 
 Focus on:
 - events/processes and their causes/effects
@@ -202,31 +212,8 @@ Focus on:
 - key terms/actors that students must connect in essays or exams
 - competing interpretations if explicitly discussed
 
-Unit types to use: event, turning_point, timeline, argument, term.
-
-{BASE_RULES}
-
-Return ONLY JSON in this exact shape:
-{{
-  "units": [ ... ],
-  "rejects": ["..."],
-  "coverage_notes": "..."
-}}
-
-Document excerpt:
-{(text or '')[:7000]}
-"""
-    resp = await llm(
-        [{"role": "system", "content": "You extract study-critical units."}, {"role": "user", "content": prompt}],
-        max_tokens=2200,
-        temperature=0.2,
-    )
-    return _normalize_units(_safe_json_loads(resp))
-
-
-async def extract_applied_case(text: str) -> Dict[str, Any]:
-    prompt = f"""
-You are extracting the highest-value learning units from APPLIED / CASE-BASED material (business, nursing case studies, applied decision-making).
+Unit types to use: event, turning_point, timeline, argument, term.""",
+    "applied_case": """You are extracting the highest-value learning units from APPLIED / CASE-BASED material (business, nursing case studies, applied decision-making).
 
 Focus on:
 - frameworks used to evaluate situations
@@ -234,38 +221,176 @@ Focus on:
 - "if X then Y" heuristics
 - common failure modes (what students forget to consider)
 
-Unit types to use: framework, procedure, decision_rule, rubric, term.
+Unit types to use: framework, procedure, decision_rule, rubric, term.""",
+}
 
-{BASE_RULES}
 
-Return ONLY JSON in this exact shape:
-{{
-  "units": [ ... ],
-  "rejects": ["..."],
-  "coverage_notes": "..."
-}}
+def _model_key(learning_model: str) -> str:
+    key = (learning_model or "").strip().lower()
+    return key if key in _MODEL_BRIEFS else "conceptual_science"
 
-Document excerpt:
-{(text or '')[:7000]}
-"""
+
+def model_brief(learning_model: str) -> str:
+    """Extraction brief for a learning model (conceptual_science if unknown)."""
+    return _MODEL_BRIEFS[_model_key(learning_model)]
+
+
+# Everything but the excerpt is fixed per learning model, so it is rendered
+# once here and sent as the system message: identical leading tokens on
+# every call let the provider reuse its cached prompt prefix. The provider
+# enforces the UnitsOut schema, so the JSON-only rule and the shape
+# example that BASE_RULES callers need are left out.
+_UNIT_RULES = BASE_RULES.replace("- Return ONLY valid JSON. No markdown.\n", "")
+_UNITS_FORMAT = json_schema_format(UnitsOut)
+_SYSTEM_MESSAGES: Dict[str, Dict[str, str]] = {
+    key: {"role": "system", "content": f"You extract study-critical units.\n\n{brief}\n\n{_UNIT_RULES}"}
+    for key, brief in _MODEL_BRIEFS.items()
+}
+
+# Part of the result-cache key, so editing a brief, the rules or the schema
+# retires the cached units made with the old prompt
+_PROMPT_IDS: Dict[str, str] = {
+    key: hashlib.blake2b(
+        (msg["content"] + repr(_UNITS_FORMAT)).encode(), digest_size=8
+    ).hexdigest()
+    for key, msg in _SYSTEM_MESSAGES.items()
+}
+
+
+async def _call_units(key: str, src: str, model: str | None = None) -> Tuple[Dict[str, Any], bool]:
+    """(normalized units, whether the reply parsed whole) from one LLM call"""
     resp = await llm(
-        [{"role": "system", "content": "You extract study-critical units."}, {"role": "user", "content": prompt}],
-        max_tokens=2200,
-        temperature=0.2,
+        [_SYSTEM_MESSAGES[key], {"role": "user", "content": "Document excerpt:\n" + src}],
+        max_tokens=_UNITS_MAX_TOKENS,
+        # structural extraction, not prose: same excerpt -> same units
+        temperature=0,
+        seed=DETERMINISTIC_SEED,
+        response_format=_UNITS_FORMAT,
+        prompt_cache_key=prompt_shard(f"units_{key}"),
+        accept=lambda r: _safe_json_loads(r) is not _PARSE_ERROR,
+        model=model,
     )
-    return _normalize_units(_safe_json_loads(resp))
+    data = _safe_json_loads(resp)
+    complete = data is not _PARSE_ERROR
+    if not complete:
+        data = _salvage_units(resp or "")
+    return normalize_units(data), complete
+
+
+def _windows(text: str, max_windows: int) -> List[str]:
+    """Up to max_windows overlapping _WINDOW_CHARS slices from the start of text"""
+    if max_windows <= 1 or len(text) <= _MULTI_WINDOW_MIN_CHARS:
+        return [text[:_WINDOW_CHARS]]
+    step = _WINDOW_CHARS - _WINDOW_OVERLAP
+    out = []
+    for start in range(0, len(text), step):
+        out.append(text[start : start + _WINDOW_CHARS])
+        if len(out) == max_windows or start + _WINDOW_CHARS >= len(text):
+            break
+    return out
+
+
+def _merge_windows(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One normalized result from per-window results: units deduped by
+    name (keeping the higher-importance copy), then capped like a single
+    extraction; edges kept only between surviving units."""
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for r in results:
+        for u in r["units"]:
+            k = u["name"].lower()
+            seen = by_name.get(k)
+            if seen is None or _IMPORTANCE_RANK.get(u["importance"], 1) < _IMPORTANCE_RANK.get(seen["importance"], 1):
+                by_name[k] = u
+    # stable: first-seen order within each importance level
+    units = sorted(by_name.values(), key=lambda u: _IMPORTANCE_RANK.get(u["importance"], 1))[:_MAX_UNITS]
+    kept = {u["name"].lower() for u in units}
+
+    edges: List[Dict[str, str]] = []
+    seen_edges = set()
+    rejects: List[Any] = []
+    notes = []
+    for r in results:
+        for e in r["edges"]:
+            ek = (e["from"].lower(), e["to"].lower(), e["type"])
+            if ek[0] in kept and ek[1] in kept and ek not in seen_edges and len(edges) < _MAX_EDGES:
+                seen_edges.add(ek)
+                edges.append(e)
+        rejects.extend(r["rejects"])
+        if r["coverage_notes"]:
+            notes.append(r["coverage_notes"])
+    return {"units": units, "edges": edges, "rejects": rejects[:20], "coverage_notes": " ".join(notes)[:600]}
+
+
+async def _units_for_excerpt(key: str, src: str) -> Tuple[Dict[str, Any], bool]:
+    """_call_units, first on settings.UNITS_CASCADE_MODEL when one is set"""
+    small = settings.UNITS_CASCADE_MODEL
+    if small and small != settings.OPENAI_MODEL:
+        out, complete = await _call_units(key, src, small)
+        if complete and len(out["units"]) >= settings.UNITS_CASCADE_MIN_UNITS:
+            return out, complete
+        # logged so the threshold/prompt can be tuned to keep this rare
+        logger.info(f"[units] escalating {key} from {small}: {len(out['units'])} units, complete={complete}")
+    return await _call_units(key, src)
+
+
+async def _extract(learning_model: str, text: str) -> Dict[str, Any]:
+    key = _model_key(learning_model)
+    text = text or ""
+    windows = _windows(text, settings.UNITS_MAX_WINDOWS)
+    if len(windows[0].strip()) < _MIN_EXCERPT_CHARS:
+        logger.info(f"[units] skipped {key}: excerpt under {_MIN_EXCERPT_CHARS} chars")
+        return {"units": [], "edges": [], "rejects": [], "coverage_notes": "input_too_short"}
+
+    # cache on the span the windows cover
+    src = text[: (len(windows) - 1) * (_WINDOW_CHARS - _WINDOW_OVERLAP) + len(windows[-1])]
+    params: Dict[str, Any] = {"learning_model": key, "prompt": _PROMPT_IDS[key]}
+    if len(windows) > 1:
+        params["windows"] = len(windows)
+    hit = semantic_cache.lookup("units", src, **params)
+    if hit is not None:
+        return hit
+
+    if len(windows) == 1:
+        out, complete = await _units_for_excerpt(key, src)
+    else:
+        results = await asyncio.gather(*(_units_for_excerpt(key, w) for w in windows), return_exceptions=True)
+        ok = [r for r in results if not isinstance(r, BaseException)]
+        if not ok:
+            raise results[0]
+        out = _merge_windows([r[0] for r in ok])
+        complete = len(ok) == len(results) and all(r[1] for r in ok)
+    # a salvaged partial result isn't cached, so a re-upload retries
+    if out["units"] and complete:
+        semantic_cache.store("units", src, out, **params)
+    return out
 
 
 async def extract_by_learning_model(learning_model: str, text: str) -> Dict[str, Any]:
-    learning_model = (learning_model or "").strip().lower()
-    if learning_model == "quantitative":
-        return await extract_quantitative(text)
-    if learning_model == "conceptual_science":
-        return await extract_conceptual_science(text)
-    if learning_model == "humanities_writing":
-        return await extract_humanities_writing(text)
-    if learning_model == "historical_timeline":
-        return await extract_historical_timeline(text)
-    if learning_model == "applied_case":
-        return await extract_applied_case(text)
-    return await extract_conceptual_science(text)
+    """Units for text, extracted with the learning model's brief
+    (conceptual_science if unknown)."""
+    return await _extract(learning_model, text)
+
+
+async def extract_many(jobs: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """extract_by_learning_model over (learning_model, text) jobs concurrently
+    (at most settings.CONCURRENCY jobs in flight).
+
+    One result per job, in order; a failed job gets an empty result.
+    """
+    sem = asyncio.Semaphore(settings.CONCURRENCY)
+
+    async def _limited(learning_model: str, text: str) -> Dict[str, Any]:
+        async with sem:
+            return await _extract(learning_model, text)
+
+    results = await asyncio.gather(
+        *(_limited(learning_model, text) for learning_model, text in jobs),
+        return_exceptions=True,
+    )
+    out = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning(f"Batch unit extraction error: {result}")
+            result = {"units": [], "edges": [], "rejects": [], "coverage_notes": "extraction_error"}
+        out.append(result)
+    return out
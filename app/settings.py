@@ -6,12 +6,34 @@ class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str | None = None
     OPENAI_MODEL: str = "gpt-4o-mini"
+    # Small/cheap model for document classification (None = OPENAI_MODEL)
+    CLASSIFIER_MODEL: str | None = "gpt-4o-mini"
+    # Small/cheap model for low-stakes second attempts: JSON repair retries
+    # and the study-timeline retry (None = the first attempt's model)
+    FALLBACK_MODEL: str | None = "gpt-4o-mini"
+    # Unit extraction cascade: try this cheaper model first and escalate to
+    # OPENAI_MODEL when it returns fewer than UNITS_CASCADE_MIN_UNITS units
+    # or unparsable output (None = no cascade)
+    UNITS_CASCADE_MODEL: str | None = None
+    UNITS_CASCADE_MIN_UNITS: int = 5
     MOCK_MODE: bool = False
 
+    # OpenAI HTTP connection pool (shared by all LLM calls)
+    OPENAI_HTTP_MAX_CONNECTIONS: int = 100
+    OPENAI_HTTP_MAX_KEEPALIVE: int = 50
+    # Idle time before a pooled connection is dropped (httpx default is 5s,
+    # shorter than the gaps between an upload's LLM calls)
+    OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    OPENAI_HTTP_TIMEOUT_SECONDS: float = 60.0
+
     # Performance knobs
     MAX_PAGES: int = 30
     CONCURRENCY: int = 4
 
+    # PDFs at least this large are parsed in a process pool instead of a thread
+    PDF_PROCESS_POOL_MIN_MB: int = 5
+    PDF_PROCESS_WORKERS: int = 2
+
     # Safety/abuse knobs
     MAX_UPLOAD_MB: int = 25
     RATE_LIMIT: str = "30/minute"
@@ -24,6 +46,25 @@ class Settings(BaseSettings):
     # Optional extra frontend
     FRONTEND_ORIGIN: str | None = None
 
+    # LLM response cache (cache/llm): default TTL per entry; callers may
+    # override it per call (None = never expires)
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    # Part of every LLM and semantic-cache key; change it to invalidate all entries
+    LLM_CACHE_VERSION: str = "v1"
+
+    # Upload pipeline: one combined LLM call for extraction + summary + cards
+    # instead of separate calls (off until quality is compared)
+    ENABLE_COMBINED_CALL: bool = False
+
+    # Knowledge graph: run the mode router concurrently with a speculative
+    # "mixed"-mode extraction (costs a second extraction when they disagree)
+    KG_SPECULATIVE_ROUTING: bool = False
+
+    # Unit extraction on documents over 10k chars: extract this many
+    # overlapping 7k-char windows in parallel and merge the units
+    # (1 = first window only; each extra window is another LLM call)
+    UNITS_MAX_WINDOWS: int = 1
+
     # Supabase
     SUPABASE_URL: str | None = None
     SUPABASE_SERVICE_ROLE_KEY: str | None = None
@@ -33,6 +74,9 @@ class Settings(BaseSettings):
     SUPABASE_STORAGE_BUCKET: str = "documents"
     SUPABASE_SIGNED_URL_TTL_SECONDS: int = 600
 
+    # Supabase HTTP request timeout (postgrest and storage)
+    SUPABASE_HTTP_TIMEOUT_SECONDS: float = 30.0
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -0,0 +1,14 @@
+-- Documents mentioning each concept, counted from concept_doc_mentions (the
+-- source of truth; concepts.document_frequency is a denormalized counter).
+-- Used by app/services/graph_intelligence.recalc_importance.
+
+create or replace function public.concept_doc_frequency(_class_id uuid)
+returns table (concept_id uuid, df int)
+language sql
+stable
+as $$
+    select concept_id, count(distinct document_id)::int as df
+    from public.concept_doc_mentions
+    where class_id = _class_id
+    group by concept_id;
+$$;
@@ -0,0 +1,17 @@
+-- "related" edges are stored once per concept pair, in canonical direction
+-- (from_concept_id < to_concept_id); see graph_intelligence._reinforce_related_edges.
+-- This view adds the mirrored row, so every reader sees a related edge from
+-- both endpoints (as when both directions were stored). Run
+-- fold_related_edges.sql once to merge rows written before that change.
+-- Writes and by-id lookups go to concept_edges itself.
+
+create or replace view public.concept_edges_bidirected as
+    select id, class_id, from_concept_id, to_concept_id, type, label, weight,
+           confidence, evidence, definition, example, application, created_at, updated_at
+    from public.concept_edges
+    union all
+    select id, class_id, to_concept_id as from_concept_id, from_concept_id as to_concept_id,
+           type, label, weight, confidence, evidence, definition, example, application,
+           created_at, updated_at
+    from public.concept_edges
+    where type = 'related';
@@ -0,0 +1,21 @@
+-- Weighted degree per concept (sum of weights of edges touching it), used by
+-- app/services/graph_intelligence.recalc_importance. Reads the
+-- concept_edges_bidirected view, so a related edge counts from both sides.
+
+create or replace function public.concept_weighted_degree(_class_id uuid)
+returns table (concept_id uuid, degree float8)
+language sql
+stable
+as $$
+    select cid, sum(weight)::float8
+    from (
+        select from_concept_id as cid, weight
+        from public.concept_edges_bidirected
+        where class_id = _class_id
+        union all
+        select to_concept_id, weight
+        from public.concept_edges_bidirected
+        where class_id = _class_id
+    ) t
+    group by cid;
+$$;
@@ -0,0 +1,45 @@
+-- One-off migration: "related" edges used to be written in both directions
+-- and are now stored once per pair as (least, greatest) id; see
+-- graph_intelligence._reinforce_related_edges. Fold every legacy reverse row
+-- (from_concept_id > to_concept_id) into its canonical twin, or flip it when
+-- there is none. Readers go through concept_edges_bidirected, which would
+-- otherwise count old pairs twice.
+--
+-- Both legacy rows were reinforced together, and only the canonical one
+-- since, so the pair's weight is the larger of the two.
+
+begin;
+
+update public.concept_edges c
+set weight      = greatest(c.weight, r.weight),
+    confidence  = greatest(c.confidence, r.confidence),
+    label       = coalesce(c.label, r.label),
+    evidence    = coalesce(c.evidence, r.evidence),
+    definition  = coalesce(c.definition, r.definition),
+    example     = coalesce(c.example, r.example),
+    application = coalesce(c.application, r.application),
+    updated_at  = greatest(c.updated_at, r.updated_at)
+from public.concept_edges r
+where c.type = 'related'
+  and r.type = 'related'
+  and r.class_id = c.class_id
+  and r.from_concept_id = c.to_concept_id
+  and r.to_concept_id = c.from_concept_id
+  and c.from_concept_id < c.to_concept_id;
+
+delete from public.concept_edges r
+using public.concept_edges c
+where r.type = 'related'
+  and c.type = 'related'
+  and c.class_id = r.class_id
+  and c.from_concept_id = r.to_concept_id
+  and c.to_concept_id = r.from_concept_id
+  and r.from_concept_id > r.to_concept_id;
+
+update public.concept_edges
+set from_concept_id = to_concept_id,
+    to_concept_id = from_concept_id
+where type = 'related'
+  and from_concept_id > to_concept_id;
+
+commit;
@@ -0,0 +1,76 @@
+-- Whole post-upload graph maintenance in one round-trip, used by
+-- app/services/graph_intelligence.reinforce_graph_after_upload (the Python
+-- steps there are the fallback and the reference semantics):
+--   1) reinforce "related" co-occurrence edges (canonical direction, capped;
+--      _concept_ids arrives deduped and most-important first)
+--   2) prune weak "related" edges
+--   3) recalc importance from document frequency + weighted degree
+-- Requires upsert_edges_batch.sql (unique index), concept_weighted_degree.sql
+-- and concept_doc_frequency.sql.
+
+create or replace function public.reinforce_graph_after_upload(
+    _class_id uuid,
+    _concept_ids uuid[],
+    _max_related_edges int default 25,
+    _prune_edge_weight_lt int default 2,
+    _degree_scale float8 default 25.0,
+    _doc_weight float8 default 0.60,
+    _degree_weight float8 default 0.40
+)
+returns void
+language plpgsql
+as $$
+begin
+    -- 1) co-occurrence: first _max_related_edges pairs in array order
+    insert into public.concept_edges
+        (id, class_id, from_concept_id, to_concept_id, type, weight, created_at, updated_at)
+    select
+        gen_random_uuid(),
+        _class_id,
+        least(a.cid, b.cid),
+        greatest(a.cid, b.cid),
+        'related',
+        1,
+        now(),
+        now()
+    from unnest(_concept_ids) with ordinality as a(cid, ord)
+    join unnest(_concept_ids) with ordinality as b(cid, ord) on b.ord > a.ord
+    order by a.ord, b.ord
+    limit _max_related_edges
+    on conflict (class_id, from_concept_id, to_concept_id, type)
+    do update set
+        weight = public.concept_edges.weight + excluded.weight,
+        updated_at = now();
+
+    -- 2) prune weak related edges
+    delete from public.concept_edges
+    where class_id = _class_id
+      and type = 'related'
+      and weight < _prune_edge_weight_lt;
+
+    -- 3) importance = doc_weight * df/max_df + degree_weight * min(1, degree/scale)
+    with df as (
+        select c.id, coalesce(f.df, 0) as df
+        from public.concepts c
+        left join public.concept_doc_frequency(_class_id) f on f.concept_id = c.id
+        where c.class_id = _class_id
+          and c.merged_into is null
+    ),
+    mx as (
+        select max(df) as max_df from df
+    ),
+    deg as (
+        select concept_id, degree from public.concept_weighted_degree(_class_id)
+    )
+    update public.concepts c
+    set importance_score = round((
+            _doc_weight * coalesce(d.df::float8 / nullif(mx.max_df, 0), 0)
+            + _degree_weight * least(1.0, coalesce(deg.degree, 0) / _degree_scale)
+        )::numeric, 4),
+        updated_at = now()
+    from df d
+    cross join mx
+    left join deg on deg.concept_id = d.id
+    where c.id = d.id;
+end;
+$$;
@@ -0,0 +1,32 @@
+-- Batched edge upsert used by app/services/graph_intelligence.upsert_edges_batch.
+--
+-- rows: jsonb array of
+--   {"class_id", "from_concept_id", "to_concept_id", "type", "weight"}
+-- where "weight" is the amount to ADD to an existing edge (or the initial
+-- weight for a new one). Callers must not send the same
+-- (class_id, from_concept_id, to_concept_id, type) twice in one batch.
+
+create unique index if not exists concept_edges_class_from_to_type_key
+    on public.concept_edges (class_id, from_concept_id, to_concept_id, type);
+
+create or replace function public.upsert_edges_batch(rows jsonb)
+returns void
+language sql
+as $$
+    insert into public.concept_edges
+        (id, class_id, from_concept_id, to_concept_id, type, weight, created_at, updated_at)
+    select
+        gen_random_uuid(),
+        r.class_id,
+        r.from_concept_id,
+        r.to_concept_id,
+        r.type,
+        coalesce(r.weight, 1),
+        now(),
+        now()
+    from jsonb_populate_recordset(null::public.concept_edges, rows) as r
+    on conflict (class_id, from_concept_id, to_concept_id, type)
+    do update set
+        weight = public.concept_edges.weight + excluded.weight,
+        updated_at = now();
+$$;